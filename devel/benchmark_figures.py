@@ -0,0 +1,50 @@
+"""
+Compare the time taken to render and save many scatter plots with the same layout, making a new
+figure for each plot versus reusing one figure template (SysTest.reuse_figures = True).
+
+Usage: python benchmark_figures.py [n_plots] [n_points]   (defaults: 1000 plots of 1000 points)
+"""
+import io
+import sys
+import time
+import numpy
+try:
+    import stile
+except ImportError:
+    sys.path.append('..')
+    import stile
+
+
+def render(sys_test, catalogs):
+    t0 = time.time()
+    for catalog in catalogs:
+        fig = sys_test(catalog)
+        fig.savefig(io.BytesIO(), format='png')
+    return time.time()-t0
+
+
+def main():
+    n_plots = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000
+    n_points = int(float(sys.argv[2])) if len(sys.argv) > 2 else 1000
+    fields = ['g1', 'g1_err', 'psf_g1']
+    numpy.random.seed(42)
+    catalogs = []
+    for i in range(n_plots):
+        catalog = numpy.zeros(n_points, dtype=[(field, float) for field in fields])
+        for field in fields:
+            catalog[field] = numpy.random.randn(n_points)
+        catalog['g1_err'] = numpy.abs(catalog['g1_err'])
+        catalogs.append(catalog)
+
+    sys_test = stile.ScatterPlotSysTest('StarVsPSFG1')
+    t_new = render(sys_test, catalogs)
+    sys_test.reuse_figures = True
+    t_reuse = render(sys_test, catalogs)
+    sys_test.closeFigures()
+    print("%i plots x %i points" % (n_plots, n_points))
+    print("New figure per plot:  %.2f s" % t_new)
+    print("Reused figure:        %.2f s" % t_reuse)
+    print("Speedup: %.1fx" % (t_new/t_reuse))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Time ``import stile`` in fresh interpreters, compared with ``import numpy`` (which Stile always
+needs), and check that the optional heavy dependencies (matplotlib, TreeCorr, scipy and the FITS
+readers) are not imported until they are used.
+
+Usage: python benchmark_import.py [n_runs] [max_extra_ms]   (defaults: 20 runs; if max_extra_ms is
+given, exit with an error when the median extra time taken by Stile over numpy is larger, so this
+can be used as a regression check in batch jobs)
+"""
+import os
+import subprocess
+import sys
+
+heavy_modules = ['matplotlib', 'treecorr', 'scipy', 'pyfits', 'astropy']
+
+timing_code = """
+import time
+t0 = time.time()
+import %s
+print(time.time()-t0)
+"""
+
+check_code = """
+import sys
+import stile
+print(' '.join(m for m in %r if m in sys.modules))
+"""
+
+
+def timeImport(module, n_runs, env):
+    times = []
+    for i in range(n_runs):
+        output = subprocess.check_output([sys.executable, '-c', timing_code % module], env=env)
+        times.append(float(output))
+    return sorted(times)[n_runs//2]
+
+
+def main():
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    max_extra_ms = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+
+    t_numpy = timeImport('numpy', n_runs, env)
+    t_stile = timeImport('stile', n_runs, env)
+    imported = subprocess.check_output([sys.executable, '-c', check_code % heavy_modules],
+                                       env=env).decode().split()
+    print("Median of %i runs" % n_runs)
+    print("import numpy: %.1f ms" % (1000*t_numpy))
+    print("import stile: %.1f ms" % (1000*t_stile))
+    print("Modules imported by stile that should be loaded on first use: %s" %
+          (', '.join(imported) if imported else 'none'))
+    if imported:
+        sys.exit(1)
+    if max_extra_ms is not None and 1000*(t_stile-t_numpy) > max_extra_ms:
+        print("import stile took more than %.1f ms longer than import numpy" % max_extra_ms)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare the time taken to compute StatSysTest statistics for many fields of a catalog, calling the
+StatSysTest once per field versus a single call to StatSysTest.multiFieldStats.
+
+Usage: python benchmark_stats.py [n_rows] [n_fields]   (defaults: 10^7 rows, 20 fields; the
+catalog alone then takes 1.6 GB of memory)
+"""
+import sys
+import time
+import numpy
+try:
+    import stile
+except ImportError:
+    sys.path.append('..')
+    import stile
+
+
+def main():
+    n_rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**7
+    n_fields = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    fields = ['col%i'%i for i in range(n_fields)]
+    catalog = numpy.zeros(n_rows, dtype=[(field, float) for field in fields])
+    numpy.random.seed(42)
+    for field in fields:
+        catalog[field] = numpy.random.randn(n_rows)
+
+    stat = stile.StatSysTest()
+    t0 = time.time()
+    per_field = [stat(catalog, field=field) for field in fields]
+    t_per_field = time.time()-t0
+    t0 = time.time()
+    table = stat.multiFieldStats(catalog, fields=fields)
+    t_multi = time.time()-t0
+
+    for result, row in zip(per_field, table):
+        numpy.testing.assert_allclose(result.values, row['values'])
+        numpy.testing.assert_allclose(result.mad, row['mad'])
+        numpy.testing.assert_allclose(result.mean, row['mean'], atol=1.E-12)
+    print("%i fields x %i rows" % (n_fields, n_rows))
+    print("StatSysTest per field:       %.2f s" % t_per_field)
+    print("StatSysTest.multiFieldStats: %.2f s" % t_multi)
+    print("Speedup: %.1fx" % (t_per_field/t_multi))
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,39 @@
 from .file_io import (ReadFITSImage, ReadFITSTable, ReadASCIITable, ReadTable, WriteTable,
                       WriteASCIITable, WriteFITSTable)
 from .stile_utils import Parser, FormatArray, fieldNames
-from .binning import BinList, BinStep, BinFunction, ExpandBinList
-from . import treecorr_utils
-from .treecorr_utils import ReadTreeCorrResultsFile
+from .binning import BinList, BinStep, BinFunction, BinKDTree, ExpandBinList
+from .groupby import GroupBy
+from .plot_queue import PlotSpec, PlotQueue
+from .result_store import ResultStore
+from .manifest import RunManifest
 from .data_handler import DataHandler
-from .sys_tests import (StatSysTest, CorrelationFunctionSysTest, ScatterPlotSysTest,
-                        WhiskerPlotSysTest, HistogramSysTest)
+
+# The systematics tests and the TreeCorr utilities (and, through them, matplotlib, scipy and
+# TreeCorr) are only imported when one of these names is first used, so that scripts which only
+# need the file readers or binning start quickly.  Each name maps to the module which defines it.
+_lazy_registry = {'sys_tests': None,
+                  'treecorr_utils': None,
+                  'ReadTreeCorrResultsFile': 'treecorr_utils',
+                  'StatSysTest': 'sys_tests',
+                  'CorrelationFunctionSysTest': 'sys_tests',
+                  'ScatterPlotSysTest': 'sys_tests',
+                  'WhiskerPlotSysTest': 'sys_tests',
+                  'HistogramSysTest': 'sys_tests',
+                  'FocalPlaneMapSysTest': 'sys_tests'}
+
+
+def __getattr__(name):
+    if name not in _lazy_registry:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    import importlib
+    module_name = _lazy_registry[name]
+    if module_name is None:
+        value = importlib.import_module('.'+name, __name__)
+    else:
+        value = getattr(importlib.import_module('.'+module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_registry))
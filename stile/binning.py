@@ -3,6 +3,7 @@ Contains definitions of Bin* classes that generate binning schemes and the Singl
 objects they create which can be applied to data to limit it to the bin in question.
 """
 #TODO: binning for images
+import weakref
 import numpy
 
 
@@ -274,10 +275,15 @@ class SingleFunctionBin(SingleBin):
             self.long_name = self.short_name
         self.function = function
         self.n = n
-        if returns_bools:
-            self.__call__ = self._call_bool
+        self.returns_bools = returns_bools
+
+    def __call__(self, data):
+        # Python 3 looks up __call__ on the class rather than the instance, so we dispatch here
+        # instead of rebinding the attribute at initialization.
+        if self.returns_bools:
+            return self._call_bool(data)
         else:
-            self.__call__ = self._call_int
+            return self._call_int(data)
 
     def _call_int(self, data):
         """
@@ -302,6 +308,176 @@ class SingleFunctionBin(SingleBin):
         return data[self.function(data, self.n)]
 
 
+class BinKDTree(BinFunction):
+    """
+    An object which returns bin definitions (a list of :class:`SingleFunctionBin`\s) that divide a
+    2-d space, such as ``(x, y)`` on the focal plane or ``(ra, dec)`` on the sky, into ``n_bins``
+    rectangular cells containing (nearly) equal numbers of objects.  Unlike a :class:`BinStep`
+    grid, every cell is populated no matter how the objects are distributed.
+
+    The cells are defined by a kd-tree: starting from the full data set, each node is split at the
+    appropriate quantile along whichever axis has the larger extent, sending ``k//2`` of the ``k``
+    cells it must produce to one side and the rest to the other.  Each split is a single
+    :func:`numpy.argpartition` of the objects in that node.  The outermost cells extend to infinity,
+    so any object with finite coordinates lands in some cell; rows with ``NaN`` or infinite
+    coordinates are assigned to bin ``-1`` (that is, to no bin).
+
+    The cells are fixed once :func:`fit` has been called (or ``data`` has been passed at
+    initialization), so the same object can be used to bin other data sets--for example, every
+    visit of a survey can be binned with cells defined from the first visit or from a coadd.
+    Looking up the cell for ``N`` objects descends the tree for all of them at once, which costs
+    ``O(N log n_bins)``.
+
+    This is a child class of :class:`BinFunction`, so calling it returns a list of
+    :class:`SingleFunctionBin`\s, and it can be mixed with the other ``Bin*`` objects in
+    :func:`ExpandBinList`.  The method :func:`assign` returns the bin number of every row directly.
+    The :class:`SingleFunctionBin`\s share the bin numbers of the last data array they were called
+    with, so selecting all ``n_bins`` bins of an array descends the tree only once; if the
+    coordinates of that array are then changed in place, call :func:`assign` on it to update them.
+
+    :param x_field:   Data field to use as the first coordinate, such as ``x`` or ``ra``.
+    :param y_field:   Data field to use as the second coordinate, such as ``y`` or ``dec``.
+    :param n_bins:    The number of cells to create.
+    :param data:      A data array containing ``x_field`` and ``y_field`` from which to define the
+                      cells.  If None, :func:`fit` must be called before the object is used.
+                      [default: None]
+    :returns:         A list of :class:`SingleFunctionBin` objects determined by the input
+                      criteria.
+    """
+
+    def __init__(self, x_field, y_field, n_bins, data=None):
+        if not isinstance(x_field, str) or not isinstance(y_field, str):
+            raise TypeError('Field descriptions must be strings. Passed values: '+str(x_field)+
+                            ', '+str(y_field))
+        if int(n_bins) != n_bins or n_bins < 1:
+            raise ValueError('n_bins must be a positive integer. Given argument: %s'%n_bins)
+        self.x_field = x_field
+        self.y_field = y_field
+        self.n_bins = int(n_bins)
+        self.function = self._cachedAssign
+        self.returns_bools = False
+        self.split_dim = None
+        self._assigned_data = None
+        self._assignments = None
+        if data is not None:
+            self.fit(data)
+
+    def _getCoords(self, data):
+        x = numpy.asarray(data[self.x_field], dtype=float).reshape(-1)
+        y = numpy.asarray(data[self.y_field], dtype=float).reshape(-1)
+        return x, y, numpy.logical_and(numpy.isfinite(x), numpy.isfinite(y))
+
+    def fit(self, data):
+        """
+        Define the cells from the objects in ``data``.  Any previously defined cells are replaced.
+
+        :param data:   A data array containing the fields ``x_field`` and ``y_field``.
+        :returns:      This object, so that ``BinKDTree(...).fit(data)`` can be used inline.
+        """
+        self._assigned_data = None
+        self._assignments = None
+        x, y, good = self._getCoords(data)
+        coords = [x[good], y[good]]
+        n_points = len(coords[0])
+        if n_points < self.n_bins:
+            raise ValueError('Cannot make %i equal-count cells from %i objects with finite '
+                             'coordinates'%(self.n_bins, n_points))
+        # The tree is stored as flat arrays indexed by node number.  A binary tree with n_bins
+        # leaves has 2*n_bins-1 nodes; leaf_id is -1 for internal nodes.
+        n_nodes = 2*self.n_bins-1
+        self.split_dim = numpy.full(n_nodes, -1, dtype=int)
+        self.split_value = numpy.zeros(n_nodes)
+        self.left = numpy.full(n_nodes, -1, dtype=int)
+        self.right = numpy.full(n_nodes, -1, dtype=int)
+        self.leaf_id = numpy.full(n_nodes, -1, dtype=int)
+        # Bounds of each cell as (xmin, xmax, ymin, ymax)
+        self.bounds = numpy.zeros((self.n_bins, 4))
+        # Each node owns a contiguous slice [start, end) of the "order" array, which we permute in
+        # place as we split, so no per-node copies of the coordinates are kept.
+        order = numpy.arange(n_points)
+        next_node = 1
+        next_leaf = 0
+        # Depth-first, left before right, so that leaf numbers run contiguously across the plane.
+        stack = [(0, 0, n_points, self.n_bins, [-numpy.inf, numpy.inf, -numpy.inf, numpy.inf])]
+        while stack:
+            node, start, end, k, bounds = stack.pop()
+            if k == 1:
+                self.leaf_id[node] = next_leaf
+                self.bounds[next_leaf] = bounds
+                next_leaf += 1
+                continue
+            members = order[start:end]
+            extents = [numpy.ptp(c[members]) for c in coords]
+            dim = 0 if extents[0] >= extents[1] else 1
+            values = coords[dim][members]
+            k_left = k//2
+            n_left = int(round(float(end-start)*k_left/k))
+            # Make sure each side has at least as many objects as cells.
+            n_left = min(max(n_left, k_left), end-start-(k-k_left))
+            partition = numpy.argpartition(values, n_left)
+            order[start:end] = members[partition]
+            low_max = numpy.max(values[partition[:n_left]])
+            high_min = values[partition[n_left]]
+            # Split halfway between the two sides so data sets other than the one used to fit the
+            # tree are not biased toward either cell.
+            split = 0.5*(low_max+high_min) if high_min > low_max else high_min
+            self.split_dim[node] = dim
+            self.split_value[node] = split
+            self.left[node] = next_node
+            self.right[node] = next_node+1
+            left_bounds = list(bounds)
+            right_bounds = list(bounds)
+            left_bounds[2*dim+1] = split
+            right_bounds[2*dim] = split
+            stack.append((next_node+1, start+n_left, end, k-k_left, right_bounds))
+            stack.append((next_node, start, start+n_left, k_left, left_bounds))
+            next_node += 2
+        return self
+
+    def assign(self, data):
+        """
+        Return the bin number of each row of ``data``: an integer array with values from ``0`` to
+        ``n_bins-1``, or ``-1`` for rows with non-finite coordinates.
+
+        :param data:   A data array containing the fields ``x_field`` and ``y_field``.
+        :returns:      A NumPy array of ``int``\s with the same length as ``data``.
+        """
+        if self.split_dim is None:
+            raise RuntimeError('BinKDTree cells have not been defined; call fit() first')
+        x, y, good = self._getCoords(data)
+        node = numpy.zeros(len(x), dtype=int)
+        active = numpy.where(good)[0]
+        if self.leaf_id[0] >= 0:
+            active = active[:0]
+        # Walk every object down one level of the tree per iteration.
+        while len(active):
+            this_node = node[active]
+            dim = self.split_dim[this_node]
+            coord = numpy.where(dim == 0, x[active], y[active])
+            this_node = numpy.where(coord < self.split_value[this_node],
+                                    self.left[this_node], self.right[this_node])
+            node[active] = this_node
+            active = active[self.leaf_id[this_node] < 0]
+        result = self.leaf_id[node]
+        result[~good] = -1
+        try:
+            self._assigned_data = weakref.ref(data)
+            self._assignments = result.copy()
+            self._assignments.flags.writeable = False
+        except TypeError:
+            # Data that can't be weakly referenced (such as a dict of columns) isn't cached.
+            self._assigned_data = None
+            self._assignments = None
+        return result
+
+    def _cachedAssign(self, data):
+        # The function for the SingleFunctionBins: the bin numbers from the last call to assign()
+        # if it was made with this same data array, else assign(data).
+        if self._assigned_data is not None and self._assigned_data() is data:
+            return self._assignments
+        return self.assign(data)
+
+
 def ExpandBinList(bin_list):
     """
     If the user has indicated more than one :class:`Bin*` object, we assume that they want to do the
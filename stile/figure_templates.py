@@ -0,0 +1,87 @@
+"""
+figure_templates.py: Figures for Stile plots which are not tracked by pyplot, and templates which
+reuse one laid-out figure for a series of plots of the same kind.
+
+Figures made with :func:`matplotlib.pyplot.figure` stay open (and in memory) until they are
+explicitly closed, so a long run that makes one plot per CCD grows without bound.  The figures made
+here belong only to the objects that refer to them, and are freed when they are no longer used.
+"""
+
+
+def NewFigure(figsize=None):
+    """
+    Return a new :class:`matplotlib.figure.Figure` with an Agg canvas attached, so it can be drawn
+    and saved with :func:`.savefig`, but which is not registered with pyplot.
+
+    :param figsize: Size of the figure ``(x, y)`` in units of inches.
+                    [default: None, meaning use the default value of matplotlib]
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+class FigureTemplate(object):
+    """
+    A figure with a column of ``nrows`` axes (and, once :func:`colorbar` has been called,
+    colorbars), which can be reused for a series of plots with the same layout.
+
+    :func:`reset` removes the plotted data, legends, labels and colorbar labels from the previous
+    plot but keeps the figure, the axes and their scales, and the colorbar axes, so the next plot
+    only has to add its own artists.  This is considerably faster than making a new figure for each
+    plot, and the memory used stays the same however many plots are made.
+
+    :param figsize: Size of the figure ``(x, y)`` in units of inches.
+                    [default: None, meaning use the default value of matplotlib]
+    :param nrows:   The number of (vertically stacked) axes. [default: 1]
+    :param sharex:  Whether the axes share their x-axis. [default: False]
+    """
+    def __init__(self, figsize=None, nrows=1, sharex=False):
+        self.figure = NewFigure(figsize)
+        self.axes = []
+        for i in range(nrows):
+            share = self.axes[0] if sharex and self.axes else None
+            self.axes.append(self.figure.add_subplot(nrows, 1, i+1, sharex=share))
+        self.colorbars = {}
+        # The number of plots made with this template, including the current one.
+        self.uses = 1
+
+    def reset(self):
+        """Remove the previous plot from the figure, ready for the next one."""
+        for ax in self.axes:
+            for artist in (list(ax.lines)+list(ax.collections)+list(ax.images)+list(ax.patches)+
+                           list(ax.texts)+list(ax.artists)):
+                artist.remove()
+            del ax.containers[:]
+            if ax.get_legend() is not None:
+                ax.get_legend().remove()
+            ax.set_xlabel('')
+            ax.set_ylabel('')
+            ax.set_title('')
+            ax.relim()
+            ax.set_autoscale_on(True)
+        for colorbar in self.colorbars.values():
+            colorbar.set_label('')
+        self.uses += 1
+
+    def colorbar(self, mappable, ax=None):
+        """
+        Return a colorbar for ``mappable`` next to ``ax`` (by default, the first axes): the
+        colorbar made for these axes by an earlier plot, updated for ``mappable``, if there is one.
+        """
+        ax = ax if ax is not None else self.axes[0]
+        key = self.axes.index(ax)
+        if key in self.colorbars:
+            self.colorbars[key].update_normal(mappable)
+        else:
+            self.colorbars[key] = self.figure.colorbar(mappable, ax=ax)
+        return self.colorbars[key]
+
+    def close(self):
+        """Clear the figure and release it."""
+        self.figure.clear()
+        self.figure = None
+        self.axes = []
+        self.colorbars = {}
@@ -2,19 +2,36 @@
 file_io.py: Simple file input/output.
 """
 
-try:
-    import pyfits as fits_handler
-    has_fits = True
-except ImportError:
-    try:
-        import astropy.io.fits as fits_handler
-        has_fits = True
-    except ImportError:
-        has_fits = False
 import numpy
 import os
 from . import stile_utils
 
+# The FITS module (pyfits or astropy.io.fits) is slow to import, so it is only imported the first
+# time it is needed; ``has_fits`` and ``fits_handler`` are still available as module attributes.
+_fits_handler = []
+
+
+def _getFitsHandler():
+    """Return the FITS module (pyfits or astropy.io.fits), or None if neither can be imported."""
+    if not _fits_handler:
+        try:
+            import pyfits as fits_handler
+        except ImportError:
+            try:
+                import astropy.io.fits as fits_handler
+            except ImportError:
+                fits_handler = None
+        _fits_handler.append(fits_handler)
+    return _fits_handler[0]
+
+
+def __getattr__(name):
+    if name == 'has_fits':
+        return _getFitsHandler() is not None
+    elif name == 'fits_handler' and _getFitsHandler() is not None:
+        return _getFitsHandler()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 def ReadFITSImage(file_name, hdu=0):
     """
@@ -29,7 +46,8 @@ def ReadFITSImage(file_name, hdu=0):
     :param hdu:       The HDU in which the requested data is located [default: 0].
     :returns:         The contents of the requested HDU.
     """
-    if has_fits:
+    fits_handler = _getFitsHandler()
+    if fits_handler is not None:
         fits_file = fits_handler.open(file_name)
         data = fits_file[hdu].data
         fits_file.close()
@@ -205,7 +223,8 @@ def WriteFITSTable(file_name, data_array, fields=None):
        At the moment, if your maximum column number in the ``fields`` dict is greater than the
        number of fields in the ``data_array``, an error will occur.
     """
-    if not has_fits:
+    fits_handler = _getFitsHandler()
+    if fits_handler is None:
         raise ImportError('FITS-type table requested, but no FITS handler found')
     data = _handleFields(data_array, fields)
     cols = [fits_handler.Column(name=data.dtype.names[i], format=_coerceFitsFormat(data.dtype[i]),
@@ -239,7 +258,7 @@ def WriteTable(file_name, data_array, fields=None):
     """
     ext = os.path.splitext(file_name)[1]
     if not ext:
-        if has_fits:
+        if _getFitsHandler() is not None:
             WriteFITSTable(file_name, data_array, fields)
         else:
             WriteASCIITable(file_name, data_array, fields)
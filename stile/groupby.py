@@ -0,0 +1,122 @@
+"""
+groupby.py: A vectorized group-by engine for computing statistics of data split into groups (for
+example, per-CCD statistics) without looping over the groups in Python.
+"""
+
+import numpy
+
+
+class GroupBy(object):
+    """
+    An object that splits data into groups according to an array of keys, and computes statistics
+    of other arrays of the same length within each group.
+
+    The keys are factorized once, at initialization, with :func:`numpy.unique`, so the groups are
+    always returned in sorted order of their keys (available as ``self.keys``), unlike the
+    arbitrary iteration order of a ``set``.  Sums, means and standard deviations are then computed
+    in a single :func:`numpy.bincount` pass per quantity; minima and maxima use one stable sort of
+    the group indices (computed the first time it's needed) and :func:`numpy.ufunc.reduceat`;
+    medians sort each quantity once by (group, value).  All the statistics therefore cost
+    O(N log N) or better, independent of the number of groups.
+
+    For example, ``GroupBy(catalog['CCD']).median(catalog['g1'])`` returns the median of ``g1`` on
+    each CCD, in the order of the CCD names in ``GroupBy(catalog['CCD']).keys``.
+
+    :param keys: An array of group labels, one per data point.  Any type that
+                 :func:`numpy.unique` can sort (ints, strings, ...) is allowed.
+    """
+    def __init__(self, keys):
+        keys = numpy.asarray(keys).reshape(-1)
+        self.keys, self.inverse = numpy.unique(keys, return_inverse=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.n_groups = len(self.keys)
+        self.counts = numpy.bincount(self.inverse, minlength=self.n_groups)
+        self._order = None
+
+    def __len__(self):
+        return self.n_groups
+
+    def _checkValues(self, values):
+        values = numpy.asarray(values).reshape(-1)
+        if len(values) != len(self.inverse):
+            raise ValueError('Values have length %i, but there are %i keys' %
+                             (len(values), len(self.inverse)))
+        return values
+
+    @property
+    def order(self):
+        """The indices that sort the data by group, preserving the original order within each
+        group."""
+        if self._order is None:
+            self._order = numpy.argsort(self.inverse, kind='stable')
+        return self._order
+
+    @property
+    def starts(self):
+        """The index of the first element of each group in data sorted by :attr:`order`."""
+        return numpy.cumsum(self.counts)-self.counts
+
+    def count(self):
+        """Return the number of data points in each group."""
+        return self.counts.copy()
+
+    def sum(self, values, weights=None):
+        """Return the (optionally weighted) sum of ``values`` in each group."""
+        values = self._checkValues(values)
+        if weights is not None:
+            values = values*self._checkValues(weights)
+        return numpy.bincount(self.inverse, weights=values, minlength=self.n_groups)
+
+    def mean(self, values, weights=None):
+        """Return the (optionally weighted) mean of ``values`` in each group."""
+        if weights is None:
+            return self.sum(values)/self.counts
+        return self.sum(values, weights)/self.sum(weights)
+
+    def inverseVarianceMean(self, values, errors):
+        """Return the inverse-variance weighted mean of ``values`` in each group, given the
+        ``errors`` on each value, and the error on that mean.
+
+        :returns: a tuple of (weighted mean, error on the weighted mean), each an array with one
+                  entry per group.
+        """
+        inverse_variance = 1./self._checkValues(errors)**2
+        total_weight = self.sum(inverse_variance)
+        return self.sum(values, inverse_variance)/total_weight, numpy.sqrt(1./total_weight)
+
+    def std(self, values, ddof=0):
+        """Return the standard deviation of ``values`` in each group, with ``ddof`` delta degrees
+        of freedom as for :func:`numpy.std`.  The deviations are taken from the group means (a
+        two-pass computation), so this is numerically stable."""
+        values = self._checkValues(values)
+        deviation = values-self.mean(values)[self.inverse]
+        return numpy.sqrt(self.sum(deviation*deviation)/(self.counts-ddof))
+
+    def min(self, values):
+        """Return the minimum of ``values`` in each group."""
+        return numpy.minimum.reduceat(self._checkValues(values)[self.order], self.starts)
+
+    def max(self, values):
+        """Return the maximum of ``values`` in each group."""
+        return numpy.maximum.reduceat(self._checkValues(values)[self.order], self.starts)
+
+    def median(self, values):
+        """Return the median of ``values`` in each group, with the same convention as
+        :func:`numpy.median` for groups with an even number of members."""
+        values = self._checkValues(values)
+        sorted_values = values[numpy.lexsort((values, self.inverse))]
+        starts = self.starts
+        lower = starts+(self.counts-1)//2
+        upper = starts+self.counts//2
+        return 0.5*(sorted_values[lower]+sorted_values[upper])
+
+    def apply(self, func, values):
+        """Apply an arbitrary function ``func`` to the ``values`` in each group, for statistics
+        that have no vectorized version here.  This loops over the groups, but still only sorts
+        the data once.
+
+        :returns: a list with the result of ``func`` for each group, in the order of
+                  ``self.keys``.
+        """
+        sorted_values = self._checkValues(values)[self.order]
+        return [func(group) for group in numpy.split(sorted_values, self.starts[1:])]
@@ -16,8 +16,14 @@ import lsst.afw.cameraGeom.utils as cameraGeomUtils
 from lsst.meas.mosaic.mosaicTask import MosaicTask
 from lsst.pipe.tasks.dataIds import PerTractCcdDataIdContainer
 from lsst.pipe.tasks.coaddBase import ExistingCoaddDataIdContainer
-from lsst.pex.exceptions import LsstCppException
-from .sys_test_adapters import adapter_registry
+from .sys_test_adapters import adapter_registry, ConfigFields
+from .columns import AsColumns, ColumnStore
+from .shapes import (GetColumn, MomentColumns, CovarianceColumns, TransformMoments,
+                     TransformMomentVariances, ShapesFromMoments, ShapeErrorsFromMoments,
+                     CentroidColumns, JacobianGrid)
+from .calib import LRUCache, CorrectionGrid
+from .parallel import PrefetchCatalogs, ProcessMap, GatherColumns
+from .derived import DerivedColumns
 import numpy
 import re
 import stile
@@ -114,6 +120,41 @@ class CCDSingleEpochStileConfig(lsst.pex.config.Config):
         doc="y limit for whisker plot", default=[-100., 4200.])
     whiskerplot_scale = lsst.pex.config.Field(dtype=float,
         doc="length of whisker per inch", default=0.4)
+    whiskerplot_aggregate = lsst.pex.config.Field(dtype=bool,
+        doc="draw one whisker per grid cell instead of one per object", default=False)
+    focalplanemap_xlim = lsst.pex.config.ListField(dtype=float,
+        doc="x limits of the focal-plane map grid", default=[0., 2048.])
+    focalplanemap_ylim = lsst.pex.config.ListField(dtype=float,
+        doc="y limits of the focal-plane map grid", default=[0., 4176.])
+    focalplanemap_nbins = lsst.pex.config.ListField(dtype=int,
+        doc="number of (x, y) cells in the focal-plane map grid", default=[8, 16])
+    plot_processes = lsst.pex.config.Field(dtype=int, default=2,
+        doc="number of background processes to render plots (0 to render them in the main process)")
+    plot_max_pending = lsst.pex.config.Field(dtype=int, default=8,
+        doc="largest number of plots waiting to be rendered before the tests wait for them")
+    jacobian_grid_tolerance = lsst.pex.config.Field(dtype=float, default=1.E-5,
+        doc="largest relative error of the WCS Jacobians interpolated from a grid for "
+            "sky-coordinate shapes (the grid is refined, or the Jacobians evaluated exactly, to "
+            "meet it)")
+    calib_cache_size = lsst.pex.config.Field(dtype=int, default=64,
+        doc="number of calibration metadata items (per data ID and dataset) to keep in memory; "
+            "the visit, tract and multi-visit/tract tasks keep at least enough for all their CCDs")
+    flux_correction_grid_tolerance = lsst.pex.config.Field(dtype=float, default=1.E-4,
+        doc="largest error (in magnitudes) of the meas_mosaic photometric corrections "
+            "interpolated from a grid for 'mag' columns")
+    column_processes = lsst.pex.config.Field(dtype=int, default=0,
+        doc="number of processes reading, masking and generating the columns of the catalogs in "
+            "the visit, tract and multi-visit/tract tasks (0 to do it all in this process, -1 for "
+            "one per CPU core)")
+    prefetch_threads = lsst.pex.config.Field(dtype=int, default=8,
+        doc="number of threads reading catalogs from the butler at once in the visit, tract and "
+            "multi-visit/tract tasks (1 to read them one at a time)")
+    result_store_format = lsst.pex.config.Field(dtype=str, default="npz",
+        doc="format of the single file per run holding all the result arrays ('npz' or 'hdf5'), "
+            "or '' to write one .dat or .npz file per test instead")
+    manifest_file = lsst.pex.config.Field(dtype=str, default="stile_manifest.sqlite",
+        doc="SQLite file in the output directory recording the tests already run, so that tests "
+            "whose inputs and config have not changed are skipped on reruns; '' to rerun all tests")
 
 
 class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
@@ -130,6 +171,11 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
     # lsst magic
     ConfigClass = CCDSingleEpochStileConfig
     _DefaultName = "CCDSingleEpochStile"
+    # The config fields which change the catalogs given to every sys test (through the objects
+    # removed and the derived columns), and so are part of the config hashed for each test.
+    result_config_fields = ['flags_keep_false', 'flags_keep_true', 'do_hsm', 'shape_flags',
+                            'shape_flags_hsm', 'jacobian_grid_tolerance',
+                            'flux_correction_grid_tolerance']
     # necessary basic parameters for treecorr to run
     def __init__(self, **kwargs):
         lsst.pipe.base.CmdLineTask.__init__(self, **kwargs)
@@ -153,7 +199,163 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
             os.makedirs(dir)
         return dir, "-%07d-%03d" % (dataRef.dataId["visit"], dataRef.dataId["ccd"])
 
+    def makePlotQueue(self):
+        """
+        Return a :class:`stile.PlotQueue` to render and save the plots from :func:`run` in the
+        background, and set the sys tests to return plot specifications instead of drawing the
+        plots themselves if there are background processes.
+        """
+        for sys_test in self.sys_tests:
+            sys_test.sys_test.defer_plots = self.config.plot_processes > 0
+        return stile.PlotQueue(processes=self.config.plot_processes,
+                               max_pending=self.config.plot_max_pending)
+
+    @staticmethod
+    def savePlot(plot_queue, sys_test, results, filename):
+        """
+        Save the plot for the ``results`` of ``sys_test`` (an adapter) to ``filename`` through
+        ``plot_queue``: ``results`` itself if it is a figure or a :class:`stile.PlotSpec`, or
+        otherwise the output of the sys test's :func:`plot` method if it overrides the one of
+        :class:`stile.sys_tests.SysTest` (which draws nothing for such results).  Returns a list of
+        the files written (which is empty if there was no plot).
+        """
+        if isinstance(results, stile.sys_tests.PlotNone):
+            return []
+        elif isinstance(results, stile.PlotSpec) or hasattr(results, 'savefig'):
+            plot_queue.submit(results, filename)
+        elif getattr(type(sys_test.sys_test), 'plot', None) not in (None,
+                                                                    stile.sys_tests.SysTest.plot):
+            plot_queue.submit(stile.PlotSpec(sys_test.sys_test, 'plot', results), filename)
+        else:
+            return []
+        return [filename]
+
+    def makeResultStore(self, dir, filename_base):
+        """
+        Return a :class:`stile.ResultStore` in ``dir`` to hold all the result arrays written by
+        :func:`run`, or None if ``config.result_store_format`` is empty and each result should be
+        written to its own file.
+        """
+        if not self.config.result_store_format:
+            return None
+        ext = {'npz': '.npz', 'hdf5': '.h5'}.get(self.config.result_store_format)
+        if ext is None:
+            raise ValueError("result_store_format must be 'npz', 'hdf5' or '', not %s" %
+                             self.config.result_store_format)
+        return stile.ResultStore(os.path.join(dir, 'stile_results'+filename_base+ext),
+                                 backend=self.config.result_store_format)
+
+    @staticmethod
+    def getResultKey(dataRefs):
+        """
+        Return the keys identifying the results for a dataRef (or list of dataRefs) in a
+        :class:`stile.ResultStore`: the visit, CCD, tract and/or patch, with several values joined
+        by "+".
+        """
+        if not isinstance(dataRefs, (list, tuple)):
+            dataRefs = [dataRefs]
+        key = {}
+        for name in ['visit', 'ccd', 'tract', 'patch']:
+            values = []
+            for dataRef in dataRefs:
+                if name in dataRef.dataId and dataRef.dataId[name] not in values:
+                    values.append(dataRef.dataId[name])
+            if len(values) == 1:
+                key[name] = values[0]
+            elif values:
+                key[name] = '+'.join([str(value) for value in values])
+        return key
+
+    @staticmethod
+    def saveResults(result_store, sys_test, results, filename_base, sys_test_name, key):
+        """
+        Save the results of ``sys_test`` (an adapter): array ``results``, the output of the sys
+        test's :func:`getData` method, and the mergeable state of :class:`stile.stile_utils.Stats`
+        and :class:`stile.sys_tests.FocalPlaneMap` results.  These are written to
+        ``result_store`` for ``sys_test_name`` and ``key`` if it is not None, or else to files
+        named ``filename_base`` plus ``.dat`` or ``.npz``.  Returns a list of the outputs, in the
+        form used by :class:`stile.RunManifest`.
+        """
+        outputs = []
+        def write(data, **output_key):
+            name = stile.ResultStore.makeName(sys_test_name, **dict(key, **output_key))
+            result_store.write(sys_test_name, data, **dict(key, **output_key))
+            outputs.append(result_store.file_name+'::'+name)
+
+        if isinstance(results, numpy.ndarray):
+            if result_store is not None:
+                write(results, output='results')
+            else:
+                stile.WriteASCIITable(filename_base+'.dat', results, print_header=True)
+                outputs.append(filename_base+'.dat')
+        if ((isinstance(results, stile.stile_utils.Stats) and results.moments is not None) or
+                isinstance(results, stile.sys_tests.FocalPlaneMap)):
+            # Save the mergeable state, so that results for larger areas can be reduced from these
+            # (with stile.stile_utils.TreeReduceStats or FocalPlaneMap.merge) without re-reading
+            # the catalogs.
+            if result_store is not None:
+                for field, value in results.getState().items():
+                    write(value, output='state', field=field)
+            else:
+                numpy.savez(filename_base+'.npz', **results.getState())
+                outputs.append(filename_base+'.npz')
+        if hasattr(sys_test.sys_test, 'getData'):
+            if result_store is not None:
+                write(sys_test.sys_test.getData(), output='data')
+            else:
+                stile.WriteASCIITable(filename_base+'.dat', sys_test.sys_test.getData(),
+                                      print_header=True)
+                outputs.append(filename_base+'.dat')
+        return outputs
+
+    def makeManifest(self, dir):
+        """
+        Return the :class:`stile.RunManifest` in ``dir`` which records the tests already run, or
+        None if ``config.manifest_file`` is empty.
+        """
+        if not self.config.manifest_file:
+            return None
+        return stile.RunManifest(os.path.join(dir, self.config.manifest_file))
+
+    def isDone(self, manifest, sys_test, sys_test_name, data_id, catalogs):
+        """
+        Return a tuple of whether ``manifest`` shows that ``sys_test`` (an adapter), named
+        ``sys_test_name``, has already been run on ``data_id`` with the same ``catalogs`` and
+        config (and its outputs still exist), and the hash of those inputs to record once it has
+        been run.  Only the config which affects the results of this test is hashed: the test's
+        own (see :func:`BaseSysTestAdapter.getConfig
+        <stile.hsc.sys_test_adapters.BaseSysTestAdapter.getConfig>`), and the flags and tolerances
+        in ``result_config_fields``, which change the catalogs of every test.
+        """
+        if manifest is None:
+            return False, None
+        config = sys_test.getConfig(self.config)
+        config.update(ConfigFields(self.config, self.result_config_fields))
+        input_hash = stile.RunManifest.hashInputs(*catalogs, config=config)
+        return manifest.isDone(sys_test_name, data_id, input_hash), input_hash
+
+    @staticmethod
+    def recordDone(manifest, done, unwritten=()):
+        """
+        Record in ``manifest`` each of the ``(sys_test_name, data_id, input_hash, outputs)`` tuples
+        ``done`` whose outputs have all been written, that is, none of whose outputs are in the set
+        ``unwritten`` of plots the plot queue has not written.  Output files which don't exist are
+        left out of the records.  Returns a list of the tuples which were not recorded.
+        """
+        not_recorded = []
+        for sys_test_name, data_id, input_hash, outputs in done:
+            if any(output in unwritten for output in outputs):
+                not_recorded.append((sys_test_name, data_id, input_hash, outputs))
+                continue
+            manifest.record(sys_test_name, data_id, input_hash,
+                            [output for output in outputs if os.path.exists(output.split('::')[0])])
+        return not_recorded
+
     def run(self, dataRef):
+        # WCS Jacobian and photometric correction grids, shared by all the sys tests for each
+        # dataRef in this run.
+        self._jacobian_grids = {}
+        self._flux_correction_grids = {}
         # Pull the source catalog from the butler corresponding to the particular CCD in the
         # dataRef.
         catalog = dataRef.get(self.catalog_type, immediate=True,
@@ -164,7 +366,7 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
         # Remove objects so badly measured we shouldn't use them in any test.
         catalog = self.removeFlaggedObjects(catalog)
         sys_data_list = []
-        extra_col_dict = {}
+        extra_col_dict = self.makeDerivedColumns(dataRef, catalog)
         # Now, pull the mask and required-quantity info from the individual systematics tests we're
         # going to run.  We'll generate any required quantities only for the data within the
         # corresponding mask; we'll also check for more specific flags, such as flux measurement
@@ -213,40 +415,75 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
                 for c in cols:
                     if '_sky' in c or '_chip' in c:
                         cols.append('_'.join(c.split('_')[:-1]))
-        for sys_test, sys_test_data in zip(self.sys_tests, sys_data_list):
-            new_catalogs = []
-            for (mask_type, mask), cols in zip(sys_test_data.mask_tuple_list,
-                                               sys_test_data.cols_list):
-                new_catalog = {}
-                for column in cols:
-                    if column in extra_col_dict:
-                        new_catalog[column] = extra_col_dict[column][mask]
-                    elif column in catalog.schema:
-                        try:
-                            new_catalog[column] = catalog[column][mask]
-                        except LsstCppException:
-                            new_catalog[column] = (numpy.array([src[column]
-                                                   for src in catalog])[mask])
-                new_catalogs.append(self.makeArray(new_catalog))
-            # run the test!
-            results = sys_test(self.config, *new_catalogs)
-            # If there's anything fancy to do with the results, do that.
-            this_max_path_length = max_path_length-4-len(sys_test_data.sys_test_name)
-            if isinstance(results, numpy.ndarray):
-                stile.WriteASCIITable(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chip[:this_max_path_length]+'.dat'),
-                      results, print_header=True)
-            if hasattr(sys_test.sys_test, 'getData'):
-                stile.WriteASCIITable(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chip[:this_max_path_length]+'.dat'),
-                      sys_test.sys_test.getData(), print_header=True)
-            if hasattr(sys_test.sys_test, 'plot'):
-                fig = sys_test.sys_test.plot(results)
-                fig.savefig(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chip[:this_max_path_length]+'.png'))
-            if hasattr(results, 'savefig'):
-                results.savefig(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chip[:this_max_path_length]+'.png'))
+        # The arrays are all made from one copy of each column that any of the sys tests need.
+        store = self.makeColumnStore([catalog], [extra_col_dict],
+                                     [cols for sys_data in sys_data_list
+                                      for cols in sys_data.cols_list])
+        # The input arrays for each test are made only when the test is about to run.
+        self.runSysTests(dir, filename_chip, self.getResultKey(dataRef),
+                         ((sys_test, sys_test_data.sys_test_name,
+                           [store.makeArray(cols, mask) for (mask_type, mask), cols
+                            in zip(sys_test_data.mask_tuple_list, sys_test_data.cols_list)])
+                          for sys_test, sys_test_data in zip(self.sys_tests, sys_data_list)))
+        self.logCacheStats()
+
+    def runSysTests(self, dir, filename_base, data_id, sys_test_inputs):
+        """
+        Run each sys test on its input arrays, unless the manifest shows it has already been run on
+        the same data, and save its results and plot.  Plots are rendered in the background while
+        the next tests run.  The result store and the plot queue are closed (writing any buffered
+        results and waiting for the outstanding plots) even if a test fails.
+
+        Each test is recorded in the manifest as soon as its outputs are on disk: its results are
+        flushed to the result store straight away, and it is recorded once its plot is written,
+        so the tests finished before a crash need not be run again.
+
+        :param dir:             The output directory.
+        :param filename_base:   The end of the output file names, after the sys test name.
+        :param data_id:         The data ID for the results, from :func:`getResultKey`.
+        :param sys_test_inputs: An iterable of ``(sys_test, sys_test_name, catalogs)`` tuples, with
+                                the list of input arrays ``catalogs`` for each sys test (adapter).
+        """
+        plot_queue = self.makePlotQueue()
+        result_store = self.makeResultStore(dir, filename_base)
+        manifest = self.makeManifest(dir)
+        done = []
+        try:
+            for sys_test, sys_test_name, new_catalogs in sys_test_inputs:
+                # Skip the test if it was already run on the same data with the same config.
+                is_done, input_hash = self.isDone(manifest, sys_test, sys_test_name, data_id,
+                                                  new_catalogs)
+                if is_done:
+                    continue
+                # run the test!
+                results = sys_test(self.config, *new_catalogs)
+                # If there's anything fancy to do with the results, do that.
+                this_max_path_length = max_path_length-4-len(sys_test_name)
+                output_base = os.path.join(dir,
+                                           sys_test_name+filename_base[:this_max_path_length])
+                outputs = self.saveResults(result_store, sys_test, results, output_base,
+                                           sys_test_name, data_id)
+                outputs += self.savePlot(plot_queue, sys_test, results, output_base+'.png')
+                done.append((sys_test_name, data_id, input_hash, outputs))
+                if manifest is not None:
+                    if result_store is not None:
+                        result_store.flush()
+                    done = self.recordDone(manifest, done, plot_queue.unwritten())
+        finally:
+            # Don't finish until all the plots and results are written.
+            try:
+                plot_queue.close()
+            finally:
+                try:
+                    if result_store is not None:
+                        result_store.close()
+                    # Record the rest of the tests whose plots were written, even if another test
+                    # or plot failed.
+                    if manifest is not None:
+                        self.recordDone(manifest, done, plot_queue.unwritten())
+                finally:
+                    if manifest is not None:
+                        manifest.close()
 
     def removeFlaggedObjects(self, catalog):
         """
@@ -256,22 +493,42 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
         ``self.config.flags``.  They can be altered on the command line or via configuration files
         as described in the parser help.
 
+        The catalog is returned as a :class:`stile.hsc.columns.CatalogColumns` object, so that
+        every column of the masked catalog (and of any further subsets of it) can still be read as
+        a whole NumPy array.
+
         :param catalog: A source catalog pulled from the LSST pipeline.
-        :returns:       The source catalog, masked to the rows which don't have any of our defined
-                        flags set.
+        :returns:       A :class:`stile.hsc.columns.CatalogColumns` view of the source catalog,
+                        masked to the rows which don't have any of our defined flags set.
         """
-        masks = []
-        if self.config.flags_keep_false:
-            masks += [catalog[flag] == False for flag in self.config.flags_keep_false]
-        if self.config.flags_keep_true:
-            masks += [catalog[flag] == True for flag in self.config.flags_keep_true]
-        if masks:
-            mask = masks[0]
-            for new_mask in masks[1:]:
-                mask = numpy.logical_and(mask, new_mask)
-            catalog = catalog[mask]
+        catalog = AsColumns(catalog)
+        if self.config.flags_keep_false or self.config.flags_keep_true:
+            catalog = catalog[catalog.flagMask(self.config.flags_keep_false or [],
+                                               self.config.flags_keep_true or [])]
         return catalog
 
+    def makeColumnStore(self, catalogs, extra_col_dicts, cols_lists):
+        """
+        Return a :class:`stile.hsc.columns.ColumnStore` holding one copy of each of the columns
+        named in ``cols_lists`` (a list of lists of column names), concatenated across
+        ``catalogs``.  Each column is taken from the corresponding dict (or
+        :class:`stile.hsc.derived.DerivedColumns`) in ``extra_col_dicts`` if it's there, else from
+        the catalog; columns which are in neither are left out.
+        """
+        store = ColumnStore([len(catalog) for catalog in catalogs])
+        for name in dict.fromkeys(name for cols in cols_lists for name in cols):
+            parts = []
+            for catalog, extra_col_dict in zip(catalogs, extra_col_dicts):
+                if name in extra_col_dict:
+                    parts.append(extra_col_dict[name])
+                elif name in catalog.schema:
+                    parts.append(catalog[name])
+                else:
+                    break
+            else:
+                store.addColumn(name, parts)
+        return store
+
     def makeArray(self, catalog_dict):
         """
         Take a dict whose keys contain NumPy arrays of the same length and turn it into a
@@ -290,12 +547,91 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
             data[key] = catalog_dict[key]
         return data
 
+    def makeDerivedColumns(self, dataRef, catalog):
+        """
+        Return a :class:`stile.hsc.derived.DerivedColumns` for ``catalog`` (from ``dataRef``) which
+        defines each of the quantities :func:`generateColumns` can compute that aren't columns of
+        the catalog, along with the columns and calibration data each is computed from.
+        """
+        derived = DerivedColumns(len(catalog))
+        for suffix, sky_coords in [('_sky', True), ('_chip', False)]:
+            position = ['centroid', 'calexp_md'] if sky_coords else ['centroid']
+            derived.define(['g1'+suffix, 'g2'+suffix, 'sigma'+suffix],
+                           ['shape.sdss', 'shape.hsm.regauss']+position,
+                           self._makeShapeRule(dataRef, catalog, sky_coords, do_shape=True))
+            derived.define(['g1_err'+suffix, 'g2_err'+suffix, 'sigma_err'+suffix],
+                           ['shape.sdss', 'shape.sdss.err', 'shape.hsm.regauss']+position,
+                           self._makeShapeRule(dataRef, catalog, sky_coords, do_err=True))
+            derived.define(['psf_g1'+suffix, 'psf_g2'+suffix, 'psf_sigma'+suffix],
+                           ['shape.sdss.psf', 'flux.psf.flags']+position,
+                           self._makeShapeRule(dataRef, catalog, sky_coords, do_psf=True))
+        # The sys tests that use weights all work in sky coordinates.
+        def computeWeights(rows, mask_type=None):
+            g1_err = derived['g1_err_sky'][rows]
+            g2_err = derived['g2_err_sky'][rows]
+            return {'w': 1./(0.51**2+g1_err**2+g2_err**2)}, None
+        derived.define(['w'], ['g1_err_sky', 'g2_err_sky'], computeWeights)
+        # The adapters copy the _sky or _chip shapes into these columns before running the tests.
+        for name in ['g1', 'g2', 'sigma', 'g1_err', 'g2_err', 'sigma_err',
+                     'psf_g1', 'psf_g2', 'psf_sigma']:
+            derived.define([name], [],
+                           lambda rows, name=name, mask_type=None: ({name: numpy.zeros(len(rows))},
+                                                                    None))
+        for name, inputs in [('ra', ['coord.ra']), ('dec', ['coord.dec']),
+                             ('x', ['centroid', 'CCD']), ('y', ['centroid', 'CCD']),
+                             ('mag_err', ['flux.psf', 'flux.psf.err', 'flux.psf.flags']),
+                             ('mag', ['flux.psf', 'flux.psf.flags', 'centroid', 'fcr_md',
+                                      'calexp_md']),
+                             ('mag_inst', ['flux.psf', 'flux.psf.flags'])]:
+            derived.define([name], inputs,
+                           self._makeExtraColumnRule(dataRef, catalog, derived, name))
+        return derived
+
+    def _makeShapeRule(self, dataRef, catalog, sky_coords, do_shape=False, do_err=False,
+                       do_psf=False, do_psf_err=False):
+        # Return a function for DerivedColumns.define that computes one group of shape quantities
+        # for some rows of the catalog with computeShapes.
+        def compute(rows, mask_type=None):
+            calib_metadata_shape = self.getCalibData(dataRef, True)[2]
+            jacobian_grid = (self.getJacobianGrid(dataRef, catalog, calib_metadata_shape)
+                             if sky_coords else None)
+            return self.computeShapes(catalog[rows], calib_metadata_shape, do_shape=do_shape,
+                                      do_err=do_err, do_psf=do_psf, do_psf_err=do_psf_err,
+                                      sky_coords=sky_coords, mask_type=mask_type,
+                                      jacobian_grid=jacobian_grid)
+        return compute
+
+    def _makeExtraColumnRule(self, dataRef, catalog, derived, col):
+        # Return a function for DerivedColumns.define that computes the quantity col for some rows
+        # of the catalog with computeExtraColumn.
+        def compute(rows, mask_type=None):
+            calib_type, calib_metadata, calib_metadata_shape = self.getCalibData(dataRef, [])
+            # offset for (x,y) if there is a column 'CCD'. Currently getMm() returns values in
+            # pixel. When the pipeline is updated, we should update this line as well.
+            if col in ('x', 'y') and 'ccd' in dataRef.dataId and 'CCD' in derived:
+                xy0 = cameraGeomUtils.findCcd(dataRef.getButler().mapper.camera, cameraGeom.Id(
+                    dataRef.dataId.get('ccd'))
+                                           ).getPositionFromPixel(afwGeom.PointD(0., 0.)).getMm()
+            else:
+                xy0 = None
+            # The photometric correction grid is made once per CCD, for the whole catalog.
+            if col == "mag" and calib_type == "fcr":
+                flux_correction = self.getFluxCorrectionGrid(dataRef, catalog, calib_metadata)
+            else:
+                flux_correction = None
+            values, extra_mask = self.computeExtraColumn(col, catalog[rows], calib_metadata,
+                                                         calib_type, xy0, mask_type=mask_type,
+                                                         flux_correction=flux_correction)
+            return {col: values}, extra_mask
+        return compute
+
     def generateColumns(self, dataRef, catalog, mask_tuple, raw_cols, extra_col_dict):
         """
-        Generate required columns which are not already in the data array,  and update
-        ``extra_col_dict`` to include them.  Also update the mask (``mask_tuple[1]``) to exclude any
-        objects which have specific failures for the requested quantities, such as flux measurement
-        failures for flux/magnitude measurements.
+        Generate required columns which are not already in the catalog, for the rows of the mask
+        (``mask_tuple[1]``) they haven't already been generated for, and keep them in
+        ``extra_col_dict``.  Also update the mask to exclude any objects which have specific
+        failures for the requested quantities, such as flux measurement failures for
+        flux/magnitude measurements.
 
         :param dataRef:        A ``dataRef`` that is the source of the following data
         :param catalog:        A source catalog from the LSST pipeline.
@@ -303,95 +639,42 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
                                mask indicating which rows to generate columns for in the second
                                element.  ``mask_tuple[1]`` is updated by this function.
         :param cols:           An iterable of strings indicating which quantities are needed.
-        :param extra_col_dict: A dict whose keys are quantity names and whose values are
-                               NumPy arrays of those quantities.  ``nan`` is used to indicate
-                               as-yet uncomputed results; elements which are something other than
-                               ``nan`` are not recomputed.  ``extra_col_dict`` is updated by this
+        :param extra_col_dict: The :class:`stile.hsc.derived.DerivedColumns` for ``catalog``, made
+                               by :func:`makeDerivedColumns`, which keeps the generated quantities
+                               and which rows of each have been generated.  It is updated by this
                                function.
         """
-        cols = list(raw_cols) # so we can pop items and not mess up our column description elsewhere
-        # The moments measurement is slow enough to make a difference if we're processing many
-        # catalogs, so we do those first, and separately, all at once.  Here, we figure out if there
-        # are any moments-related keys to pull out of the catalog.
-        base_shape_keys = ['g1', 'g2', 'psf_g1', 'psf_g2', 'w', 'g1_err', 'g2_err', 'psf_g1_err',
-                           'psf_g2_err', 'sigma', 'sigma_err', 'psf_sigma', 'psf_sigma_err']
-        shape_keys = ['g1_sky', 'g1_chip', 'g2_sky', 'g2_chip', 'sigma_sky', 'sigma_chip']
-        shape_err_keys = ['g1_err_sky', 'g1_err_chip', 'g2_err_sky', 'g2_err_chip',
-                          'sigma_err_sky', 'sigma_err_chip', 'w']
-        psf_shape_keys = ['psf_g1_sky', 'psf_g1_chip', 'psf_g2_sky', 'psf_g2_chip',
-                          'psf_sigma_sky', 'psf_sigma_chip']
-        psf_shape_err_keys = ['psf_g1_err_sky', 'psf_g1_err_chip', 'psf_g2_err_sky',
-                              'psf_g2_err_chip', 'psf_sigma_err_sky', 'psf_sigma_err_chip']
-        do_shape = [col for col in shape_keys if col in cols and not col in catalog.schema]
-        do_err = [col for col in shape_err_keys if col in cols and not col in catalog.schema]
-        do_psf = [col for col in psf_shape_keys if col in cols and not col in catalog.schema]
-        do_psf_err = [col for col in psf_shape_err_keys
-                      if col in cols and not col in catalog.schema]
-        shape_cols = do_shape+do_err+do_psf+do_psf_err  # a list of shape-related columns to process
-        # Add the base column names, to make sure there's a column for that in the final array.
-        for key in base_shape_keys:
-            if key+'_chip' or key+'_sky' in shape_cols:
-                shape_cols.append(key)
-
-        calib_type, calib_metadata, calib_metadata_shape = self.getCalibData(dataRef, shape_cols)
-
-        # offset for (x,y) if extra_col_dict has a column 'CCD'. Currently getMm() returns values
-        # in pixel. When the pipeline is updated, we should update this line as well.
-        if 'ccd' in dataRef.dataId and 'CCD' in extra_col_dict and ('x' in raw_cols or 'y' in raw_cols):
-            xy0 = cameraGeomUtils.findCcd(dataRef.getButler().mapper.camera, cameraGeom.Id(
-                dataRef.dataId.get('ccd'))
-                                       ).getPositionFromPixel(afwGeom.PointD(0., 0.)).getMm()
-        else:
-            xy0 = None
-
-        if shape_cols:
-            for col in shape_cols:
-                if col in cols:
-                    cols.remove(col)
-                # Make sure there's already a NumPy array in the dict associated with this key.
-                # We use "nan" to mark the rows we haven't computed already.
-                if col not in extra_col_dict:
-                    extra_col_dict[col] = numpy.zeros(len(catalog))
-                    extra_col_dict[col].fill('nan')
-            # Now, figure out the rows where we need to compute at least one of these quantities
-            nan_masks = [numpy.isnan(extra_col_dict[col]) for col in shape_cols]
-            nan_mask = numpy.logical_or.reduce(nan_masks)
-            nan_and_col_mask = numpy.logical_and(nan_mask, mask_tuple[1])
-            # We will have to transform to sky coordinates if the locations are in (ra,dec).  But
-            # we may also need the quantities in chip coordinates.
-            do_sky_coords = True if numpy.any(['_sky' in col for col in raw_cols]) else False
-            do_chip_coords = True if numpy.any(['_chip' in col for col in raw_cols]) else False
-            if any(nan_and_col_mask > 0):
-                # computeShapes returns a dict of ('key': column) pairs, and sometimes an extra
-                # mask indicating where measurements were valid. Here, the extra mask is only used
-                # if PSF shapes were computed, since we already computed the shape masking in run().
-                for do_quantity, sky_coords in [(do_sky_coords, True), (do_chip_coords, False)]:
-                    if do_quantity:
-                        shapes_dict, extra_mask = self.computeShapes(catalog[nan_and_col_mask],
-                            calib_metadata_shape, do_shape=do_shape, do_err=do_err, do_psf=do_psf,
-                            do_psf_err=do_psf_err, sky_coords=sky_coords, mask_type=mask_tuple[0])
-                        if extra_mask is not None:
-                            mask_tuple[1][nan_and_col_mask] = numpy.logical_and(extra_mask,
-                                                                   mask_tuple[1][nan_and_col_mask])
-                        for col in shapes_dict:
-                            if shapes_dict[col] is not None and col in extra_col_dict:
-                                extra_col_dict[col][nan_and_col_mask] = shapes_dict[col]
-        # Now we do the other quantities.  A lot of this is similar to the above code.
-        for col in cols:
-            if not col in catalog.schema:
-                if not col in extra_col_dict:
-                    extra_col_dict[col] = numpy.zeros(len(catalog))
-                    extra_col_dict[col].fill('nan')
-                nan_mask = numpy.isnan(extra_col_dict[col])
-                nan_and_col_mask = numpy.logical_and(nan_mask, mask_tuple[1])
-                if any(nan_and_col_mask > 0):
-                    # "extra_mask" is the new mask with the quantity-specific flags
-                    extra_col_dict[col][nan_and_col_mask], extra_mask = self.computeExtraColumn(
-                        col, catalog[nan_and_col_mask], calib_metadata, calib_type, xy0,
-                        mask_type=mask_tuple[0])
-                    if extra_mask is not None:
-                        mask_tuple[1][nan_and_col_mask] = numpy.logical_and(extra_mask,
-                                                                   mask_tuple[1][nan_and_col_mask])
+        cols = [col for col in raw_cols if col not in catalog.schema]
+        # Add the base shape names, to make sure there's a column for them in the final array.
+        cols += ['_'.join(col.split('_')[:-1]) for col in cols if '_sky' in col or '_chip' in col]
+        # Each quantity is computed (with the quantities it depends on) only for the rows where it
+        # hasn't been already, and the mask is updated wherever it isn't usable.
+        valid = extra_col_dict.compute(cols, mask_tuple[1], mask_type=mask_tuple[0])
+        numpy.logical_and(mask_tuple[1], valid, out=mask_tuple[1])
+
+    def getCalibCache(self):
+        """
+        Return the :class:`stile.hsc.calib.LRUCache` of calibration data for this task, making it
+        the first time.  It holds the calibration metadata (and whether it exists) per dataset and
+        data ID, so that these are read from the butler once rather than once per sys test and
+        mask.
+        """
+        if '_calib_cache' not in self.__dict__:
+            self._calib_cache = LRUCache(self.config.calib_cache_size)
+        return self._calib_cache
+
+    def getCalibDataset(self, dataRef, dataset):
+        """Return ``dataRef.get(dataset)`` for a calibration dataset such as ``"calexp_md"``, from
+        the calibration cache if it was read before."""
+        return self.getCalibCache().get((dataset, tuple(sorted(dataRef.dataId.items()))),
+                                        lambda: dataRef.get(dataset, immediate=True))
+
+    def calibDatasetExists(self, dataRef, dataset):
+        """Return ``dataRef.datasetExists(dataset)``, from the calibration cache if it was checked
+        before."""
+        return self.getCalibCache().get(
+            ('exists', dataset, tuple(sorted(dataRef.dataId.items()))),
+            lambda: dataRef.datasetExists(dataset, immediate=True))
 
     def getCalibData(self, dataRef, shape_cols):
         # "fcr_md" is the more granular calibration generated by the
@@ -399,45 +682,89 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
         # datasetExists() call will fail if no tract is defined, hence the try-except block.
         calib_metadata_shape = None
         try:
-            if dataRef.datasetExists("fcr_md", immediate=True):
-                calib_metadata = dataRef.get("fcr_md", immediate=True)
+            if self.calibDatasetExists(dataRef, "fcr_md"):
+                calib_metadata = self.getCalibDataset(dataRef, "fcr_md")
                 calib_type = "fcr"
                 if shape_cols:
-                    calib_metadata_shape = dataRef.get("calexp_md", immediate=True)
+                    calib_metadata_shape = self.getCalibDataset(dataRef, "calexp_md")
             else:
-                calib_metadata = dataRef.get("calexp_md", immediate=True)
+                calib_metadata = self.getCalibDataset(dataRef, "calexp_md")
                 calib_type = "calexp"
                 if shape_cols:
                     calib_metadata_shape = calib_metadata
         except:
-            calib_metadata = dataRef.get("calexp_md", immediate=True)
+            calib_metadata = self.getCalibDataset(dataRef, "calexp_md")
             calib_type = "calexp"
             if shape_cols:
                 calib_metadata_shape = calib_metadata
 
         return calib_type, calib_metadata, calib_metadata_shape
 
+    def getFluxCorrectionGrid(self, dataRef, catalog, calib_data):
+        """
+        Return a :class:`stile.hsc.calib.CorrectionGrid` of the meas_mosaic photometric correction
+        described by ``calib_data`` (an ``fcr_md`` dataset) over the area covered by ``catalog``.
+        The grid is made once for each ``dataRef`` in a run, and shared by all the sys tests.
+        """
+        grids = self.__dict__.setdefault('_flux_correction_grids', {})
+        key = tuple(sorted(dataRef.dataId.items()))
+        if key not in grids:
+            grids[key] = self.makeFluxCorrectionGrid(catalog, calib_data)
+        return grids[key]
+
+    def makeFluxCorrectionGrid(self, catalog, calib_data):
+        """Return a :class:`stile.hsc.calib.CorrectionGrid` of the meas_mosaic photometric
+        correction described by ``calib_data`` covering the sources in ``catalog``."""
+        ffp = lsst.meas.mosaic.FluxFitParams(calib_data)
+        x, y = CentroidColumns(catalog)
+        xlim = (numpy.min(x), numpy.max(x)) if len(x) else (0., 1.)
+        ylim = (numpy.min(y), numpy.max(y)) if len(y) else (0., 1.)
+        return CorrectionGrid(ffp.eval, xlim, ylim,
+                              tolerance=self.config.flux_correction_grid_tolerance)
+
+    def logCacheStats(self):
+        """Log the hit rate of the calibration cache."""
+        self.log.info("Calibration cache: %s" % self.getCalibCache())
+
     def _computeShapeMask(self, data, mask_type):
         """
         Compute and return the mask for ``data`` that excludes pernicious shape measurement
-        failures.
+        failures.  The mask is kept with ``data`` (see
+        :func:`stile.hsc.columns.CatalogColumns.cachedMask`) and shared by every sys test and
+        object type that uses the same flags; it is read-only.
         """
-        masks = list()
         if 'galaxy' in mask_type and self.config.do_hsm:
-            for flag in self.config.shape_flags_hsm:
-                key = data.schema.find(flag).key
-                masks.append(numpy.array([src.get(key) == False for src in data]))
+            flags = tuple(self.config.shape_flags_hsm)
         else:
-            for flag in self.config.shape_flags:
-                key = data.schema.find(flag).key
-                masks.append(numpy.array([src.get(key) == False for src in data]))
-        mask = masks[0]
-        for new_mask in masks[1:]:
-            mask = numpy.logical_and(mask, new_mask)
-        return mask
+            flags = tuple(self.config.shape_flags)
+        return AsColumns(data).cachedMask(('shape flags',)+flags,
+                                          lambda data: data.flagMask(flags))
+
+    def getJacobianGrid(self, dataRef, catalog, calib):
+        """
+        Return a :class:`stile.hsc.shapes.JacobianGrid` of the pixel-to-sky Jacobians of the WCS in
+        ``calib`` over the area covered by ``catalog``.  The grid is made once for each ``dataRef``
+        in a run, and shared by all the sys tests.
+        """
+        grids = self.__dict__.setdefault('_jacobian_grids', {})
+        key = tuple(sorted(dataRef.dataId.items()))
+        if key not in grids:
+            grids[key] = self.makeJacobianGrid(catalog, calib)
+        return grids[key]
+
+    def makeJacobianGrid(self, catalog, calib):
+        """Return a :class:`stile.hsc.shapes.JacobianGrid` of the WCS in ``calib`` covering the
+        sources in ``catalog``."""
+        wcs = afwImage.makeWcs(calib)
+        x, y = CentroidColumns(catalog)
+        xlim = (numpy.min(x), numpy.max(x)) if len(x) else (0., 1.)
+        ylim = (numpy.min(y), numpy.max(y)) if len(y) else (0., 1.)
+        return JacobianGrid(
+            lambda x, y: wcs.linearizePixelToSky(afwGeom.Point2D(x, y)).getLinear().getMatrix(),
+            xlim, ylim, tolerance=self.config.jacobian_grid_tolerance)
 
     def computeShapes(self, data, calib, do_shape=True, do_err=True, do_psf=True, do_psf_err=True,
-                             sky_coords=True, mask_type=None):
+                             sky_coords=True, mask_type=None, jacobian_grid=None):
         """
         Compute the shapes for the given ``data``, an LSST source catalog, with the associated
         ``calib`` calibrated exposure metadata (``'calexp'`` or ``'fcr'``, either works).
@@ -453,6 +780,9 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
         :param sky_coords: If True, compute the moments in ra, dec coordinates; else compute in
                            native coordinates (x, y for CCD).
         :param mask_type:  The object type corresponding to the data in ``data`` [default: ``None``]
+        :param jacobian_grid: A :class:`stile.hsc.shapes.JacobianGrid` to interpolate the local
+                           pixel-to-sky transforms from, if ``sky_coords=True``.  [default: None,
+                           meaning make one from ``calib`` for just this ``data``]
         :returns:          A tuple consisting of:
         
                               - A dict whose keys are column names (``'g1', 'psf_sigma'``, etc) and
@@ -460,86 +790,45 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
                               - None if no new mask was needed, or a NumPy array of bools indicating
                                 which rows had valid measurements.
         """
+        # The moments and covariances are pulled out of the catalog as whole columns, and the
+        # local (pixel to sky) linear transforms are applied to all the objects at once.
         if sky_coords:
-            wcs = afwImage.makeWcs(calib)
-            localLinearTransform = [wcs.linearizePixelToSky(src.getCentroid()).getLinear()
-                                for src in data]
+            if jacobian_grid is None:
+                jacobian_grid = self.makeJacobianGrid(data, calib)
+            transforms = jacobian_grid(*CentroidColumns(data))
         if do_shape or do_err:
             if 'galaxy' in mask_type and self.config.do_hsm:  # For any galaxy type, use shape.hsm
-                key_g1 = data.schema.find("shape.hsm.regauss.e1").key
-                key_g2 = data.schema.find("shape.hsm.regauss.e2").key
-                g1 = numpy.array([src.get(key_g1) for src in data])
-                g2 = numpy.array([src.get(key_g2) for src in data])
-                if sky_coords:
-                    # we do not have size in shape.hsm, but it does not matter for shapes.
-                    # The size derived in this code is meaningless though.
-                    ixx_pixel = 1.+g1
-                    iyy_pixel = 1.-g1
-                    ixy_pixel = g2
-                    ixx = numpy.array([lt[0,0]**2*ixxp+2.*lt[0,0]*lt[0,1]*ixyp+lt[0,1]**2*iyyp
-                            for (ixxp, ixyp, iyyp, lt)
-                            in zip(ixx_pixel, ixy_pixel, iyy_pixel, localLinearTransform)])
-                    iyy = numpy.array([lt[1,0]**2*ixxp+2.*lt[1,0]*lt[1,1]*ixyp+lt[1,1]**2*iyyp
-                            for (ixxp, ixyp, iyyp, lt)
-                            in zip(ixx_pixel, ixy_pixel, iyy_pixel, localLinearTransform)])
-                    ixy = numpy.array([(lt[0,0]*lt[1,0]*ixxp +
-                                     (lt[0,0]*lt[1,1]+lt[0,1]*lt[1,0])*ixyp+
-                                     lt[0,1]*lt[1,1]*iyyp)
-                            for (ixxp, ixyp, iyyp, lt)
-                            in zip(ixx_pixel, ixy_pixel, iyy_pixel, localLinearTransform)])
-                else:
-                    ixx = 1.+g1
-                    iyy = 1.-g1
-                    ixy = g2
+                g1 = GetColumn(data, data.schema.find("shape.hsm.regauss.e1").key)
+                g2 = GetColumn(data, data.schema.find("shape.hsm.regauss.e2").key)
+                # we do not have size in shape.hsm, but it does not matter for shapes.
+                # The size derived in this code is meaningless though.
+                ixx = 1.+g1
+                iyy = 1.-g1
+                ixy = g2
             else:
-                key = data.schema.find("shape.sdss").key
-                moments = [src.get(key) for src in data]
-                if sky_coords:
-                    moments = [moment.transform(lt) for moment, lt in
-                                      zip(moments, localLinearTransform)]
-                ixx = numpy.array([mom.getIxx() for mom in moments])
-                ixy = numpy.array([mom.getIxy() for mom in moments])
-                iyy = numpy.array([mom.getIyy() for mom in moments])
+                ixx, iyy, ixy = MomentColumns(data, "shape.sdss")
+            if sky_coords:
+                ixx, iyy, ixy = TransformMoments(ixx, iyy, ixy, transforms)
         if do_err:
             if 'galaxy' in mask_type and self.config.do_hsm:
-                key = data.schema.find('shape.hsm.regauss.sigma').key
-                errs = numpy.array([src.get(key) for src in data])
-                sigma_errs = numpy.array(errs.shape)
-                sigma_errs.fill(1.)
+                errs = GetColumn(data, data.schema.find('shape.hsm.regauss.sigma').key)
+                sigma_errs = numpy.ones(len(errs))
             else:
-                key = data.schema.find("shape.sdss.err").key
-                covariances = numpy.array([src.get(key) for src in data])
+                covariances = CovarianceColumns(data, "shape.sdss.err")
+                cov_ixx = covariances[:, 0, 0]
+                cov_iyy = covariances[:, 1, 1]
+                cov_ixy = covariances[:, 2, 2]
                 if sky_coords:
-                    cov_ixx = numpy.zeros(covariances[:,0,0].shape)
-                    cov_iyy = numpy.zeros(covariances[:,0,0].shape)
-                    cov_ixy = numpy.zeros(covariances[:,0,0].shape)
-                    for i, (cov, lt) in enumerate(zip(covariances,localLinearTransform)):
-                        cov_ixx[i] = (lt[0,0]**4*cov[0,0] +
-                                      (2.*lt[0,0]*lt[0,1])**2*cov[2,2] + lt[0,1]**4*cov[1,1])
-                        cov_iyy[i] = (lt[1,0]**4*cov[0,0] +
-                                      (2.*lt[1,0]*lt[1,1])**2*cov[2,2] + lt[1,1]**4*cov[1,1])
-                        cov_ixy[i] = ((lt[0,0]*lt[1,0])**2*cov[0,0] +
-                                      (lt[0,0]*lt[1,1]+lt[0,1]*lt[1,0])**2*cov[2,2] +
-                                      (lt[0,1]*lt[1,1])**2*cov[1,1])
-                else:
-                    cov_ixx = covariances[:,0,0]
-                    cov_iyy = covariances[:,1,1]
-                    cov_ixy = covariances[:,2,2]
+                    cov_ixx, cov_iyy, cov_ixy = TransformMomentVariances(cov_ixx, cov_iyy, cov_ixy,
+                                                                         transforms)
         if do_psf:
-            key = data.schema.find("shape.sdss.psf").key
-            psf_moments = [src.get(key) for src in data]
+            psf_ixx, psf_iyy, psf_ixy = MomentColumns(data, "shape.sdss.psf")
             if sky_coords:
-                psf_moments = [moment.transform(lt) for moment, lt in
-                                  zip(psf_moments, localLinearTransform)]
-            psf_ixx = numpy.array([mom.getIxx() for mom in psf_moments])
-            psf_ixy = numpy.array([mom.getIxy() for mom in psf_moments])
-            psf_iyy = numpy.array([mom.getIyy() for mom in psf_moments])
+                psf_ixx, psf_iyy, psf_ixy = TransformMoments(psf_ixx, psf_iyy, psf_ixy, transforms)
 
         # Now, combine the moment measurements into the actual quantities we want.
         if do_shape:
-            g1 = (ixx-iyy)/(ixx+iyy)
-            g2 = 2.*ixy/(ixx+iyy)
-            sigma = (ixx*iyy - ixy**2)**0.25
+            g1, g2, sigma = ShapesFromMoments(ixx, iyy, ixy)
         else:
             g1 = None
             g2 = None
@@ -550,31 +839,18 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
                 g2_err = errs
                 sigma_err = sigma_errs
             else:
-                dg1_dixx = 2.*iyy/(ixx+iyy)**2
-                dg1_diyy = -2.*ixx/(ixx+iyy)**2
-                g1_err = numpy.sqrt(dg1_dixx**2 * cov_ixx + dg1_diyy**2 * cov_iyy)
-                dg2_dixx = -2.*ixy/(ixx+iyy)**2
-                dg2_diyy = -2.*ixy/(ixx+iyy)**2
-                dg2_dixy = 2./(ixx+iyy)
-                g2_err = numpy.sqrt(dg2_dixx**2 * cov_ixx + dg2_diyy**2 * cov_iyy +
-                                    dg2_dixy**2 * cov_ixy)
-                dsigma_dixx = 0.25/sigma**3*iyy
-                dsigma_diyy = 0.25/sigma**3*ixx
-                dsigma_dixy = -0.5/sigma**3*ixy
-                sigma_err = numpy.sqrt(dsigma_dixx**2 * cov_ixx + dsigma_diyy**2 * cov_iyy +
-                                       dsigma_dixy**2 * cov_ixy)
+                g1_err, g2_err, sigma_err = ShapeErrorsFromMoments(ixx, iyy, ixy,
+                                                                   cov_ixx, cov_iyy, cov_ixy)
             w = 1./(0.51**2+g1_err**2+g2_err**2)
         else:
             g1_err = None
             g2_err = None
             sigma_err = None
-            w = [1.]*len(data)
+            w = numpy.ones(len(data))
         if do_psf:
-            psf_g1 = (psf_ixx-psf_iyy)/(psf_ixx+psf_iyy)
-            psf_g2 = 2.*psf_ixy/(psf_ixx+psf_iyy)
-            psf_sigma = (psf_ixx*psf_iyy - psf_ixy**2)**0.25
+            psf_g1, psf_g2, psf_sigma = ShapesFromMoments(psf_ixx, psf_iyy, psf_ixy)
             key = data.schema.find('flux.psf.flags').key
-            extra_mask = numpy.array([src.get(key) == 0 for src in data])
+            extra_mask = GetColumn(data, key) == 0
         else:
             psf_g1 = None
             psf_g2 = None
@@ -614,59 +890,61 @@ class CCDSingleEpochStileTask(lsst.pipe.base.CmdLineTask):
                      'psf_g1_chip': psf_g1, 'psf_g2_chip': psf_g2, 'psf_sigma_chip': psf_sigma},
                      extra_mask)
 
-    def computeExtraColumn(self, col, data, calib_data, calib_type, xy0=None, mask_type=None):
+    def computeExtraColumn(self, col, data, calib_data, calib_type, xy0=None, mask_type=None,
+                           flux_correction=None):
         """
         Compute the quantity ``col`` for the given ``data``.
 
         :param col:        A string indicating the quantity needed.
-        :param data:       A (subset of a) source catalog from the LSST pipeline.
+        :param data:       A (subset of a) source catalog from the LSST pipeline, preferably as a
+                           :class:`stile.hsc.columns.CatalogColumns` object.
         :param calib_data: Photometric calibration data for flux/magnitude measurements.
         :param calib_type: Which type of calibration calib_data is ("fcr" or "calexp"--"fcr" for
                            coadds where available, else "calexp").
         :param xy0:        Offset of a CCD. [default: None, meaning do not add any offset]
         :param mask_type:  The object type corresponding to the data in ``data`` [default: None]
+        :param flux_correction: A :class:`stile.hsc.calib.CorrectionGrid` to interpolate the
+                           photometric correction from, for ``col="mag"`` with
+                           ``calib_type="fcr"``.  [default: None, meaning make one from
+                           ``calib_data`` for just this ``data``]
         :returns:          A 2-element tuple.  The first element is a list or NumPy array of the
                            quantity indicated by ``col``. The second is either None (if no further
                            masking is needed) or a NumPy array of boolean values indicating where
                            the quantity is reliable (True) or unusable in some way (False).
 
         """
+        data = AsColumns(data)
         if col == "ra":
-            return [src.getRa().asDegrees() for src in data], None
+            # Angle columns are stored in radians.
+            return numpy.degrees(data['coord.ra']), None
         elif col == "dec":
-            return [src.getDec().asDegrees() for src in data], None
+            return numpy.degrees(data['coord.dec']), None
         elif col == "x":
             if xy0:
-                return [src.getX() + xy0.getX() for src in data], None
+                return data.getX() + xy0.getX(), None
             else:
-                return [src.getX() for src in data], None
+                return data.getX(), None
         elif col == "y":
             if xy0:
-                return [src.getY() + xy0.getY() for src in data], None
+                return data.getY() + xy0.getY(), None
             else:
-                return [src.getY() for src in data], None
+                return data.getY(), None
         elif col == "mag_err":
-            key = data.schema.find('flux.psf.flags').key
-            return (2.5/numpy.log(10)*numpy.array([src.getPsfFluxErr()/src.getPsfFlux()
-                                                    for src in data]),
-                    numpy.array([src.get(key) == 0 for src in data]))
+            return (2.5/numpy.log(10)*data['flux.psf.err']/data['flux.psf'],
+                    data.flagMask(['flux.psf.flags']))
         elif col == "mag":
             # From Steve Bickerton's helpful HSC butler documentation
             if calib_type == "fcr":
-                ffp = lsst.meas.mosaic.FluxFitParams(calib_data)
-                x = [src.getX() for src in data]
-                y = [src.getY() for src in data]
-                correction = numpy.array([ffp.eval(x[i], y[i]) for i in range(len(x))])
+                if flux_correction is None:
+                    flux_correction = self.makeFluxCorrectionGrid(data, calib_data)
+                correction = flux_correction(data.getX(), data.getY())
                 zeropoint = 2.5*numpy.log10(calib_data.get("FLUXMAG0")) + correction
             elif calib_type == "calexp":
                 zeropoint = 2.5*numpy.log10(calib_data.get("FLUXMAG0"))
-            key = data.schema.find('flux.psf.flags').key
-            return (zeropoint - 2.5*numpy.log10(numpy.array([src.getPsfFlux() for src in data])),
-                    numpy.array([src.get(key) == 0 for src in data]))
+            return (zeropoint - 2.5*numpy.log10(data['flux.psf']),
+                    data.flagMask(['flux.psf.flags']))
         elif col == "mag_inst":
-            key = data.schema.find('flux.psf.flags').key
-            return (-2.5*numpy.log10(numpy.array([src.getPsfFlux() for src in data])),
-                    numpy.array([src.get(key) == 0 for src in data]))
+            return (-2.5*numpy.log10(data['flux.psf']), data.flagMask(['flux.psf.flags']))
         elif col == "w":
             # Use uniform weights for now if we don't use shapes ("w" will be removed from the
             # list of columns if shapes are computed).
@@ -741,6 +1019,7 @@ class VisitSingleEpochStileConfig(CCDSingleEpochStileConfig):
                              "StarXGalaxyShear", "StarXStarShear", "Rho1",
                              "StarXStarSizeResidual",
                              "WhiskerPlotStar", "WhiskerPlotPSF", "WhiskerPlotResidual",
+                             "FocalPlaneMap",
                              "ScatterPlotStarVsPSFG1", "ScatterPlotStarVsPSFG2",
                              "ScatterPlotStarVsPSFSigma", "ScatterPlotResidualVsPSFG1",
                              "ScatterPlotResidualVsPSFG2", "ScatterPlotResidualVsPSFSigma",
@@ -759,10 +1038,38 @@ class VisitSingleEpochStileConfig(CCDSingleEpochStileConfig):
         doc="y limit for whisker plot", default=[-20000., 20000.])
     whiskerplot_scale = lsst.pex.config.Field(dtype=float,
         doc="length of whisker per inch", default=0.4)
+    whiskerplot_aggregate = lsst.pex.config.Field(dtype=bool,
+        doc="draw one whisker per grid cell instead of one per object", default=True)
+    # Keep the visit-level grid fixed, so maps from different visits can be merged.
+    focalplanemap_xlim = lsst.pex.config.ListField(dtype=float,
+        doc="x limits of the focal-plane map grid", default=[-20000., 20000.])
+    focalplanemap_ylim = lsst.pex.config.ListField(dtype=float,
+        doc="y limits of the focal-plane map grid", default=[-20000., 20000.])
+    focalplanemap_nbins = lsst.pex.config.ListField(dtype=int,
+        doc="number of (x, y) cells in the focal-plane map grid", default=[100, 100])
     scatterplot_per_ccd_stat = lsst.pex.config.Field(dtype=str, default='median',
                          doc="Which statistics (median, mean, or None) to be performed in CCDs.")
     ccd_type = 'S7'
 
+# The copy of the task used in each process of VisitSingleEpochStileTask.computeColumnsInProcesses.
+_column_worker_task = None
+
+
+def _initColumnWorker(task_class, config):
+    global _column_worker_task
+    _column_worker_task = task_class(config=config)
+
+
+def _computeCatalogColumns(dataRef):
+    task = _column_worker_task
+    try:
+        catalog = task.loadCatalog(dataRef)
+    except RuntimeError as e:
+        print(e, ', skip this patch')
+        return None
+    return task.computeCatalogColumns(dataRef, task.prepareCatalog(dataRef, catalog))
+
+
 class VisitSingleEpochStileTask(CCDSingleEpochStileTask):
     """
     A basic Task class to run visit-level single-epoch tests.  Inheriting from
@@ -817,115 +1124,199 @@ class VisitSingleEpochStileTask(CCDSingleEpochStileTask):
         return dir, "-%07d-%s" % (dataRefList[0].dataId["visit"], ccd_str)
 
     def run(self, visit, dataRefList):
+        # WCS Jacobian and photometric correction grids, shared by all the sys tests for each
+        # dataRef in this run.
+        self._jacobian_grids = {}
+        self._flux_correction_grids = {}
+        # Keep the calibration metadata for every dataRef in the run: up to three items each
+        # (whether fcr_md exists, fcr_md and calexp_md).
+        calib_cache = self.getCalibCache()
+        calib_cache.max_size = max(calib_cache.max_size, 3*len(dataRefList))
         # It seems like it would make more sense to put all of this in a separate function and run
         # it once per catalog, then collate the results at the end (just before running the test).
         # Turns out that, compared to the current implementation, that takes 2-3 times as long to
         # run (!) even before you get to the collation step.  So, we duplicate some code here in
         # the name of runtime, at the expense of some complexity in terms of nested lists of things.
         # Some of this code is annotated more clearly in the CCD* version of this class.
-
-        # temporary fix for a patch that exists in dataRefList but not in catalogs.
-        catalogs = list()
-        for dataRef in dataRefList:
-            try:
-                catalogs.append(dataRef.get(self.catalog_type, immediate=True,
-                                flags=afwTable.SOURCE_IO_NO_FOOTPRINTS))
-            except RuntimeError as e:
-                print(e, ', skip this patch')
-        catalogs = [self.removeFlaggedObjects(catalog) for catalog in catalogs]
-        sys_data_list = []
-        extra_col_dicts = [{} for catalog in catalogs]
+        # If config.column_processes is set, though, the catalogs are processed separately (by
+        # computeCatalogColumns) in a pool of processes, so the run time scales with the number of
+        # cores instead.
 
         dir, filename_chips = self.getFilenameBase(dataRefList)
+        data_id = self.getResultKey(dataRefList)
 
-        # Some tests need to know which data came from which CCD
-        for dataRef, catalog, extra_col_dict in zip(dataRefList, catalogs, extra_col_dicts):
-            extra_col_dict['CCD'] = numpy.zeros(len(catalog), dtype=self.config.ccd_type)
-            if self.multi_item_type:
-                extra_col_dict['CCD'].fill(str(dataRef.dataId[self.multi_item_type])+'_'+
-                                           str(dataRef.dataId[self.item_type]))
-            else:
-                extra_col_dict['CCD'].fill(dataRef.dataId[self.item_type])
+        if self.config.column_processes:
+            # Farm out the reading, masking and column generation for each catalog to a pool of
+            # processes, and gather the columns and masks from all the catalogs.
+            store, sys_test_masks = self.computeColumnsInProcesses(dataRefList)
+            sys_test_cols = [self.getSysTestColumns(sys_test) for sys_test in self.sys_tests]
+        else:
+            # The catalogs are read from the butler in parallel, and each is cleaned up and masked
+            # as soon as it arrives.  A patch that exists in dataRefList but has no catalog is
+            # skipped (and left out of dataRefList, so that the dataRefs and catalogs stay
+            # aligned).
+            loaded = PrefetchCatalogs(dataRefList, self.loadCatalog, self.prepareCatalog,
+                                      n_threads=self.config.prefetch_threads,
+                                      on_skip=lambda dataRef, e: print(e, ', skip this patch'))
+            dataRefList = [dataRef for dataRef, catalog in loaded]
+            catalogs = [catalog for dataRef, catalog in loaded]
+            sys_data_list = []
+            extra_col_dicts = [self.makeDerivedColumns(dataRef, catalog)
+                               for dataRef, catalog in zip(dataRefList, catalogs)]
+
+            # Some tests need to know which data came from which CCD
+            for dataRef, catalog, extra_col_dict in zip(dataRefList, catalogs, extra_col_dicts):
+                extra_col_dict['CCD'] = self.makeCCDColumn(dataRef, len(catalog))
+            for sys_test in self.sys_tests:
+                sys_test_data = SysTestData()
+                sys_test_data.sys_test_name = sys_test.name
+                # Masks expects: a tuple of tuples, with each tuple having a mask name and a mask,
+                # and one tuple for each required data set for the sys_test
+                temp_mask_tuple_list = [sys_test.getMasks(catalog, self.config)
+                                        for catalog in catalogs]
+                # cols expects: an iterable of iterables, describing for each required data set
+                # the set of extra required columns.
+                sys_test_data.cols_list = sys_test.getRequiredColumns()
+                if any([key in c for cols_list in sys_test_data.cols_list for c in cols_list
+                        for key in ['g1', 'g2', 'sigma']]):
+                    shape_masks = [[self._computeShapeMask(catalog, mask_type=mask[0])
+                                    for mask in mask_tuple_list]
+                                   for catalog, mask_tuple_list in zip(catalogs,
+                                                                       temp_mask_tuple_list)]
+                else:
+                    shape_masks = [[[True]*len(catalog) for mask in mask_tuple_list]
+                                   for catalog, mask_tuple_list in zip(catalogs,
+                                                                       temp_mask_tuple_list)]
+                # Now, temp_mask_tuple_list and shape_mask is ordered such that there is one list
+                # per catalog, and the list for each catalog iterates through the sys tests.  But we
+                # actually want one list per sys test, and the list for each sys test to iterate
+                # through the catalogs!  So this next line A) combines the new shape masks with the
+                # old flag masks, and B) switches the nesting of the mask list to be the ordering we
+                # expect.
+                sys_test_data.mask_tuple_list = [[(mask_tuple_list[i][0],
+                                               numpy.logical_and(mask_tuple_list[i][1],
+                                               shape_mask_list[i]))
+                        for mask_tuple_list, shape_mask_list in zip(temp_mask_tuple_list,
+                                                                    shape_masks)]
+                        for i in range(len(temp_mask_tuple_list[0]))]
+                for (mask_tuple_list, cols) in zip(sys_test_data.mask_tuple_list,
+                                                   sys_test_data.cols_list):
+                    for dataRef, mask, catalog, extra_col_dict in zip(dataRefList, mask_tuple_list,
+                                                                      catalogs, extra_col_dicts):
+                        self.generateColumns(dataRef, catalog, mask, cols, extra_col_dict)
+                # Some tests need to know which data came from which CCD, so we add a column for
+                # that here to make sure it's propagated through to the sys_tests.
+                sys_test_data.cols_list = [list(cols)+['CCD'] for cols in sys_test_data.cols_list]
+                sys_data_list.append(sys_test_data)
+            for sys_data in sys_data_list:
+                for cols in sys_data.cols_list:
+                    for c in cols:
+                        if '_sky' in c or '_chip' in c:
+                            cols.append('_'.join(c.split('_')[:-1]))
+            # Keep one copy of each column that any of the sys tests need, concatenated across the
+            # catalogs, and one mask over all its rows for each data set of each sys test.
+            sys_test_cols = [sys_data.cols_list for sys_data in sys_data_list]
+            store = self.makeColumnStore(catalogs, extra_col_dicts,
+                                         [cols for cols_list in sys_test_cols
+                                          for cols in cols_list])
+            sys_test_masks = [[numpy.concatenate([mask for mask_type, mask in mask_tuple_list])
+                               for mask_tuple_list in sys_data.mask_tuple_list]
+                              for sys_data in sys_data_list]
+        self.runSysTests(dir, filename_chips, data_id,
+                         ((sys_test, sys_test.name,
+                           # Each array selects its rows from the shared columns, rather than
+                           # masking and concatenating the columns of each catalog again.
+                           [store.makeArray(cols, mask)
+                            for cols, mask in zip(sys_test_cols[i], sys_test_masks[i])])
+                          for i, sys_test in enumerate(self.sys_tests)))
+        self.logCacheStats()
+
+    def loadCatalog(self, dataRef):
+        """Read the source catalog for ``dataRef`` from the butler.  Called from several threads
+        at once by :func:`run`."""
+        return dataRef.get(self.catalog_type, immediate=True,
+                           flags=afwTable.SOURCE_IO_NO_FOOTPRINTS)
+
+    def prepareCatalog(self, dataRef, catalog):
+        """
+        Remove the flagged objects from a newly read ``catalog`` and make the masks that the sys
+        tests will ask for, which are kept with the catalog (see
+        :func:`stile.hsc.columns.CatalogColumns.cachedMask`), so that this work is done while the
+        other catalogs are still being read.
+        """
+        catalog = self.removeFlaggedObjects(catalog)
         for sys_test in self.sys_tests:
-            sys_test_data = SysTestData()
-            sys_test_data.sys_test_name = sys_test.name
-            # Masks expects: a tuple of tuples, with each tuple having a mask name and a mask,
-            # and one tuple for each required data set for the sys_test
-            temp_mask_tuple_list = [sys_test.getMasks(catalog, self.config) for catalog in catalogs]
-            # cols expects: an iterable of iterables, describing for each required data set
-            # the set of extra required columns.
-            sys_test_data.cols_list = sys_test.getRequiredColumns()
-            if any([key in c for cols_list in sys_test_data.cols_list for c in cols_list
-                    for key in ['g1', 'g2', 'sigma']]):
-                shape_masks = [[self._computeShapeMask(catalog, mask_type=mask[0])
-                                for mask in mask_tuple_list]
-                                for catalog, mask_tuple_list in zip(catalogs, temp_mask_tuple_list)]
-            else:
-                shape_masks = [[[True]*len(catalog) for mask in mask_tuple_list]
-                               for catalog, mask_tuple_list in zip(catalogs, temp_mask_tuple_list)]
-            # Now, temp_mask_tuple_list and shape_mask is ordered such that there is one list per
-            # catalog, and the list for each catalog iterates through the sys tests.  But we
-            # actually want one list per sys test, and the list for each sys test to iterate through
-            # the catalogs!  So this next line A) combines the new shape masks with the old flag
-            # masks, and B) switches the nesting of the mask list to be the ordering we expect.
-            sys_test_data.mask_tuple_list = [[(mask_tuple_list[i][0],
-                                           numpy.logical_and(mask_tuple_list[i][1],
-                                           shape_mask_list[i]))
-                    for mask_tuple_list, shape_mask_list in zip(temp_mask_tuple_list, shape_masks)]
-                    for i in range(len(temp_mask_tuple_list[0]))]
-            for (mask_tuple_list, cols) in zip(sys_test_data.mask_tuple_list,
-                                               sys_test_data.cols_list):
-                for dataRef, mask, catalog, extra_col_dict in zip(dataRefList, mask_tuple_list,
-                                                                  catalogs, extra_col_dicts):
-                    self.generateColumns(dataRef, catalog, mask, cols, extra_col_dict)
-            # Some tests need to know which data came from which CCD, so we add a column for that
-            # here to make sure it's propagated through to the sys_tests.
-            sys_test_data.cols_list = [list(cols)+['CCD'] for cols in sys_test_data.cols_list]
-            sys_data_list.append(sys_test_data)
-        for sys_data in sys_data_list:
-            for cols in sys_data.cols_list:
-                for c in cols:
-                    if '_sky' in c or '_chip' in c:
-                        cols.append('_'.join(c.split('_')[:-1]))
-        for sys_test, sys_test_data in zip(self.sys_tests, sys_data_list):
-            new_catalogs = []
-            for mask_tuple_list, cols in zip(sys_test_data.mask_tuple_list,
-                                             sys_test_data.cols_list):
-                new_catalog = {}
-                for column in cols:
-                    for catalog, extra_col_dict, (mask_type, mask) in zip(catalogs, extra_col_dicts,
-                                                                          mask_tuple_list):
-                        if column in extra_col_dict:
-                            newcol = extra_col_dict[column][mask]
-                        elif column in catalog.schema:
-                            key = catalog.schema.find(column).key
-                            try:
-                                newcol = catalog.get(key)[mask]
-                            except LsstCppException:
-                                newcol = numpy.array([src.get(key) for src in catalog])[mask]
-                        # The new_catalog dict has values which are lists of the quantity we want,
-                        # one per dataRef.
-                        if column in new_catalog:
-                            new_catalog[column].append(newcol)
-                        else:
-                            new_catalog[column] = [newcol]
-                new_catalogs.append(self.makeArray(new_catalog))
-            results = sys_test(self.config, *new_catalogs)
-            this_max_path_length = max_path_length-4-len(sys_test_data.sys_test_name)
-            if isinstance(results, numpy.ndarray):
-                stile.WriteASCIITable(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chips[:this_max_path_length]+'.dat'),
-                      results, print_header=True)
-            if hasattr(sys_test.sys_test, 'getData'):
-                stile.WriteASCIITable(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chips[:this_max_path_length]+'.dat'),
-                      sys_test.sys_test.getData(), print_header=True)
-            if hasattr(results, 'savefig'):
-                results.savefig(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chips[:this_max_path_length]+'.png'))
-            fig = sys_test.sys_test.plot(results)
-            fig.savefig(os.path.join(dir,
-                      sys_test_data.sys_test_name+filename_chips[:this_max_path_length]+'.png'))
+            sys_test.getMasks(catalog, self.config)
+        return catalog
+
+    def makeCCDColumn(self, dataRef, length):
+        """Return an array of ``length`` copies of the label of the CCD (or patch) of ``dataRef``,
+        for the ``'CCD'`` column."""
+        column = numpy.zeros(length, dtype=self.config.ccd_type)
+        if self.multi_item_type:
+            column.fill(str(dataRef.dataId[self.multi_item_type])+'_'+
+                        str(dataRef.dataId[self.item_type]))
+        else:
+            column.fill(dataRef.dataId[self.item_type])
+        return column
+
+    def getSysTestColumns(self, sys_test):
+        """
+        Return the lists of the columns in the input arrays of ``sys_test`` (one list per data
+        set) in the visit-level tasks: its required columns, ``'CCD'``, and the names without
+        ``_sky`` or ``_chip`` of any shape columns.
+        """
+        cols_list = [list(cols)+['CCD'] for cols in sys_test.getRequiredColumns()]
+        for cols in cols_list:
+            for c in cols:
+                if '_sky' in c or '_chip' in c:
+                    cols.append('_'.join(c.split('_')[:-1]))
+        return cols_list
+
+    def computeCatalogColumns(self, dataRef, catalog):
+        """
+        Do the masking and column generation of :func:`run` for a single catalog (already passed
+        through :func:`prepareCatalog`).
+
+        :returns: A tuple of a :class:`stile.hsc.columns.ColumnStore` of the columns (including
+                  ``'CCD'``) that the sys tests need from the catalog, and a list with one element
+                  per sys test, each a list with one boolean mask per data set of the sys test.
+        """
+        extra_col_dict = self.makeDerivedColumns(dataRef, catalog)
+        extra_col_dict['CCD'] = self.makeCCDColumn(dataRef, len(catalog))
+        masks = []
+        cols_lists = []
+        for sys_test in self.sys_tests:
+            cols_list = [list(cols) for cols in sys_test.getRequiredColumns()]
+            do_shape_mask = any([key in c for cols in cols_list for c in cols
+                                 for key in ['g1', 'g2', 'sigma']])
+            # The masks are made writable copies, since generateColumns updates them.
+            mask_tuple_list = [(mask_type, numpy.logical_and(mask,
+                                    self._computeShapeMask(catalog, mask_type)
+                                    if do_shape_mask else True))
+                               for mask_type, mask in sys_test.getMasks(catalog, self.config)]
+            for mask_tuple, cols in zip(mask_tuple_list, cols_list):
+                self.generateColumns(dataRef, catalog, mask_tuple, cols, extra_col_dict)
+            masks.append([mask for mask_type, mask in mask_tuple_list])
+            cols_lists += self.getSysTestColumns(sys_test)
+        return self.makeColumnStore([catalog], [extra_col_dict], cols_lists), masks
+
+    def computeColumnsInProcesses(self, dataRefList):
+        """
+        Read, mask and generate the columns of the catalog of each of ``dataRefList`` in a pool of
+        ``config.column_processes`` processes (see :func:`computeCatalogColumns`), and gather the
+        results.  Each process makes its own copy of this task from its class and config.  Missing
+        catalogs are skipped, as in :func:`run`.
+
+        :returns: A tuple of a :class:`stile.hsc.columns.ColumnStore` of the columns of all the
+                  catalogs, and a list with one element per sys test, each a list with one mask
+                  over all the rows of the store per data set of the sys test.
+        """
+        n_processes = self.config.column_processes
+        per_catalog = ProcessMap(_computeCatalogColumns, dataRefList,
+                                 n_processes=None if n_processes < 0 else n_processes,
+                                 initializer=_initColumnWorker, initargs=(type(self), self.config))
+        return GatherColumns([columns for columns in per_catalog if columns is not None])
 
     def makeArray(self, catalog_dict):
         """
@@ -1142,7 +1533,7 @@ class PatchSingleEpochStileTask(CCDSingleEpochStileTask):
 
     def getCalibData(self, dataRef, shape_cols):
         calib_metadata_shape = None
-        calib_metadata = dataRef.get("deepCoadd_calexp_md", immediate=True)
+        calib_metadata = self.getCalibDataset(dataRef, "deepCoadd_calexp_md")
         calib_type = "calexp"  # This is just so computeShapes knows the format
         if shape_cols:
             calib_metadata_shape = calib_metadata
@@ -1186,6 +1577,8 @@ class TractSingleEpochStileConfig(CCDSingleEpochStileConfig):
         doc="y limit for whisker plot", default=[None, None])
     whiskerplot_scale = lsst.pex.config.Field(dtype=float,
         doc="length of whisker per inch", default=0.4)
+    whiskerplot_aggregate = lsst.pex.config.Field(dtype=bool,
+        doc="draw one whisker per grid cell instead of one per object", default=True)
     # Generate a list of flag columns to be used in the .removeFlaggedObjects() method
     flags_keep_false = lsst.pex.config.ListField(dtype=str,
         doc="Flags that indicate unrecoverable failures",
@@ -1313,7 +1706,7 @@ class TractSingleEpochStileTask(VisitSingleEpochStileTask):
 
     def getCalibData(self, dataRef, shape_cols):
         calib_metadata_shape = None
-        calib_metadata = dataRef.get("deepCoadd_calexp_md", immediate=True)
+        calib_metadata = self.getCalibDataset(dataRef, "deepCoadd_calexp_md")
         calib_type = "calexp"  # This is just so computeShapes knows the format
         if shape_cols:
             calib_metadata_shape = calib_metadata
@@ -0,0 +1,108 @@
+"""
+calib.py: Caches of calibration data for the HSC/LSST tasks.
+
+The tasks need the same calibration metadata (``calexp_md``, ``fcr_md``, ...) for every sys test and
+every mask on a CCD, and the photometric correction of each CCD at the position of every source.
+:class:`LRUCache` keeps recently fetched metadata so it is read from the butler once, and
+:class:`CorrectionGrid` evaluates a smooth correction on a coarse grid and interpolates it to all
+the sources at once.
+"""
+
+import collections
+import numpy
+from .shapes import JacobianGrid
+
+
+class LRUCache(object):
+    """
+    A dict-like cache of at most ``max_size`` items, which discards the least recently used item
+    when it is full.  Use :func:`get` to fetch an item, computing it if it isn't already cached::
+
+        >>> cache = LRUCache(32)
+        >>> metadata = cache.get(('calexp_md', visit, ccd),
+        ...                      lambda: dataRef.get('calexp_md', immediate=True))
+
+    The numbers of ``hits`` (items found in the cache) and ``misses`` (items that had to be
+    computed) are kept, and the fraction of hits is available as ``hit_rate``.
+
+    :param max_size: The largest number of items to keep.  [default: 32]
+    """
+    def __init__(self, max_size=32):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1, not %s'%max_size)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key, compute):
+        """
+        Return the item for ``key`` (which must be hashable), calling ``compute()`` to make it if it
+        isn't in the cache.  If ``compute()`` raises an exception, nothing is cached.
+        """
+        if key in self._items:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+        self.misses += 1
+        value = compute()
+        self._items[key] = value
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return value
+
+    @property
+    def hit_rate(self):
+        """The fraction of calls to :func:`get` that found their item in the cache (0 if there
+        have been none)."""
+        n_calls = self.hits+self.misses
+        return float(self.hits)/n_calls if n_calls else 0.
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        """Remove every item from the cache (but keep the hit and miss counts)."""
+        self._items.clear()
+
+    def __str__(self):
+        return '%i hits, %i misses (hit rate %.2f), %i/%i items'%(
+            self.hits, self.misses, self.hit_rate, len(self), self.max_size)
+
+
+class CorrectionGrid(JacobianGrid):
+    """
+    A grid of the values of a smoothly varying scalar correction, such as the photometric
+    correction (in magnitudes) of a CCD from ``lsst.meas.mosaic.FluxFitParams``, which evaluates
+    the correction only at the grid nodes and bilinearly interpolates it to any number of positions
+    in one step.  The grid is refined as for :class:`stile.hsc.shapes.JacobianGrid`, except that
+    ``tolerance`` is the largest acceptable *absolute* error of the interpolated correction.
+
+    :param evaluate:  A function taking pixel coordinates ``(x, y)`` (floats) and returning the
+                      correction there: ``ffp.eval``, for example.
+    :param xlim:      The ``(min, max)`` x range to cover.
+    :param ylim:      The ``(min, max)`` y range to cover.
+    :param n_cells:   The initial number of grid cells ``(nx, ny)``. [default: (4, 8)]
+    :param tolerance: The largest acceptable absolute error. [default: 1.E-4]
+    :param max_cells: The largest number of grid cells to use. [default: 4096]
+    :param n_check:   The number of cell centers at which to check the error. [default: 64]
+    """
+    def __init__(self, evaluate, xlim, ylim, n_cells=(4, 8), tolerance=1.E-4, max_cells=4096,
+                 n_check=64):
+        JacobianGrid.__init__(self, evaluate, xlim, ylim, n_cells=n_cells, tolerance=tolerance,
+                              max_cells=max_cells, n_check=n_check)
+
+    def _evaluate(self, x, y):
+        self.n_evaluations += len(x)
+        return numpy.array([self.linearize(float(xx), float(yy)) for xx, yy in zip(x, y)],
+                           dtype=float)
+
+    def maxError(self, x, y):
+        """
+        Return the largest absolute error of the interpolated correction at positions ``(x, y)``,
+        compared to exact evaluations.
+        """
+        return numpy.max(numpy.abs(self.interpolate(x, y)-self._evaluate(x, y)))
@@ -0,0 +1,240 @@
+"""
+columns.py: Whole-column access to LSST source catalogs for the HSC/LSST tasks.
+
+An LSST source catalog can only be read a column at a time if its records are contiguous in memory,
+which is no longer true once it has been indexed with a boolean mask; reading a masked catalog means
+looping over its records in Python.  A :class:`CatalogColumns` object instead keeps the contiguous
+catalog and applies masks to the NumPy column arrays, so every column of every subset is read as a
+whole.
+"""
+
+import json
+import numpy
+
+
+class CatalogColumns(object):
+    """
+    A view of an LSST source catalog (or of a subset of its rows) that serves every column as a
+    NumPy array.  It supports the parts of the catalog interface that the HSC tasks use on whole
+    catalogs--``len()``, ``schema``, ``isContiguous()``, ``get(key)``, ``getX()``, ``getY()`` and
+    indexing by a column name or a boolean mask--so it can be passed anywhere a contiguous catalog
+    could be.
+
+    Indexing with a column name returns that column as an array; each column is read from the
+    catalog once and kept, so masks and sys tests that use the same column share it.  Indexing with
+    a boolean mask (or an array of row indices) returns a :class:`CatalogColumns` for those rows,
+    which shares the columns of the full catalog rather than copying any records.
+
+    Masks (such as the object-type masks of the sys tests) can also be kept with the catalog, with
+    :func:`cachedMask`, so that each is computed only once however many tests ask for it.
+
+    :param catalog: An LSST source catalog.  If its records are not contiguous (if it is itself the
+                    result of masking another catalog) it is deep-copied, once, so that they are.
+    """
+    def __init__(self, catalog):
+        if not catalog.isContiguous():
+            catalog = catalog.copy(deep=True)
+        self.catalog = catalog
+        self.schema = catalog.schema
+        self.rows = None
+        self._parent = None
+        self._columns = {}
+        self._masks = {}
+        self._length = len(catalog)
+
+    def select(self, rows):
+        """
+        Return a :class:`CatalogColumns` for the subset of these rows given by ``rows``, a boolean
+        mask or an array of row indices.
+        """
+        rows = numpy.asarray(rows)
+        if rows.dtype == bool:
+            if len(rows) != len(self):
+                raise ValueError('Mask has length %i, but the catalog has %i rows'%(len(rows),
+                                                                                   len(self)))
+            rows = numpy.flatnonzero(rows)
+        root = self if self._parent is None else self._parent
+        subset = object.__new__(CatalogColumns)
+        subset.catalog = self.catalog
+        subset.schema = self.schema
+        subset.rows = rows if self.rows is None else self.rows[rows]
+        subset._parent = root
+        subset._columns = {}
+        subset._masks = {}
+        subset._length = len(rows)
+        return subset
+
+    def __len__(self):
+        return self._length
+
+    def isContiguous(self):
+        """Always True: every column can be read as a whole."""
+        return True
+
+    def _read(self, name, read):
+        # Columns of the full catalog are read with ``read(catalog)``; those of a subset are taken
+        # from the full catalog's column.
+        if name not in self._columns:
+            if self._parent is None:
+                self._columns[name] = numpy.asarray(read(self.catalog))
+            else:
+                self._columns[name] = self._parent._read(name, read)[self.rows]
+        return self._columns[name]
+
+    def column(self, name):
+        """Return the column ``name`` (eg ``'flux.psf'``) as a NumPy array."""
+        return self._read(name, lambda catalog: catalog.get(self.schema.find(name).key))
+
+    def get(self, key):
+        """Return the column for the schema key ``key`` as a NumPy array."""
+        column = numpy.asarray(self.catalog.get(key))
+        return column if self.rows is None else column[self.rows]
+
+    def getX(self):
+        """Return the x centroids as a NumPy array."""
+        return self._read('__x', lambda catalog: catalog.getX())
+
+    def getY(self):
+        """Return the y centroids as a NumPy array."""
+        return self._read('__y', lambda catalog: catalog.getY())
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.column(item)
+        return self.select(item)
+
+    def flagMask(self, keep_false=(), keep_true=()):
+        """
+        Return a boolean array which is True for the rows where none of the flags named in
+        ``keep_false`` and all of those named in ``keep_true`` are set.  The flags are combined into
+        a single array in place, rather than making and then combining one mask per flag.
+        """
+        bad = numpy.zeros(len(self), dtype=bool)
+        for flag in keep_false:
+            numpy.logical_or(bad, self.column(flag), out=bad)
+        for flag in keep_true:
+            numpy.logical_or(bad, numpy.logical_not(self.column(flag)), out=bad)
+        return numpy.logical_not(bad, out=bad)
+
+    def cachedMask(self, key, compute):
+        """
+        Return the boolean mask for these rows stored under ``key``, which must be hashable,
+        computing it as ``compute(self)`` the first time it is asked for.  The stored mask is made
+        read-only, since it is shared by every caller; combine it with other masks into a new array
+        (``numpy.logical_and(mask, other)``) rather than changing it in place.
+        """
+        if key not in self._masks:
+            mask = numpy.asarray(compute(self), dtype=bool)
+            if mask.shape != (len(self),):
+                raise ValueError('Mask %s has shape %s for a catalog of %i rows'%(
+                                 key, mask.shape, len(self)))
+            mask.setflags(write=False)
+            self._masks[key] = mask
+        return self._masks[key]
+
+
+class ColumnStore(object):
+    """
+    A single copy of each of the columns that the sys tests need from one or more catalogs (such as
+    the CCDs of a visit), each concatenated across the catalogs.  The input array for a data set of
+    a sys test is then made with :func:`makeArray` by selecting its rows from these columns, rather
+    than by masking and concatenating the columns of every catalog again for every sys test.
+
+    A :class:`ColumnStore` holds only NumPy arrays, so it can be pickled and sent between
+    processes; stores made separately for each catalog can be joined with :func:`concatenate`.
+
+    :param lengths: The number of rows of each catalog. [default: (), meaning no catalogs]
+    """
+    def __init__(self, lengths=()):
+        self.lengths = [int(length) for length in lengths]
+        self._columns = {}
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def names(self):
+        """Return a list of the names of the columns, in the order they were added."""
+        return list(self._columns)
+
+    def addColumn(self, name, parts):
+        """
+        Add the column ``name``, given as a list ``parts`` of arrays with one array (of the right
+        length) for each catalog.
+        """
+        if len(parts) != len(self.lengths):
+            raise ValueError('Column %s has %i parts for %i catalogs'%(name, len(parts),
+                                                                        len(self.lengths)))
+        for part, length in zip(parts, self.lengths):
+            if len(part) != length:
+                raise ValueError('Column %s has %i rows for a catalog of %i rows'%(name, len(part),
+                                                                                   length))
+        if len(parts) == 1:
+            self._columns[name] = numpy.asarray(parts[0])
+        else:
+            self._columns[name] = numpy.concatenate(parts)
+
+    @staticmethod
+    def concatenate(stores):
+        """
+        Return a :class:`ColumnStore` of the catalogs of all of ``stores``, in order, with the
+        columns that every store has.
+        """
+        stores = list(stores)
+        store = ColumnStore([length for s in stores for length in s.lengths])
+        if stores:
+            for name in stores[0].names():
+                if all(name in s for s in stores):
+                    store._columns[name] = numpy.concatenate([s[name] for s in stores])
+        return store
+
+    def makeArray(self, names, rows=None):
+        """
+        Return a formatted NumPy array of the columns ``names`` (leaving out any repeats, and any
+        columns not in the store) for the selected ``rows``.
+
+        :param names: A list of column names.
+        :param rows:  A boolean mask over all the rows of the store, or an array of row indices.
+                      [default: None, meaning all the rows]
+        """
+        names = [name for name in dict.fromkeys(names) if name in self._columns]
+        if rows is not None:
+            rows = numpy.asarray(rows)
+            if rows.dtype == bool:
+                if len(rows) != len(self):
+                    raise ValueError('Mask has length %i, but the store has %i rows'%(len(rows),
+                                                                                     len(self)))
+                rows = numpy.flatnonzero(rows)
+        length = len(self) if rows is None else len(rows)
+        data = numpy.zeros(length, dtype=[(name, self._columns[name].dtype,
+                                           self._columns[name].shape[1:]) for name in names])
+        for name in names:
+            data[name] = self._columns[name] if rows is None else self._columns[name][rows]
+        return data
+
+
+def ConfigKey(config):
+    """
+    Return a hashable description of ``config`` for use in a :func:`CatalogColumns.cachedMask`
+    key: a string of its values, if it is an LSST config object (or anything else with a
+    ``toDict()`` method), else the object itself if it is hashable, else its ``id()``.
+    """
+    if hasattr(config, 'toDict'):
+        return json.dumps(config.toDict(), sort_keys=True, default=str)
+    try:
+        hash(config)
+        return config
+    except TypeError:
+        return id(config)
+
+
+def AsColumns(catalog):
+    """Return ``catalog`` as a :class:`CatalogColumns`, if it is not one already."""
+    if isinstance(catalog, CatalogColumns):
+        return catalog
+    return CatalogColumns(catalog)
@@ -0,0 +1,181 @@
+"""
+derived.py: Quantities computed from the columns of a source catalog for the HSC/LSST tasks.
+
+The sys tests need quantities, such as ``mag``, ``ra`` or ``g1_sky``, that aren't columns of the
+source catalog but are computed from its columns (and the calibration data), and each sys test
+needs them only for the rows of its own masks.  A :class:`DerivedColumns` object knows how each
+quantity is computed and from which other quantities, and keeps a bitmap of the rows it has
+computed so far for each one, so that a quantity is computed for each row at most once however
+many sys tests and masks ask for it.
+"""
+
+import numpy
+
+
+class _Rule(object):
+    # How to compute a group of columns that are always computed together, and which rows of them
+    # have been computed (``done``) and are usable (``valid``) so far.
+    def __init__(self, names, inputs, compute, length):
+        self.names = names
+        self.inputs = inputs
+        self.compute = compute
+        self.done = numpy.zeros(length, dtype=bool)
+        self.valid = numpy.zeros(length, dtype=bool)
+
+
+class DerivedColumns(object):
+    """
+    The quantities computed from a catalog of ``length`` rows, each a NumPy array over all the rows
+    of the catalog but computed only for the rows that have been asked for.
+
+    Each group of quantities that is computed together is declared with :func:`define`, along with
+    the columns it is computed from; then :func:`compute` computes a list of quantities for a mask
+    of rows, first computing any of their inputs that are themselves derived quantities, and
+    skipping the rows that have already been computed.  For example, ``w`` is computed from
+    ``g1_err_sky`` and ``g2_err_sky``, which are computed from the shape moments, their errors and
+    the WCS::
+
+        >>> derived = DerivedColumns(len(catalog))
+        >>> derived.define(['g1_err_sky', 'g2_err_sky', 'sigma_err_sky'],
+        ...                ['shape.sdss', 'shape.sdss.err', 'wcs'], computeShapeErrors)
+        >>> derived.define(['w'], ['g1_err_sky', 'g2_err_sky'], computeWeights)
+        >>> valid = derived.compute(['w'], galaxy_mask)
+
+    Columns that are known for every row, such as the CCD number of each object, can be set
+    directly, as with a dict: ``derived['CCD'] = ccd``.  Indexing with a quantity name returns its
+    column, and ``name in derived`` is True once :func:`compute` has been called for a quantity
+    (even for no rows) or it has been set, so a :class:`DerivedColumns` can be used in place of a
+    dict of extra columns.  The values in the
+    rows that haven't been computed are meaningless; :func:`computed` returns which rows have been.
+
+    :param length: The number of rows in the catalog.
+    """
+    def __init__(self, length):
+        self.length = length
+        self._rules = {}
+        self._columns = {}
+
+    def define(self, names, inputs, compute):
+        """
+        Declare how to compute the quantities ``names``, which are computed together.
+
+        :param names:   A list of the names of the quantities.  Each quantity can only be defined
+                        once.
+        :param inputs:  A list of the names of the columns and other data they are computed from.
+                        Those that are quantities defined here are computed (for the same rows)
+                        first; the others (such as catalog columns or ``'calib'``) are only a
+                        record of what the quantities depend on.
+        :param compute: A function taking an array of row indices, plus any keyword arguments
+                        given to :func:`compute` (such as the ``mask_type`` of the rows), and
+                        returning a tuple of a dict whose keys include ``names`` and whose values
+                        are arrays of the quantities for those rows, and either None or an array of
+                        bools indicating which of those rows have usable values.  Other keys of the
+                        dict are ignored.
+        """
+        names = list(names)
+        for name in names:
+            if name in self._rules or name in self._columns:
+                raise ValueError('Column %s is already defined'%name)
+        rule = _Rule(names, list(inputs), compute, self.length)
+        for name in names:
+            self._rules[name] = rule
+
+    def isDefined(self, name):
+        """Return True if the quantity ``name`` can be computed (or has been set)."""
+        return name in self._rules or name in self._columns
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __setitem__(self, name, values):
+        values = numpy.asarray(values)
+        if len(values) != self.length:
+            raise ValueError('Column %s has length %i, not %i'%(name, len(values), self.length))
+        if name in self._rules:
+            raise ValueError('Column %s is already defined'%name)
+        self._columns[name] = values
+
+    def computed(self, name):
+        """Return a (read-only) array of bools indicating which rows of ``name`` are computed."""
+        if name in self._rules:
+            done = self._rules[name].done.view()
+            done.flags.writeable = False
+            return done
+        elif name in self._columns:
+            return numpy.ones(self.length, dtype=bool)
+        raise ValueError('No rule to compute column %s'%name)
+
+    def order(self, names):
+        """
+        Return a list of the names of the derived quantities needed to compute ``names``
+        (including any of ``names`` themselves), in an order in which each comes after all the
+        derived quantities it is computed from.
+        """
+        order = []
+        visited = set()
+        in_progress = set()
+
+        def visit(name, required):
+            if name not in self._rules:
+                if required and name not in self._columns:
+                    raise ValueError('No rule to compute column %s'%name)
+                return
+            rule = self._rules[name]
+            if id(rule) in visited:
+                return
+            if id(rule) in in_progress:
+                raise ValueError('Column %s depends on itself'%name)
+            in_progress.add(id(rule))
+            for input_name in rule.inputs:
+                visit(input_name, False)
+            in_progress.remove(id(rule))
+            visited.add(id(rule))
+            order.extend(rule.names)
+
+        for name in names:
+            visit(name, True)
+        return order
+
+    def compute(self, names, rows, **kwargs):
+        """
+        Compute the quantities ``names`` (and any derived quantities they are computed from) for
+        the rows selected by the boolean mask ``rows``, except for those rows already computed.
+        Each group of quantities is computed for all its missing rows at once, and after the
+        quantities it depends on.
+
+        :param names:  A list of the names of the quantities.  Each must be defined with
+                       :func:`define` or set directly.
+        :param rows:   A boolean mask of the rows to compute.
+        :param kwargs: Keyword arguments to pass to the ``compute`` function of each group.
+        :returns:      An array of bools over all the rows of the catalog which is False for the
+                       rows in ``rows`` where any of the quantities (or the quantities they depend
+                       on) is unusable, and True everywhere else.
+        """
+        rows = numpy.asarray(rows, dtype=bool)
+        if len(rows) != self.length:
+            raise ValueError('Mask has length %i, but there are %i rows'%(len(rows), self.length))
+        valid = numpy.ones(self.length, dtype=bool)
+        computed_rules = set()
+        for name in self.order(names):
+            rule = self._rules[name]
+            if id(rule) in computed_rules:
+                continue
+            computed_rules.add(id(rule))
+            missing = numpy.flatnonzero(rows & ~rule.done)
+            # The columns are made the first time the group is computed, even if no rows are
+            # asked for, so that they exist for every catalog whatever its masks select.
+            if len(missing) or any(rule_name not in self._columns for rule_name in rule.names):
+                values, rule_valid = rule.compute(missing, **kwargs)
+                for rule_name in rule.names:
+                    column = numpy.asarray(values[rule_name])
+                    if rule_name not in self._columns:
+                        self._columns[rule_name] = numpy.zeros((self.length,)+column.shape[1:],
+                                                               dtype=column.dtype)
+                    self._columns[rule_name][missing] = column
+                rule.done[missing] = True
+                rule.valid[missing] = True if rule_valid is None else rule_valid
+            valid[rows] &= rule.valid[rows]
+        return valid
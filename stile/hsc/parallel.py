@@ -0,0 +1,120 @@
+"""
+parallel.py: Concurrent loading and processing of per-CCD (or per-patch) catalogs for the HSC/LSST
+tasks.
+
+Reading a catalog from the butler is mostly waiting on I/O, so the multi-catalog tasks read their
+catalogs from a pool of threads and process each one as soon as it arrives, rather than reading them
+all one after another before doing any work.  The masking and column generation for each catalog
+can also be spread over a pool of processes, with :func:`ProcessMap`, and the resulting columns
+and masks gathered for all the catalogs with :func:`GatherColumns`.
+"""
+
+import concurrent.futures
+import os
+import numpy
+from .columns import ColumnStore
+
+
+def PrefetchCatalogs(items, load, process=None, n_threads=8, skip_errors=(RuntimeError,),
+                     on_skip=None):
+    """
+    Load a catalog for each of ``items`` (such as the dataRefs of the CCDs in a visit) with
+    ``load(item)``, using a pool of at most ``n_threads`` threads, and call ``process(item,
+    catalog)`` on each catalog as soon as it has been loaded, while the others are still loading.
+    ``process`` is always called in the calling thread, one catalog at a time, so it needn't be
+    thread-safe.
+
+    Items whose ``load`` raises one of the exceptions in ``skip_errors`` (for example, a patch that
+    is in the data ID list but has no catalog) are left out, after calling ``on_skip(item,
+    exception)`` if given.  Any other exception is raised once the loads already started have
+    finished.
+
+    :param items:       An iterable of the items to load.
+    :param load:        A function taking an item and returning its catalog.
+    :param process:     A function taking an item and its catalog and returning the processed
+                        catalog.  [default: None, meaning return the catalogs as loaded]
+    :param n_threads:   The largest number of catalogs to load at once; 1 or less loads them one
+                        at a time in the calling thread.  [default: 8]
+    :param skip_errors: A tuple of the exception types that mean an item should be skipped.
+                        [default: (RuntimeError,)]
+    :param on_skip:     A function called with each skipped item and its exception.  [default: None]
+    :returns:           A list of ``(item, catalog)`` pairs, in the order of ``items``, for the
+                        items that were not skipped.
+    """
+    items = list(items)
+    results = [None]*len(items)
+    loaded = [False]*len(items)
+
+    def finish(i, load_call):
+        try:
+            catalog = load_call()
+        except skip_errors as e:
+            if on_skip is not None:
+                on_skip(items[i], e)
+            return
+        results[i] = process(items[i], catalog) if process is not None else catalog
+        loaded[i] = True
+
+    if n_threads <= 1 or len(items) <= 1:
+        for i, item in enumerate(items):
+            finish(i, lambda: load(item))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = dict((executor.submit(load, item), i) for i, item in enumerate(items))
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    finish(futures[future], future.result)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    return [(item, result) for item, result, ok in zip(items, results, loaded) if ok]
+
+
+def ProcessMap(function, items, n_processes=None, initializer=None, initargs=()):
+    """
+    Return ``[function(item) for item in items]``, computed in a pool of ``n_processes`` processes.
+    ``function``, ``items``, ``initargs`` and the results must all be picklable, so ``function``
+    should be defined at the top level of a module.  Each process calls ``initializer(*initargs)``
+    once when it starts, if given: to set up a task object for ``function`` to use, for example.
+
+    :param function:    The function to call on each item.
+    :param items:       An iterable of the items.
+    :param n_processes: The number of processes. [default: None, meaning one per CPU core]
+    :param initializer: A function to call in each process when it starts. [default: None]
+    :param initargs:    A tuple of the arguments for ``initializer``. [default: ()]
+    :returns:           A list of the results, in the order of ``items``.
+    """
+    items = list(items)
+    if n_processes is None:
+        n_processes = os.cpu_count() or 1
+    n_processes = max(1, min(n_processes, len(items)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_processes, initializer=initializer,
+                                                initargs=initargs) as executor:
+        return list(executor.map(function, items))
+
+
+def GatherColumns(per_catalog):
+    """
+    Gather the columns and masks computed separately for each of several catalogs into one
+    :class:`stile.hsc.columns.ColumnStore` for all the catalogs, and one mask over all of its rows
+    for each data set of each sys test.
+
+    :param per_catalog: A list with one ``(store, masks)`` pair per catalog, where ``store`` is a
+                        :class:`stile.hsc.columns.ColumnStore` of the catalog's columns and
+                        ``masks`` is a list with one element per sys test, each a list with one
+                        boolean mask per data set of the sys test.
+    :returns:           A tuple of the :class:`stile.hsc.columns.ColumnStore` of all the catalogs
+                        (in the order of ``per_catalog``) and the list of lists of masks, each
+                        concatenated across the catalogs.
+    """
+    if not per_catalog:
+        return ColumnStore(), []
+    stores = [store for store, masks in per_catalog]
+    first_masks = per_catalog[0][1]
+    for store, masks in per_catalog:
+        if [len(sys_test) for sys_test in masks] != [len(sys_test) for sys_test in first_masks]:
+            raise ValueError('Catalogs have masks for different sys tests or data sets')
+    masks = [[numpy.concatenate([catalog_masks[i][j] for store, catalog_masks in per_catalog])
+              for j in range(len(first_masks[i]))] for i in range(len(first_masks))]
+    return ColumnStore.concatenate(stores), masks
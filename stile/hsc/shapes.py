@@ -0,0 +1,217 @@
+"""
+shapes.py: Vectorized shape-moment calculations for the HSC/LSST tasks.
+
+These functions work on whole columns of an LSST source catalog at once, rather than on one source
+record at a time, and on arrays of local linear transforms of shape ``(N, 2, 2)``.  They do not
+import the LSST stack themselves, so they can be used (and tested) with any object that provides
+the parts of the source catalog interface they need.
+"""
+
+import numpy
+from .columns import AsColumns
+
+
+def GetColumn(catalog, key):
+    """
+    Return the values of the field ``key`` (a schema key) for every row of ``catalog`` as a NumPy
+    array.  Catalogs whose records are not contiguous (such as the result of masking a catalog
+    with a boolean array) are read through a :class:`stile.hsc.columns.CatalogColumns` copy.
+    """
+    if not catalog.isContiguous():
+        catalog = AsColumns(catalog)
+    return numpy.asarray(catalog.get(key))
+
+
+def MomentColumns(catalog, field):
+    """
+    Return arrays ``(ixx, iyy, ixy)`` of the second moments in the moments field named ``field``
+    (eg ``'shape.sdss'``) of ``catalog``.
+    """
+    if not catalog.isContiguous():
+        catalog = AsColumns(catalog)
+    key = catalog.schema.find(field).key
+    return tuple(numpy.asarray(catalog.get(k)) for k in (key.getIxx(), key.getIyy(), key.getIxy()))
+
+
+def CovarianceColumns(catalog, field):
+    """
+    Return the ``(N, 3, 3)`` array of the covariance matrices in the covariance field named
+    ``field`` (eg ``'shape.sdss.err'``) of ``catalog``, in the (xx, yy, xy) order of the LSST
+    moments covariances.
+    """
+    if not catalog.isContiguous():
+        catalog = AsColumns(catalog)
+    key = catalog.schema.find(field).key
+    covariances = numpy.empty((len(catalog), 3, 3))
+    for i in range(3):
+        for j in range(i, 3):
+            covariances[:, i, j] = catalog.get(key[i, j])
+            covariances[:, j, i] = covariances[:, i, j]
+    return covariances
+
+
+def TransformMoments(ixx, iyy, ixy, transforms):
+    """
+    Apply the local linear transforms ``transforms``, an array of shape ``(N, 2, 2)``, to the
+    second moments ``(ixx, iyy, ixy)`` (each an array of length N): that is, return the moments of
+    ``L M L^T``, where ``M`` is the moments matrix and ``L`` the transform for each object.
+    """
+    l00, l01 = transforms[:, 0, 0], transforms[:, 0, 1]
+    l10, l11 = transforms[:, 1, 0], transforms[:, 1, 1]
+    new_ixx = l00**2*ixx + 2.*l00*l01*ixy + l01**2*iyy
+    new_iyy = l10**2*ixx + 2.*l10*l11*ixy + l11**2*iyy
+    new_ixy = l00*l10*ixx + (l00*l11+l01*l10)*ixy + l01*l11*iyy
+    return new_ixx, new_iyy, new_ixy
+
+
+def TransformMomentVariances(var_ixx, var_iyy, var_ixy, transforms):
+    """
+    Propagate the variances ``(var_ixx, var_iyy, var_ixy)`` of the second moments through the
+    local linear transforms ``transforms`` (an ``(N, 2, 2)`` array), ignoring the covariances
+    between the moments.
+    """
+    l00, l01 = transforms[:, 0, 0], transforms[:, 0, 1]
+    l10, l11 = transforms[:, 1, 0], transforms[:, 1, 1]
+    new_var_ixx = l00**4*var_ixx + (2.*l00*l01)**2*var_ixy + l01**4*var_iyy
+    new_var_iyy = l10**4*var_ixx + (2.*l10*l11)**2*var_ixy + l11**4*var_iyy
+    new_var_ixy = ((l00*l10)**2*var_ixx + (l00*l11+l01*l10)**2*var_ixy +
+                   (l01*l11)**2*var_iyy)
+    return new_var_ixx, new_var_iyy, new_var_ixy
+
+
+def ShapesFromMoments(ixx, iyy, ixy):
+    """
+    Return the distortion ``(g1, g2)`` and the size ``sigma`` (the fourth root of the determinant of
+    the moments matrix) for second moments ``(ixx, iyy, ixy)``.
+    """
+    g1 = (ixx-iyy)/(ixx+iyy)
+    g2 = 2.*ixy/(ixx+iyy)
+    sigma = (ixx*iyy - ixy**2)**0.25
+    return g1, g2, sigma
+
+
+def ShapeErrorsFromMoments(ixx, iyy, ixy, var_ixx, var_iyy, var_ixy):
+    """
+    Return the errors ``(g1_err, g2_err, sigma_err)`` of the quantities returned by
+    :func:`ShapesFromMoments`, given the variances of the moments.
+    """
+    trace = ixx+iyy
+    sigma3 = (ixx*iyy - ixy**2)**0.75
+    g1_err = numpy.sqrt((2.*iyy/trace**2)**2*var_ixx + (2.*ixx/trace**2)**2*var_iyy)
+    g2_err = numpy.sqrt((2.*ixy/trace**2)**2*(var_ixx+var_iyy) + (2./trace)**2*var_ixy)
+    sigma_err = numpy.sqrt((0.25*iyy/sigma3)**2*var_ixx + (0.25*ixx/sigma3)**2*var_iyy +
+                           (0.5*ixy/sigma3)**2*var_ixy)
+    return g1_err, g2_err, sigma_err
+
+
+def CentroidColumns(catalog):
+    """Return arrays ``(x, y)`` of the centroids of the sources in ``catalog``, in pixels."""
+    if not catalog.isContiguous():
+        catalog = AsColumns(catalog)
+    return numpy.asarray(catalog.getX()), numpy.asarray(catalog.getY())
+
+
+class JacobianGrid(object):
+    """
+    A cache of the local linear transforms (Jacobians) of a smoothly varying map, such as the WCS of
+    a CCD, which evaluates the exact transform only on a coarse grid of pixel positions and
+    bilinearly interpolates the ``2x2`` matrices to any number of positions in one step.
+
+    When it is made, the grid is checked against exact evaluations at the centers of the grid
+    cells, where the interpolation error is largest.  If the largest relative error (in the
+    Frobenius norm) is more than ``tolerance``, the grid is refined by a factor of 2 in each
+    direction, up to ``max_cells`` cells; if it still isn't accurate enough, every position is
+    evaluated exactly instead.  The error that was found is available as ``max_error``.
+
+    :param linearize: A function taking pixel coordinates ``(x, y)`` (floats) and returning the
+                      ``2x2`` matrix of the local linear transform there: for an LSST WCS, for
+                      example, ``lambda x, y: wcs.linearizePixelToSky(afwGeom.Point2D(x, y))
+                      .getLinear().getMatrix()``.
+    :param xlim:      The ``(min, max)`` x range to cover.
+    :param ylim:      The ``(min, max)`` y range to cover.  Positions outside the ranges are
+                      extrapolated from the nearest cell.
+    :param n_cells:   The initial number of grid cells ``(nx, ny)``. [default: (4, 8)]
+    :param tolerance: The largest acceptable relative error. [default: 1.E-5]
+    :param max_cells: The largest number of grid cells to use. [default: 4096]
+    :param n_check:   The number of cell centers at which to check the error; all of them if there
+                      are fewer. [default: 64]
+    """
+    def __init__(self, linearize, xlim, ylim, n_cells=(4, 8), tolerance=1.E-5, max_cells=4096,
+                 n_check=64):
+        self.linearize = linearize
+        self.xlim = (float(xlim[0]), float(xlim[1]))
+        self.ylim = (float(ylim[0]), float(ylim[1]))
+        if self.xlim[1] <= self.xlim[0]:
+            self.xlim = (self.xlim[0]-0.5, self.xlim[0]+0.5)
+        if self.ylim[1] <= self.ylim[0]:
+            self.ylim = (self.ylim[0]-0.5, self.ylim[0]+0.5)
+        self.tolerance = tolerance
+        self.n_evaluations = 0
+        nx, ny = n_cells
+        while True:
+            self._makeGrid(nx, ny)
+            self.max_error = self._checkError(n_check)
+            if self.max_error <= tolerance or 4*nx*ny > max_cells:
+                break
+            nx, ny = 2*nx, 2*ny
+        self.exact = self.max_error > tolerance
+
+    def _evaluate(self, x, y):
+        self.n_evaluations += len(x)
+        return numpy.array([self.linearize(float(xx), float(yy))
+                            for xx, yy in zip(x, y)]).reshape(len(x), 2, 2)
+
+    def _makeGrid(self, nx, ny):
+        self.n_cells = (nx, ny)
+        self.x_nodes = numpy.linspace(self.xlim[0], self.xlim[1], nx+1)
+        self.y_nodes = numpy.linspace(self.ylim[0], self.ylim[1], ny+1)
+        x, y = numpy.meshgrid(self.x_nodes, self.y_nodes)
+        values = self._evaluate(x.ravel(), y.ravel())
+        self.grid = values.reshape((ny+1, nx+1)+values.shape[1:])
+
+    def _checkError(self, n_check):
+        nx, ny = self.n_cells
+        x_centers = 0.5*(self.x_nodes[1:]+self.x_nodes[:-1])
+        y_centers = 0.5*(self.y_nodes[1:]+self.y_nodes[:-1])
+        x, y = [c.ravel() for c in numpy.meshgrid(x_centers, y_centers)]
+        if len(x) > n_check:
+            index = numpy.linspace(0, len(x)-1, n_check).astype(int)
+            x, y = x[index], y[index]
+        return self.maxError(x, y)
+
+    def maxError(self, x, y):
+        """
+        Return the largest relative error (in the Frobenius norm) of the interpolated transforms at
+        positions ``(x, y)``, compared to exact evaluations.
+        """
+        exact = self._evaluate(x, y)
+        difference = numpy.sqrt(numpy.sum((self.interpolate(x, y)-exact)**2, axis=(1, 2)))
+        return numpy.max(difference/numpy.sqrt(numpy.sum(exact**2, axis=(1, 2))))
+
+    def interpolate(self, x, y):
+        """Return the bilinearly interpolated transforms at ``(x, y)`` as an ``(N, 2, 2)``
+        array."""
+        # Written for any shape of grid values, so that child classes can interpolate other
+        # quantities.
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        nx, ny = self.n_cells
+        fx = (x-self.xlim[0])/(self.xlim[1]-self.xlim[0])*nx
+        fy = (y-self.ylim[0])/(self.ylim[1]-self.ylim[0])*ny
+        ix = numpy.clip(numpy.floor(fx).astype(int), 0, nx-1)
+        iy = numpy.clip(numpy.floor(fy).astype(int), 0, ny-1)
+        grid = self.grid
+        value_axes = (slice(None),)+(numpy.newaxis,)*(grid.ndim-2)
+        tx = (fx-ix)[value_axes]
+        ty = (fy-iy)[value_axes]
+        return ((1.-ty)*((1.-tx)*grid[iy, ix]+tx*grid[iy, ix+1]) +
+                ty*((1.-tx)*grid[iy+1, ix]+tx*grid[iy+1, ix+1]))
+
+    def __call__(self, x, y):
+        """
+        Return the transforms at positions ``(x, y)`` as an ``(N, 2, 2)`` array: interpolated from
+        the grid, or evaluated exactly if the grid could not meet the error tolerance.
+        """
+        if self.exact:
+            return self._evaluate(numpy.asarray(x), numpy.asarray(y))
+        return self.interpolate(x, y)
@@ -3,29 +3,24 @@ sys_test_adapters.py: Contains classes to wrap Stile systematics tests with func
 HSC/LSST pipeline.
 """
 import lsst.pex.config
-from lsst.pex.exceptions import LsstCppException
 from .. import sys_tests
+from .columns import AsColumns, ConfigKey
 import numpy
 
 adapter_registry = lsst.pex.config.makeRegistry("Stile test outputs")
 
 
 # We need to mask the data to particular object types; these pick out the flags we need to do that.
+# The data are read through a CatalogColumns object, which serves each column as a whole NumPy array
+# even when the catalog has already been masked.
 def MaskGalaxy(data, config):
     """
     Given ``data``, an LSST source catalog, return a NumPy boolean array describing which rows
     correspond to galaxies.
     """
     # Will have to be more careful/clever about this when classification.extendedness is
-    # continuous. These arrays are generally contiguous in memory--so we can just index them like a
-    # NumPy recarray.
-    try:
-        return data['classification.extendedness'] == 1
-    except LsstCppException:
-        # But sometimes we've already masked the array--this will work in that case (but is slower
-        # than above if the above is possible).
-        key = data.schema.find('classification.extendedness').key
-        return numpy.array([src[key] == 1 for src in data])
+    # continuous.
+    return AsColumns(data)['classification.extendedness'] == 1
 
 
 def MaskStar(data, config):
@@ -33,11 +28,7 @@ def MaskStar(data, config):
     Given ``data``, an LSST source catalog, return a NumPy boolean array describing which rows
     correspond to stars.
     """
-    try:
-        return data['classification.extendedness'] == 0
-    except LsstCppException:
-        key = data.schema.find('classification.extendedness').key
-        return numpy.array([src[key] == 0 for src in data])
+    return AsColumns(data)['classification.extendedness'] == 0
 
 
 def MaskBrightStar(data, config):
@@ -46,11 +37,9 @@ def MaskBrightStar(data, config):
     correspond to bright stars according to a given S/N cutoff set by
     ``config.bright_star_sn_cutoff``.
     """
+    data = AsColumns(data)
     star_mask = MaskStar(data, config)
-    key_psf = data.schema.find('flux.psf').key
-    key_psf_err = data.schema.find('flux.psf.err').key
-    bright_mask = (numpy.array([src[key_psf]/src[key_psf_err] for src in data]) >
-                   config.bright_star_sn_cutoff)
+    bright_mask = data['flux.psf']/data['flux.psf.err'] > config.bright_star_sn_cutoff
     return numpy.logical_and(star_mask, bright_mask)
 
 
@@ -59,16 +48,10 @@ def MaskPSFStar(data, config):
     Given ``data``, an LSST source catalog, return a NumPy boolean array describing which rows
     correspond to the stars used to determine the PSF.
     """
-    try:
+    data = AsColumns(data)
+    if 'calib.psf.used' in data.schema:
         return data['calib.psf.used'] == True
-    except LsstCppException:
-        try:
-            key = data.schema.find('calib.psf.used').key
-        except KeyError:
-            key = data.schema.find('calib.psf.used.any').key
-        key_shape = data.schema.find('shape.sdss.flags').key
-        return numpy.logical_and(numpy.array([src.get(key) == True for src in data]),
-                                 numpy.array([src.get(key_shape) == False for src in data]))
+    return data['calib.psf.used.any'] == True
 
 # Map the object type strings onto the above functions.
 mask_dict = {'galaxy': MaskGalaxy,
@@ -78,6 +61,23 @@ mask_dict = {'galaxy': MaskGalaxy,
              'star PSF': MaskPSFStar}
 
 
+def ConfigFields(config, fields):
+    """
+    Return a dict of the values of the ``fields`` of ``config`` (or None for those it doesn't have),
+    with the list and dict fields of an LSST config as plain lists and dicts, so that they can be
+    hashed (see :func:`stile.RunManifest.hashInputs`).
+    """
+    values = {}
+    for field in fields:
+        value = getattr(config, field, None)
+        if hasattr(value, 'items'):
+            value = dict(value)
+        elif hasattr(value, '__iter__') and not isinstance(value, str):
+            value = list(value)
+        values[field] = value
+    return values
+
+
 class BaseSysTestAdapter(object):
     """
     This is an abstract class, implementing a couple of useful masking and column functions for
@@ -119,6 +119,23 @@ class BaseSysTestAdapter(object):
     # (inheriting from lsst.pex.config.Config) and the ConfigClass of the SysTestAdapter set to be
     # that class.  (There are examples in previous versions of this file.)
     ConfigClass = lsst.pex.config.Config
+    # The fields of the task config which :func:`__call__` passes on to the sys test.
+    task_config_fields = ()
+
+    def getConfig(self, task_config):
+        """
+        Return a dict of the configuration which affects the results of this test: this adapter's
+        own config, the fields of ``task_config`` listed in ``self.task_config_fields`` (those
+        that :func:`__call__` uses), and the object types of the masks (with the S/N cutoff, if
+        the masks include bright stars).
+        """
+        config = {'adapter': self.config.toDict() if hasattr(self.config, 'toDict') else None,
+                  'objects': list(self.objects_list)}
+        fields = list(self.task_config_fields)
+        if 'star bright' in self.objects_list:
+            fields.append('bright_star_sn_cutoff')
+        config.update(ConfigFields(task_config, fields))
+        return config
 
     def setupMasks(self, objects_list=None):
         """
@@ -143,13 +160,22 @@ class BaseSysTestAdapter(object):
         Given ``data``, a source catalog from the LSST pipeline, return a list of masks.  Each
         element of the list is a mask corresponding to a particular object type, such as "star" or
         "galaxy."
+
+        The masks are kept with the catalog (see
+        :func:`stile.hsc.columns.CatalogColumns.cachedMask`), keyed by the object type, mask
+        function and config, so sys tests that need the same objects share one mask.  The masks
+        returned are read-only.
         
-        :param data:  An LSST source catalog.
+        :param data:  An LSST source catalog, preferably as a
+                      :class:`stile.hsc.columns.CatalogColumns` object.
         :returns:     A list of NumPy arrays; each array is made up of bools that can be broadcast
                       to index the data, returning only the rows that meet the requirements of the
                       mask.
         """
-        return [(obj, mask_func(data, config))
+        data = AsColumns(data)
+        config_key = ConfigKey(config)
+        return [(obj, data.cachedMask((obj, mask_func, config_key),
+                                      lambda data, mask_func=mask_func: mask_func(data, config)))
                 for obj, mask_func in zip(self.objects_list, self.mask_funcs)]
 
 
@@ -192,6 +218,7 @@ class ShapeSysTestAdapter(BaseSysTestAdapter):
     """
     shape_fields = ['g1', 'g2', 'sigma', 'g1_err', 'g2_err', 'sigma_err',
                     'psf_g1', 'psf_g2', 'psf_sigma', 'psf_g1_err', 'psf_g2_err', 'psf_sigma_err']
+    task_config_fields = ('treecorr_kwargs',)
 
     def getRequiredColumns(self):
         """
@@ -279,6 +306,8 @@ class StatsPSFFluxAdapter(ShapeSysTestAdapter):
 
     In the future, we plan to have this be more configurable; for now, this works as a test.
     """
+    task_config_fields = ()
+
     def __init__(self, config):
         self.config = config
         self.sys_test = sys_tests.StatSysTest(field='flux.psf')
@@ -287,22 +316,21 @@ class StatsPSFFluxAdapter(ShapeSysTestAdapter):
         self.objects_list = ['galaxy']
 
     def MaskPSFFlux(self, data, config):
+        data = AsColumns(data)
         base_mask = mask_dict['galaxy'](data, config)
-        try:
-            additional_mask = data['flux.psf.flags'] == 0
-        except LsstCppException:
-            key = data.schema.find('flux.psf.flags').key
-            additional_mask = numpy.array([src.get(key) == False for src in data])
-        return numpy.logical_and(base_mask, additional_mask)
+        return numpy.logical_and(base_mask, data.flagMask(['flux.psf.flags']))
 
     def getRequiredColumns(self):
         return (('flux.psf',),)
 
     def __call__(self, task_config, *data, **kwargs):
-        return self.sys_test(*data, verbose=True, **kwargs)
+        return self.sys_test(*data, verbose=True, keep_state=True, **kwargs)
 
 
 class WhiskerPlotStarAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('whiskerplot_scale', 'whiskerplot_figsize', 'whiskerplot_xlim',
+                          'whiskerplot_ylim', 'whiskerplot_aggregate')
+
     def __init__(self, config):
         self.shape_type = 'chip'
         self.config = config
@@ -315,10 +343,14 @@ class WhiskerPlotStarAdapter(ShapeSysTestAdapter):
         return self.sys_test(*new_data, linewidth=0.01, scale=task_config.whiskerplot_scale,
                               figsize=task_config.whiskerplot_figsize,
                               xlim=task_config.whiskerplot_xlim,
-                              ylim=task_config.whiskerplot_ylim)
+                              ylim=task_config.whiskerplot_ylim,
+                              aggregate=task_config.whiskerplot_aggregate)
 
 
 class WhiskerPlotPSFAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('whiskerplot_scale', 'whiskerplot_figsize', 'whiskerplot_xlim',
+                          'whiskerplot_ylim', 'whiskerplot_aggregate')
+
     def __init__(self, config):
         self.shape_type = 'chip'
         self.config = config
@@ -331,10 +363,14 @@ class WhiskerPlotPSFAdapter(ShapeSysTestAdapter):
         return self.sys_test(*new_data, linewidth=0.01, scale=task_config.whiskerplot_scale,
                               figsize=task_config.whiskerplot_figsize,
                               xlim=task_config.whiskerplot_xlim,
-                              ylim=task_config.whiskerplot_ylim)
+                              ylim=task_config.whiskerplot_ylim,
+                              aggregate=task_config.whiskerplot_aggregate)
 
 
 class WhiskerPlotResidualAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('whiskerplot_scale', 'whiskerplot_figsize', 'whiskerplot_xlim',
+                          'whiskerplot_ylim', 'whiskerplot_aggregate')
+
     def __init__(self, config):
         self.shape_type = 'chip'
         self.config = config
@@ -347,10 +383,30 @@ class WhiskerPlotResidualAdapter(ShapeSysTestAdapter):
         return self.sys_test(*new_data, linewidth=0.01, scale=task_config.whiskerplot_scale,
                               figsize=task_config.whiskerplot_figsize,
                               xlim=task_config.whiskerplot_xlim,
-                              ylim=task_config.whiskerplot_ylim)
+                              ylim=task_config.whiskerplot_ylim,
+                              aggregate=task_config.whiskerplot_aggregate)
+
+
+class FocalPlaneMapAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('focalplanemap_xlim', 'focalplanemap_ylim', 'focalplanemap_nbins')
+
+    def __init__(self, config):
+        self.shape_type = 'chip'
+        self.config = config
+        self.sys_test = sys_tests.FocalPlaneMapSysTest()
+        self.name = self.sys_test.short_name
+        self.setupMasks()
+
+    def __call__(self, task_config, *data):
+        new_data = [self.fixArray(d) for d in data]
+        return self.sys_test(*new_data, xlim=task_config.focalplanemap_xlim,
+                             ylim=task_config.focalplanemap_ylim,
+                             n_bins=task_config.focalplanemap_nbins)
 
 
 class ScatterPlotStarVsPSFG1Adapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -369,6 +425,8 @@ class ScatterPlotStarVsPSFG1Adapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotStarVsPSFG2Adapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -387,6 +445,8 @@ class ScatterPlotStarVsPSFG2Adapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotStarVsPSFSigmaAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -405,6 +465,8 @@ class ScatterPlotStarVsPSFSigmaAdapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotResidualVsPSFG1Adapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -423,6 +485,8 @@ class ScatterPlotResidualVsPSFG1Adapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotResidualVsPSFG2Adapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -441,6 +505,8 @@ class ScatterPlotResidualVsPSFG2Adapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotResidualVsPSFSigmaAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -459,6 +525,8 @@ class ScatterPlotResidualVsPSFSigmaAdapter(ShapeSysTestAdapter):
 
 
 class ScatterPlotResidualSigmaVsPSFMagAdapter(ShapeSysTestAdapter):
+    task_config_fields = ('scatterplot_per_ccd_stat',)
+
     def __init__(self, config):
         self.shape_type = 'sky'
         self.config = config
@@ -484,6 +552,7 @@ adapter_registry.register("Rho1", Rho1Adapter)
 adapter_registry.register("WhiskerPlotStar", WhiskerPlotStarAdapter)
 adapter_registry.register("WhiskerPlotPSF", WhiskerPlotPSFAdapter)
 adapter_registry.register("WhiskerPlotResidual", WhiskerPlotResidualAdapter)
+adapter_registry.register("FocalPlaneMap", FocalPlaneMapAdapter)
 adapter_registry.register("ScatterPlotStarVsPSFG1", ScatterPlotStarVsPSFG1Adapter)
 adapter_registry.register("ScatterPlotStarVsPSFG2", ScatterPlotStarVsPSFG2Adapter)
 adapter_registry.register("ScatterPlotStarVsPSFSigma", ScatterPlotStarVsPSFSigmaAdapter)
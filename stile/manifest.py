@@ -0,0 +1,130 @@
+"""
+manifest.py: A record of which systematics tests have been run on which data, so that an
+interrupted or reconfigured run only has to redo the tests whose inputs have changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy
+
+
+class RunManifest(object):
+    """
+    A SQLite database recording, for each unit of work--a systematics test run on the data for one
+    data ID (such as a visit and CCD) and, optionally, one bin--a hash of the inputs and
+    configuration and the locations of the outputs.
+
+    A task computes the hash of a unit's inputs with :func:`hashInputs` and asks :func:`isDone`
+    whether the unit has already been run with the same inputs; if not, it runs the test and then
+    calls :func:`record` once the unit's outputs have been written.  Each record is committed
+    immediately, so if the task dies partway through, the units recorded before then are not run
+    again (as long as the task records each unit as soon as its outputs are on disk, rather than
+    all of them at the end).  Several processes can use the same manifest at once.
+
+    Output locations are strings: either file names, or ``file_name::dataset`` for a dataset in a
+    file such as a :class:`stile.ResultStore`.  A unit is only considered done if all its output
+    files still exist.
+
+    :param file_name: The SQLite file, which is created if it does not exist.
+    :param timeout:   How long (in seconds) to wait for another process writing to the manifest.
+                      [default: 60]
+    """
+    def __init__(self, file_name, timeout=60.):
+        self.file_name = file_name
+        self._connection = sqlite3.connect(file_name, timeout=timeout)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS units (sys_test TEXT NOT NULL, data_id TEXT NOT NULL, '
+                'bins TEXT NOT NULL, input_hash TEXT NOT NULL, outputs TEXT NOT NULL, '
+                'time REAL NOT NULL, PRIMARY KEY (sys_test, data_id, bins))')
+
+    @staticmethod
+    def _encode(value):
+        """A canonical string for a data ID or bin description (a dict, list, string or None)."""
+        return json.dumps(value, sort_keys=True, default=str)
+
+    @staticmethod
+    def hashInputs(*arrays, **kwargs):
+        """
+        Return a hash of the NumPy arrays ``arrays`` (their types, shapes and contents) and of any
+        keyword arguments, which should describe the configuration: for example,
+        ``hashInputs(data, random, config=config_dict)``.  Keyword arguments are hashed through
+        their JSON representation, or their ``str()`` for objects which have none.
+        """
+        sha = hashlib.sha1()
+        for array in arrays:
+            if array is None:
+                sha.update(b'None')
+                continue
+            array = numpy.ascontiguousarray(array)
+            sha.update(str((array.dtype.descr, array.shape)).encode())
+            sha.update(array.data if not array.dtype.hasobject else str(array.tolist()).encode())
+        sha.update(RunManifest._encode(kwargs).encode())
+        return sha.hexdigest()
+
+    def get(self, sys_test, data_id, bins=None):
+        """
+        Return the record for ``sys_test`` run on ``data_id`` and ``bins`` as a dict with keys
+        ``input_hash``, ``outputs`` and ``time``, or None if there is none.
+        """
+        row = self._connection.execute(
+            'SELECT input_hash, outputs, time FROM units WHERE sys_test=? AND data_id=? AND bins=?',
+            (sys_test, self._encode(data_id), self._encode(bins))).fetchone()
+        if row is None:
+            return None
+        return {'input_hash': row[0], 'outputs': json.loads(row[1]), 'time': row[2]}
+
+    def isDone(self, sys_test, data_id, input_hash, bins=None):
+        """
+        Return True if ``sys_test`` has been run on ``data_id`` and ``bins`` with inputs whose hash
+        is ``input_hash``, and all of its output files exist.
+        """
+        record = self.get(sys_test, data_id, bins)
+        if record is None or record['input_hash'] != input_hash:
+            return False
+        return all(os.path.exists(output.split('::')[0]) for output in record['outputs'])
+
+    def record(self, sys_test, data_id, input_hash, outputs, bins=None):
+        """
+        Record that ``sys_test`` has been run on ``data_id`` and ``bins`` with inputs whose hash is
+        ``input_hash``, writing the list of ``outputs``.  Replaces any earlier record for the unit.
+        """
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)',
+                (sys_test, self._encode(data_id), self._encode(bins), input_hash,
+                 json.dumps(list(outputs)), time.time()))
+
+    def query(self, sys_test=None, **data_id):
+        """
+        Return a list of the records (as dicts with keys ``sys_test``, ``data_id``, ``bins``,
+        ``input_hash``, ``outputs`` and ``time``) for ``sys_test`` (or all tests, if None) whose
+        data IDs include the given items: ``query('Rho1', visit=1228)``, for example.
+        """
+        if sys_test is None:
+            rows = self._connection.execute('SELECT * FROM units')
+        else:
+            rows = self._connection.execute('SELECT * FROM units WHERE sys_test=?', (sys_test,))
+        records = []
+        for row in rows:
+            record = {'sys_test': row[0], 'data_id': json.loads(row[1]),
+                      'bins': json.loads(row[2]), 'input_hash': row[3],
+                      'outputs': json.loads(row[4]), 'time': row[5]}
+            if data_id and not (isinstance(record['data_id'], dict) and
+                                all(record['data_id'].get(k) == v for k, v in data_id.items())):
+                continue
+            records.append(record)
+        return records
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
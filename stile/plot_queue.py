@@ -0,0 +1,147 @@
+"""
+plot_queue.py: Deferred plot specifications and a pool of background processes to render them.
+
+Building a matplotlib figure and writing it to disk is often a large fraction of the time a
+systematics test takes.  A :class:`PlotSpec` records which plotting method to call and with what
+(array and parameter) arguments, without drawing anything; a :class:`PlotQueue` then renders specs
+and writes the files in worker processes while the main process moves on to the next data set.
+"""
+
+import copy
+import multiprocessing
+
+
+class PlotSpec(object):
+    """
+    A deferred call to a plotting method: ``getattr(obj, method)(*args, **kwargs)``, which should
+    return a :class:`matplotlib.figure.Figure` (or another object with a :func:`.savefig` method).
+
+    The object is copied (without its ``data`` attribute, which is not needed to plot and may be
+    large), so it can be modified or reused after the spec is made.  Sys tests whose
+    ``defer_plots`` attribute is True return a :class:`PlotSpec` instead of a figure.
+
+    :param obj:    The object whose method draws the plot, usually a
+                   :class:`stile.sys_tests.SysTest`.
+    :param method: The name of the plotting method.
+    :param args, kwargs: The arguments to pass to the plotting method.
+    """
+    def __init__(self, obj, method, *args, **kwargs):
+        self.obj = copy.copy(obj)
+        if hasattr(self.obj, '__dict__'):
+            self.obj.__dict__.pop('data', None)
+            # Reusable figures belong to the original object and aren't worth pickling.
+            self.obj.__dict__.pop('_figure_templates', None)
+            # The copy should draw the plot, not defer it again.
+            if getattr(self.obj, 'defer_plots', False):
+                self.obj.defer_plots = False
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def render(self):
+        """Draw the plot and return the figure."""
+        return getattr(self.obj, self.method)(*self.args, **self.kwargs)
+
+    def savefig(self, filename, **kwargs):
+        """Draw the plot, save it to ``filename`` (passing ``kwargs`` to the figure's
+        :func:`.savefig` method) and close the figure.  Returns ``filename``."""
+        fig = self.render()
+        try:
+            fig.savefig(filename, **kwargs)
+        finally:
+            if hasattr(fig, 'canvas'):
+                import matplotlib.pyplot as plt
+                plt.close(fig)
+        return filename
+
+
+def _savePlotSpec(spec, filename, kwargs):
+    return spec.savefig(filename, **kwargs)
+
+
+class PlotQueue(object):
+    """
+    A pool of worker processes which render :class:`PlotSpec` objects and write them to files in
+    the background.
+
+    :func:`submit` returns as soon as the spec has been handed to a worker, unless ``max_pending``
+    plots are already waiting, in which case it first waits for the oldest one to finish; this
+    limits the memory held by queued specs if plots are made faster than they can be rendered.
+    Call :func:`wait` (or use the queue as a context manager) to wait for all the outstanding plots
+    before exiting; errors raised while rendering are re-raised there, or by the :func:`submit`
+    call that waits for them.  :func:`unwritten` tells which files are not (yet) written.
+
+    :param processes:   The number of worker processes.  If 0, plots are rendered immediately in
+                        this process when they are submitted.
+                        [default: None, meaning the number of CPUs]
+    :param max_pending: The largest number of plots which may be waiting or rendering at once.
+                        [default: None, meaning twice the number of processes]
+    """
+    def __init__(self, processes=None, max_pending=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.max_pending = max_pending if max_pending is not None else max(2*processes, 1)
+        self._pending = []
+        self._failed = set()
+        self._pool = multiprocessing.Pool(processes) if processes > 0 else None
+
+    def submit(self, spec, filename, **kwargs):
+        """
+        Render ``spec`` and save it to ``filename`` in the background.  ``kwargs`` are passed to
+        :func:`.savefig`.  A :class:`matplotlib.figure.Figure` or any other object with a
+        :func:`.savefig` method can also be given, in which case it is saved immediately.
+        """
+        if not isinstance(spec, PlotSpec) or self._pool is None:
+            spec.savefig(filename, **kwargs)
+            return
+        # Drop the finished plots (re-raising any errors), then apply the backpressure.
+        ready = [index for index, (pending_filename, result) in enumerate(self._pending)
+                 if result.ready()]
+        for index in reversed(ready):
+            self._finish(index)
+        while len(self._pending) >= self.max_pending:
+            self._finish(0)
+        self._pending.append((filename,
+                              self._pool.apply_async(_savePlotSpec, (spec, filename, kwargs))))
+
+    def _finish(self, index):
+        # Wait for the plot self._pending[index], re-raising any error, and remember its file if
+        # it failed.
+        filename, result = self._pending.pop(index)
+        try:
+            result.get()
+        except Exception:
+            self._failed.add(filename)
+            raise
+
+    def unwritten(self):
+        """Return a set of the file names of the submitted plots which have not been written,
+        either because they are still waiting or rendering or because rendering them failed."""
+        return set(filename for filename, result in self._pending) | self._failed
+
+    def wait(self):
+        """Wait for all the submitted plots to be written."""
+        while self._pending:
+            self._finish(0)
+
+    def close(self):
+        """Wait for all the submitted plots, then shut down the worker processes."""
+        try:
+            self.wait()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
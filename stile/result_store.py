@@ -0,0 +1,252 @@
+"""
+result_store.py: A single-file store for the result arrays of many systematics tests.
+
+Writing every result of every test for every CCD or visit to its own file makes for a very large
+number of small files.  A :class:`ResultStore` instead keeps all the results of a run in one
+container, as named datasets keyed by the test name and identifiers such as the visit, CCD or bin.
+The default container is a zip archive of ``.npy`` files--the same format as :func:`numpy.savez`,
+so it can also be opened with :func:`numpy.load`--whose central directory serves as an index, so any
+single result can be read back without reading the others.  If h5py is installed, an HDF5 file can
+be used instead.
+"""
+
+import os
+import numpy
+
+
+class _NpzBackend(object):
+    """Reads and writes datasets as ``.npy`` members of a zip archive."""
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._reader = None
+        self._replaced = False
+
+    def write(self, arrays):
+        import io
+        import warnings
+        import zipfile
+        self._closeReader()
+        mode = 'a' if os.path.exists(self.file_name) else 'w'
+        with warnings.catch_warnings():
+            # Rewriting a dataset appends a second member with the same name; the zip index (and
+            # so read()) then refers to the newest one, and the old ones are dropped by compact().
+            warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+            with zipfile.ZipFile(self.file_name, mode, allowZip64=True) as zip_file:
+                existing = set(zip_file.namelist())
+                for name, array in arrays:
+                    buffer = io.BytesIO()
+                    numpy.lib.format.write_array(buffer, array, allow_pickle=False)
+                    self._replaced |= name+'.npy' in existing
+                    zip_file.writestr(name+'.npy', buffer.getvalue())
+
+    def compact(self):
+        """Rewrite the archive without the old copies of any datasets that have been replaced."""
+        import zipfile
+        self._closeReader()
+        if not os.path.exists(self.file_name):
+            return
+        temp_name = self.file_name+'.tmp'
+        with zipfile.ZipFile(self.file_name, 'r') as old_file:
+            # Later members with the same name replace earlier ones.
+            members = dict((info.filename, info) for info in old_file.infolist())
+            with zipfile.ZipFile(temp_name, 'w', allowZip64=True) as new_file:
+                for info in members.values():
+                    new_file.writestr(info, old_file.read(info))
+        os.replace(temp_name, self.file_name)
+        self._replaced = False
+
+    def _getReader(self):
+        if self._reader is None:
+            import zipfile
+            self._reader = zipfile.ZipFile(self.file_name, 'r')
+        return self._reader
+
+    def _closeReader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def read(self, name):
+        if not os.path.exists(self.file_name):
+            raise KeyError(name)
+        reader = self._getReader()
+        try:
+            member = reader.open(name+'.npy')
+        except KeyError:
+            raise KeyError(name)
+        with member:
+            return numpy.lib.format.read_array(member, allow_pickle=False)
+
+    def names(self):
+        if not os.path.exists(self.file_name):
+            return []
+        return [member[:-4] for member in dict.fromkeys(self._getReader().namelist())
+                if member.endswith('.npy')]
+
+    def close(self):
+        self._closeReader()
+        if self._replaced:
+            self.compact()
+
+
+class _HDF5Backend(object):
+    """Reads and writes datasets in an HDF5 file (requires h5py)."""
+    def __init__(self, file_name):
+        import h5py
+        self.file_name = file_name
+        self._file = h5py.File(file_name, 'a')
+
+    def write(self, arrays):
+        for name, array in arrays:
+            if name in self._file:
+                del self._file[name]
+            array = numpy.asarray(array)
+            self._file.create_dataset(name, data=array, chunks=True if array.ndim else None,
+                                      compression='gzip' if array.ndim else None)
+        self._file.flush()
+
+    def read(self, name):
+        if name not in self._file:
+            raise KeyError(name)
+        return self._file[name][()]
+
+    def names(self):
+        import h5py
+        names = []
+        self._file.visititems(
+            lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        return names
+
+    def close(self):
+        self._file.close()
+
+
+class ResultStore(object):
+    """
+    A container for the result arrays of a run of systematics tests, which stores every result as a
+    dataset named by the test and a set of keys: for example::
+
+        >>> with stile.ResultStore('results.npz') as store:
+        ...     store.write('StarXStarShear', results, visit=1228, ccd=49)
+        >>> store = stile.ResultStore('results.npz')
+        >>> store.keys('StarXStarShear')
+        [('StarXStarShear', {'ccd': 49, 'visit': 1228})]
+        >>> results = store.read('StarXStarShear', visit=1228, ccd=49)
+
+    Writes are kept in memory and added to the file in batches of ``flush_size`` datasets, and when
+    :func:`flush` or :func:`close` is called (or the store is used as a context manager and the
+    block exits), so the file is opened once per batch rather than once per result.  Writing a
+    dataset that is already in the store replaces it; in a zip archive, the new copy is added to the
+    end and the old one is removed when the store is closed, by rewriting the file once.  The values
+    in ``data`` may be any NumPy arrays, including formatted arrays, but not arrays of Python
+    objects.
+
+    A store can be written by only one process at a time; use one store per process (for example,
+    per CCD or visit) if tests run in parallel.
+
+    :param file_name:  The file to write to or read from.  It is created if it does not exist, and
+                       added to if it does.
+    :param flush_size: The number of datasets to hold in memory before adding them to the file.
+                       [default: 64]
+    :param backend:    ``'npz'`` for a zip archive of ``.npy`` files or ``'hdf5'`` for an HDF5 file.
+                       [default: None, meaning ``'hdf5'`` if ``file_name`` ends in ``.h5`` or
+                       ``.hdf5`` and ``'npz'`` otherwise]
+    """
+    def __init__(self, file_name, flush_size=64, backend=None):
+        if backend is None:
+            ext = os.path.splitext(file_name)[1].lower()
+            backend = 'hdf5' if ext in ('.h5', '.hdf5') else 'npz'
+        if backend == 'npz':
+            self._backend = _NpzBackend(file_name)
+        elif backend == 'hdf5':
+            self._backend = _HDF5Backend(file_name)
+        else:
+            raise ValueError("backend must be 'npz' or 'hdf5', not %s"%backend)
+        self.file_name = file_name
+        self.backend = backend
+        self.flush_size = flush_size
+        self._buffer = {}
+
+    @staticmethod
+    def makeName(test, **key):
+        """
+        Return the name of the dataset for ``test`` with the given keys: the test name followed by
+        ``key=value`` for each key, in alphabetical order of the keys, separated by slashes.
+        """
+        items = [str(test)]+[str(item) for k in sorted(key) for item in (k, key[k])]
+        for item in items:
+            if not item or '/' in item or '=' in item:
+                raise ValueError('Test names, keys and key values for a ResultStore cannot be '
+                                 'empty or contain "/" or "=": %s'%item)
+        return '/'.join([str(test)]+['%s=%s'%(k, key[k]) for k in sorted(key)])
+
+    @staticmethod
+    def parseName(name):
+        """Return the ``(test, key)`` pair for a dataset ``name`` made by :func:`makeName`."""
+        parts = name.split('/')
+        key = {}
+        for part in parts[1:]:
+            k, value = part.split('=')
+            for type in (int, float):
+                try:
+                    value = type(value)
+                    break
+                except ValueError:
+                    pass
+            key[k] = value
+        return parts[0], key
+
+    def write(self, test, data, **key):
+        """
+        Add the array ``data`` to the store as the result of ``test`` for the given ``key``
+        (``visit=1228, ccd=49``, for example).
+        """
+        data = numpy.asarray(data)
+        if data.dtype.hasobject:
+            raise TypeError('Arrays of Python objects cannot be written to a ResultStore')
+        self._buffer[self.makeName(test, **key)] = data
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Add all the datasets written since the last flush to the file."""
+        if self._buffer:
+            self._backend.write(list(self._buffer.items()))
+            self._buffer = {}
+
+    def read(self, test, **key):
+        """Return the result of ``test`` for the given ``key``.  Raises a KeyError if there is
+        none."""
+        name = self.makeName(test, **key)
+        if name in self._buffer:
+            return self._buffer[name]
+        try:
+            return self._backend.read(name)
+        except KeyError:
+            raise KeyError('No result in %s for %s'%(self.file_name, name))
+
+    def keys(self, test=None, **selection):
+        """
+        Return a list of ``(test, key)`` pairs for the datasets in the store, optionally only those
+        for ``test`` and whose keys include the given ``selection`` (``visit=1228``, for example).
+        """
+        names = list(dict.fromkeys(self._backend.names()+list(self._buffer)))
+        keys = []
+        for name in names:
+            this_test, key = self.parseName(name)
+            if test is not None and this_test != test:
+                continue
+            if all(k in key and key[k] == selection[k] for k in selection):
+                keys.append((this_test, key))
+        return keys
+
+    def close(self):
+        """Flush any remaining datasets to the file and close it."""
+        self.flush()
+        self._backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,178 @@
+"""
+stat_kernels.py: Vectorized weighted and robust statistics computed for many groups at once
+(for example, every CCD of a visit or every bin of a binned test) in a single call.
+
+Every function here takes a :class:`stile.groupby.GroupBy` object describing the groups, or
+``None`` to treat all the data as one group, and returns arrays with one entry per group in the
+order of ``grouped.keys``.
+"""
+
+import numpy
+from .groupby import GroupBy
+
+
+def _getGroups(grouped, values):
+    values = numpy.asarray(values, dtype=float).reshape(-1)
+    if grouped is None:
+        grouped = GroupBy(numpy.zeros(len(values), dtype=int))
+    return grouped, grouped._checkValues(values)
+
+
+def WeightedPercentiles(grouped, values, weights, percentiles):
+    """
+    Compute weighted percentiles of ``values`` within each group.
+
+    The data are sorted once by (group, value).  The cumulative sum of the weights then gives the
+    weighted cumulative distribution of each group, evaluated at the midpoint of each point's
+    weight, ``(cumsum(w)-w/2)/sum(w)``; the percentiles are linearly interpolated from that
+    distribution, and clipped to the smallest and largest values in the group.  With equal
+    weights, this is the "midpoint" (Hazen) definition of the percentiles.
+
+    :param grouped:     A :class:`stile.groupby.GroupBy` object, or None for a single group.
+    :param values:      A NumPy array of values.
+    :param weights:     A NumPy array of non-negative weights, or None for equal weights.
+    :param percentiles: An iterable of percentile levels, between 0 and 100.
+
+    :returns: an array of shape ``(number of groups, number of percentiles)``.
+    """
+    grouped, values = _getGroups(grouped, values)
+    if weights is None:
+        weights = numpy.ones(len(values))
+    weights = grouped._checkValues(numpy.asarray(weights, dtype=float))
+    if numpy.any(weights < 0):
+        raise ValueError('Weights for percentiles must be non-negative')
+    percentiles = 0.01*numpy.asarray(percentiles, dtype=float).reshape(-1)
+    # Points with zero weight don't contribute to the distribution at all, so drop them first.
+    order = numpy.lexsort((values, grouped.inverse))
+    order = order[weights[order] > 0]
+    values = values[order]
+    weights = weights[order]
+    group_index = grouped.inverse[order]
+    counts = numpy.bincount(group_index, minlength=grouped.n_groups)
+    total_weight = numpy.bincount(group_index, weights=weights, minlength=grouped.n_groups)
+    if numpy.any(total_weight <= 0):
+        raise ValueError('Every group must have a positive total weight')
+    cumulative = numpy.cumsum(weights)
+    # Subtract the weight in earlier groups, so each group's cumulative sum starts from zero.
+    cumulative -= numpy.repeat(numpy.cumsum(total_weight)-total_weight, counts)
+    cdf = (cumulative-0.5*weights)/total_weight[group_index]
+    # Adding the group index to the per-group cdf (which lies in [0, 1]) gives a single sorted
+    # array, so one searchsorted call finds the bracketing points for every group at once.
+    key = group_index+cdf
+    targets = (numpy.arange(grouped.n_groups)[:, numpy.newaxis] +
+               percentiles[numpy.newaxis, :])
+    upper = numpy.searchsorted(key, targets)
+    starts = (numpy.cumsum(counts)-counts)[:, numpy.newaxis]
+    ends = starts+counts[:, numpy.newaxis]-1
+    upper = numpy.clip(upper, starts, ends)
+    lower = numpy.clip(upper-1, starts, ends)
+    span = key[upper]-key[lower]
+    fraction = numpy.where(span > 0, (targets-key[lower])/numpy.where(span > 0, span, 1.), 0.)
+    fraction = numpy.clip(fraction, 0., 1.)
+    return values[lower]+fraction*(values[upper]-values[lower])
+
+
+def SigmaClippedMean(grouped, values, weights=None, n_sigma=3., max_iter=10):
+    """
+    Compute the iteratively sigma-clipped (optionally weighted) mean and standard deviation of
+    ``values`` within each group.
+
+    All groups are clipped together: at each iteration, the mean and standard deviation of the
+    points still included in each group are computed with :func:`numpy.bincount`, and points
+    further than ``n_sigma`` standard deviations from their group's mean are excluded.  The
+    iteration stops when no group changes (or after ``max_iter`` iterations).
+
+    :param grouped:     A :class:`stile.groupby.GroupBy` object, or None for a single group.
+    :param values:      A NumPy array of values.
+    :param weights:     A NumPy array of weights, or None for equal weights.  [default: None]
+    :param n_sigma:     The clipping threshold in units of the standard deviation. [default: 3]
+    :param max_iter:    The maximum number of clipping iterations. [default: 10]
+
+    :returns: a tuple of (mean, standard deviation, number of points kept), each an array with one
+              entry per group.
+    """
+    grouped, values = _getGroups(grouped, values)
+    if weights is None:
+        weights = numpy.ones(len(values))
+    weights = grouped._checkValues(numpy.asarray(weights, dtype=float))
+    keep = numpy.ones(len(values), dtype=bool)
+    n_kept = grouped.counts.copy()
+    for i in range(max_iter+1):
+        use_weights = weights*keep
+        sum_weights = grouped.sum(use_weights)
+        mean = grouped.sum(values, use_weights)/sum_weights
+        deviation = values-mean[grouped.inverse]
+        std = numpy.sqrt(grouped.sum(deviation*deviation, use_weights)/sum_weights)
+        if i == max_iter:
+            break
+        keep = numpy.abs(deviation) <= n_sigma*std[grouped.inverse]
+        new_n_kept = grouped.sum(keep)
+        if numpy.all(new_n_kept == n_kept):
+            break
+        n_kept = new_n_kept
+    return mean, std, n_kept.astype(int)
+
+
+def BiweightLocation(grouped, values, c=6.0, max_iter=1, tol=1.E-8):
+    """
+    Compute the Tukey biweight location of ``values`` within each group, starting from the group
+    medians and using the median absolute deviation (MAD) to set the scale.  With the default
+    ``max_iter=1`` this is the usual one-step estimator (as in
+    :func:`astropy.stats.biweight_location`); larger values iterate, for all groups together,
+    until the location changes by less than ``tol`` times the MAD in every group.
+
+    :param grouped:     A :class:`stile.groupby.GroupBy` object, or None for a single group.
+    :param values:      A NumPy array of values.
+    :param c:           The tuning constant, in units of the MAD. [default: 6.0]
+    :param max_iter:    The maximum number of iterations. [default: 1]
+    :param tol:         The convergence tolerance, in units of the MAD. [default: 1.E-8]
+
+    :returns: an array with the biweight location of each group.
+    """
+    grouped, values = _getGroups(grouped, values)
+    location = grouped.median(values)
+    mad = grouped.median(numpy.abs(values-location[grouped.inverse]))
+    # Groups with zero MAD have (more than) half their values equal to the median; keep that.
+    safe_mad = numpy.where(mad > 0, mad, 1.)
+    for i in range(max_iter):
+        deviation = values-location[grouped.inverse]
+        u = deviation/(c*safe_mad[grouped.inverse])
+        weight = numpy.where(numpy.abs(u) < 1, (1.-u*u)**2, 0.)
+        sum_weight = grouped.sum(weight)
+        safe_sum_weight = numpy.where(sum_weight > 0, sum_weight, 1.)
+        step = numpy.where((mad > 0) & (sum_weight > 0),
+                           grouped.sum(deviation, weight)/safe_sum_weight, 0.)
+        location = location+step
+        if numpy.all(numpy.abs(step) <= tol*safe_mad):
+            break
+    return location
+
+
+def BiweightScale(grouped, values, location=None, c=9.0):
+    """
+    Compute the biweight midvariance estimate of the scale (the square root of the biweight
+    midvariance) of ``values`` within each group, as in :func:`astropy.stats.biweight_scale`.
+
+    :param grouped:     A :class:`stile.groupby.GroupBy` object, or None for a single group.
+    :param values:      A NumPy array of values.
+    :param location:    An array with the location of each group.
+                        [default: None, meaning use the group medians]
+    :param c:           The tuning constant, in units of the MAD. [default: 9.0]
+
+    :returns: an array with the biweight scale of each group.
+    """
+    grouped, values = _getGroups(grouped, values)
+    median = grouped.median(values)
+    if location is None:
+        location = median
+    mad = grouped.median(numpy.abs(values-median[grouped.inverse]))
+    safe_mad = numpy.where(mad > 0, mad, 1.)
+    deviation = values-numpy.asarray(location)[grouped.inverse]
+    u = deviation/(c*safe_mad[grouped.inverse])
+    inside = numpy.abs(u) < 1
+    u2 = u*u
+    numerator = grouped.sum(numpy.where(inside, deviation*deviation*(1.-u2)**4, 0.))
+    denominator = grouped.sum(numpy.where(inside, (1.-u2)*(1.-5.*u2), 0.))
+    scale = numpy.sqrt(grouped.counts*numerator)/numpy.abs(numpy.where(denominator != 0,
+                                                                       denominator, 1.))
+    return numpy.where(mad > 0, scale, 0.)
@@ -105,16 +105,97 @@ class Stats:
     The :class:`StatSysTest <stile.sys_tests.StatSysTest>` class can be used to create and populate
     values for one of these objects.  If you want to change the list of simple statistics, it's
     only necessary to change the code there, not here.
+
+    A Stats object may also carry a compact summary of the data it describes: a
+    :class:`RunningMoments` object (``self.moments``) and a :class:`QuantileSketch`
+    (``self.sketch``).  Such Stats objects can be combined with :func:`merge` (or
+    :func:`MergeStats` and :func:`TreeReduceStats` for many at once), and saved and restored with
+    :func:`getState` and :func:`fromState`, so that, for example, statistics for a whole visit can
+    be computed from stored per-CCD results without re-reading the catalogs.  Merging is
+    associative: the moments agree up to floating-point rounding however the merges are grouped,
+    and the order statistics always stay within the (updated) ``rank_error`` bound.
     """
 
     def __init__(self, simple_stats):
         self.simple_stats = simple_stats
         for stat in self.simple_stats:
-            init_str = 'self.' + stat + '=None'
-            exec(init_str)
+            setattr(self, stat, None)
 
         self.percentiles = None
         self.values = None
+        # For statistics computed from a QuantileSketch, the bound on the fractional rank error of
+        # median and the percentile values; None means these were computed exactly.
+        self.rank_error = None
+        # Mergeable summaries of the data, if kept (see the class docstring).
+        self.moments = None
+        self.sketch = None
+
+    @classmethod
+    def fromSketches(cls, moments, sketch, percentiles):
+        """Make a Stats object from a :class:`RunningMoments` and a :class:`QuantileSketch`
+        describing the same data, which are kept as the ``moments`` and ``sketch`` attributes.
+
+        :param moments:     A :class:`RunningMoments` object.
+        :param sketch:      A :class:`QuantileSketch` object.
+        :param percentiles: The percentile levels at which to find values.
+
+        :returns: a Stats object.
+        """
+        if moments.N == 0:
+            raise RuntimeError("Cannot compute statistics of an empty data set!")
+        result = cls(simple_stats=['min', 'max', 'median', 'mad', 'mean', 'stddev', 'variance', 'N',
+                                   'skew', 'kurtosis'])
+        result.N = moments.N
+        result.min = moments.min
+        result.max = moments.max
+        result.mean = moments.mean
+        result.stddev = moments.stddev
+        result.variance = moments.variance
+        result.skew = moments.skew
+        result.kurtosis = moments.kurtosis
+        result.median = sketch.quantile(0.5)
+        result.mad = sketch.mad()
+        result.percentiles = percentiles
+        result.values = sketch.quantile(numpy.asarray(percentiles, dtype=float)/100.)
+        result.rank_error = sketch.rank_error
+        result.moments = moments
+        result.sketch = sketch
+        return result
+
+    def merge(self, other):
+        """Return a new Stats object describing the union of the data described by this object and
+        ``other``.  Both must carry their ``moments`` and ``sketch``; the percentile levels of this
+        object are used.
+        """
+        if self.moments is None or other.moments is None:
+            raise RuntimeError("Only Stats objects that keep their moments and sketch can be merged")
+        moments = RunningMoments().merge(self.moments).merge(other.moments)
+        sketch = QuantileSketch(size=self.sketch.size).merge(self.sketch).merge(other.sketch)
+        return Stats.fromSketches(moments, sketch, self.percentiles)
+
+    def getState(self):
+        """Return a dict of NumPy arrays from which :func:`fromState` can rebuild this object.  It
+        can be saved with, for example, ``numpy.savez(filename, **stats.getState())``.
+        """
+        if self.moments is None:
+            raise RuntimeError("This Stats object does not keep its moments and sketch")
+        state = {'percentiles': numpy.asarray(self.percentiles, dtype=float)}
+        for key, value in self.moments.getState().items():
+            state['moments_'+key] = value
+        for key, value in self.sketch.getState().items():
+            state['sketch_'+key] = value
+        return state
+
+    @classmethod
+    def fromState(cls, state):
+        """Rebuild a Stats object from the output of :func:`getState` (or any mapping with the same
+        keys, such as the result of ``numpy.load`` on a saved state).
+        """
+        moments = RunningMoments.fromState(
+            dict([(key[8:], state[key]) for key in state if key.startswith('moments_')]))
+        sketch = QuantileSketch.fromState(
+            dict([(key[7:], state[key]) for key in state if key.startswith('sketch_')]))
+        return cls.fromSketches(moments, sketch, list(state['percentiles']))
 
     def __str__(self):
         """This routine will print the contents of the ``Stats`` object in a nice format.
@@ -126,13 +207,9 @@ class Stats:
 
         # Loop over simple statistics and print them, if not None.  Generically if one is None then
         # all will be, so just check one.
-        test_str = "test_val = self."+("%s"%self.simple_stats[0])
-        exec(test_str)
-        if test_val is not None:
+        if getattr(self, self.simple_stats[0]) is not None:
             for stat in self.simple_stats:
-                this_string = 'this_val = self.'+stat
-                exec(this_string)
-                ret_str += '\t%s: %f\n'%(stat, this_val)
+                ret_str += '\t%s: %f\n'%(stat, getattr(self, stat))
             ret_str += '\n'
 
         # Loop over combinations of percentiles and values, and print them.
@@ -141,8 +218,314 @@ class Stats:
             for index in range(len(self.percentiles)):
                 ret_str += '\t%f %f\n'%(self.percentiles[index], self.values[index])
 
+        if self.rank_error is not None:
+            ret_str += 'Order statistics are approximate, with fractional rank error <= %g\n'%(
+                self.rank_error)
+
         return ret_str
 
+
+class RunningMoments(object):
+    """
+    Exact running moments of a data stream: the number of points, minimum, maximum, mean, and the
+    central moments needed for the variance, skewness and kurtosis.  Data can be added in chunks
+    with :func:`update`, and two ``RunningMoments`` built from different data can be combined with
+    :func:`merge`; either way the result is identical (up to floating-point rounding) to computing
+    the moments over all of the data at once.
+
+    The chunks are combined using the pairwise update formulas of Chan, Golub & LeVeque (1979) and
+    Pebay (2008), which are numerically stable even for large offsets between the mean and zero.
+    """
+    def __init__(self):
+        self.N = 0
+        self.min = numpy.inf
+        self.max = -numpy.inf
+        self.mean = 0.
+        self.M2 = 0.
+        self.M3 = 0.
+        self.M4 = 0.
+
+    def update(self, array):
+        """
+        Add the values in ``array`` (any shape; it is flattened) to the running moments.
+        """
+        array = numpy.asarray(array, dtype=float).reshape(-1)
+        if not len(array):
+            return
+        chunk = RunningMoments()
+        chunk.N = len(array)
+        chunk.min = numpy.min(array)
+        chunk.max = numpy.max(array)
+        chunk.mean = numpy.mean(array)
+        delta = array-chunk.mean
+        delta_sq = delta*delta
+        chunk.M2 = numpy.sum(delta_sq)
+        chunk.M3 = numpy.dot(delta_sq, delta)
+        chunk.M4 = numpy.dot(delta_sq, delta_sq)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Combine the moments of another :class:`RunningMoments` object into this one.
+
+        :returns: this object, updated in place.
+        """
+        if other.N == 0:
+            return self
+        if self.N == 0:
+            self.N, self.min, self.max = other.N, other.min, other.max
+            self.mean, self.M2, self.M3, self.M4 = other.mean, other.M2, other.M3, other.M4
+            return self
+        n_a = float(self.N)
+        n_b = float(other.N)
+        n = n_a+n_b
+        delta = other.mean-self.mean
+        M4 = (self.M4 + other.M4 + delta**4*n_a*n_b*(n_a*n_a-n_a*n_b+n_b*n_b)/n**3 +
+              6.*delta**2*(n_a*n_a*other.M2+n_b*n_b*self.M2)/n**2 +
+              4.*delta*(n_a*other.M3-n_b*self.M3)/n)
+        M3 = (self.M3 + other.M3 + delta**3*n_a*n_b*(n_a-n_b)/n**2 +
+              3.*delta*(n_a*other.M2-n_b*self.M2)/n)
+        self.M2 = self.M2 + other.M2 + delta**2*n_a*n_b/n
+        self.M3 = M3
+        self.M4 = M4
+        self.mean = self.mean + delta*n_b/n
+        self.N = self.N + other.N
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def getState(self):
+        """Return a dict of NumPy arrays from which :func:`fromState` can rebuild this object."""
+        return {'N': numpy.array(self.N), 'min': numpy.array(self.min),
+                'max': numpy.array(self.max), 'mean': numpy.array(self.mean),
+                'M2': numpy.array(self.M2), 'M3': numpy.array(self.M3), 'M4': numpy.array(self.M4)}
+
+    @classmethod
+    def fromState(cls, state):
+        """Rebuild a :class:`RunningMoments` object from the output of :func:`getState`."""
+        moments = cls()
+        moments.N = int(state['N'])
+        for key in ['min', 'max', 'mean', 'M2', 'M3', 'M4']:
+            setattr(moments, key, float(state[key]))
+        return moments
+
+    @property
+    def variance(self):
+        return self.M2/self.N
+
+    @property
+    def stddev(self):
+        return numpy.sqrt(self.M2/self.N)
+
+    @property
+    def skew(self):
+        """The (biased) sample skewness, as from :func:`scipy.stats.skew`."""
+        return numpy.sqrt(self.N)*self.M3/self.M2**1.5
+
+    @property
+    def kurtosis(self):
+        """The (biased) excess kurtosis, as from :func:`scipy.stats.kurtosis`."""
+        return self.N*self.M4/(self.M2*self.M2)-3.
+
+
+class QuantileSketch(object):
+    """
+    A compact, mergeable summary of a data stream from which approximate quantiles can be computed
+    without holding the whole data set in memory.
+
+    The sketch is a stack of "compactors" (as in the KLL and MRL families of sketches).  Level
+    ``h`` holds values that each represent ``2**h`` of the original data points.  Whenever a level
+    holds more than ``size`` values, it is sorted and every other value is promoted to the next
+    level, halving the storage.  One such compaction at level ``h`` changes the rank of any point
+    by at most ``2**h``, so the sketch keeps an exact running bound on the rank error of any
+    quantile it returns; :attr:`rank_error` is that bound divided by the number of points.  The
+    bound grows roughly as ``log2(N/size)/size`` in the worst case, and is usually much smaller
+    when the data arrive in large chunks.  Memory use is about ``size*log2(N/size)`` values.
+
+    Two sketches can be combined with :func:`merge`; the merged sketch summarizes the union of the
+    two data sets, and its error bound is the sum of the two bounds plus that of any compactions
+    the merge triggers, so reductions can be done in any grouping.
+
+    :param size: The maximum number of values kept in each level before it is compacted.
+                 [default: 4096]
+    """
+    def __init__(self, size=4096):
+        if size < 2:
+            raise ValueError('QuantileSketch size must be at least 2')
+        self.size = int(size)
+        self.levels = []
+        self.N = 0
+        self.abs_rank_error = 0.
+        # Alternate which half of each level is promoted, so compactions don't bias the sketch.
+        # The alternation is also flipped by a bit of the data (see _compress), so that separate
+        # sketches that are later merged don't all start out biased the same way.
+        self._offsets = []
+
+    def update(self, array):
+        """
+        Add the values in ``array`` (any shape; it is flattened) to the sketch.
+        """
+        array = numpy.asarray(array, dtype=float).reshape(-1)
+        if not len(array):
+            return
+        self._addToLevel(0, array)
+        self.N += len(array)
+        self._compress()
+
+    def merge(self, other):
+        """
+        Combine another :class:`QuantileSketch` into this one.
+
+        :returns: this object, updated in place.
+        """
+        for level, values in enumerate(other.levels):
+            if len(values):
+                self._addToLevel(level, values)
+        self.N += other.N
+        self.abs_rank_error += other.abs_rank_error
+        self._compress()
+        return self
+
+    def _addToLevel(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(numpy.zeros(0))
+            self._offsets.append(0)
+        self.levels[level] = numpy.concatenate([self.levels[level], values])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.size:
+                values = numpy.sort(values)
+                # Keep the last item at this level if there's an odd number of them, so that the
+                # total weight is preserved exactly.
+                n_compact = len(values)-len(values)%2
+                toggle = self._offsets[level]
+                self._offsets[level] = 1-toggle
+                offset = toggle ^ int(values[n_compact//2:n_compact//2+1].view(numpy.int64)[0] & 1)
+                self.levels[level] = values[n_compact:]
+                self._addToLevel(level+1, values[offset:n_compact:2])
+                self.abs_rank_error += 2.**level
+            level += 1
+
+    def getState(self):
+        """Return a dict of NumPy arrays from which :func:`fromState` can rebuild this object."""
+        return {'size': numpy.array(self.size), 'N': numpy.array(self.N),
+                'abs_rank_error': numpy.array(self.abs_rank_error),
+                'values': (numpy.concatenate(self.levels) if self.levels else numpy.zeros(0)),
+                'level_lengths': numpy.array([len(v) for v in self.levels], dtype=int),
+                'offsets': numpy.array(self._offsets, dtype=int)}
+
+    @classmethod
+    def fromState(cls, state):
+        """Rebuild a :class:`QuantileSketch` object from the output of :func:`getState`."""
+        sketch = cls(size=int(state['size']))
+        sketch.N = int(state['N'])
+        sketch.abs_rank_error = float(state['abs_rank_error'])
+        boundaries = numpy.cumsum(numpy.asarray(state['level_lengths'], dtype=int))[:-1]
+        if len(state['level_lengths']):
+            sketch.levels = numpy.split(numpy.asarray(state['values'], dtype=float), boundaries)
+        sketch._offsets = [int(offset) for offset in state['offsets']]
+        return sketch
+
+    @property
+    def rank_error(self):
+        """The bound on the fractional rank error of any quantile computed from this sketch."""
+        if self.N == 0:
+            return 0.
+        return self.abs_rank_error/self.N
+
+    def _weightedValues(self):
+        values = numpy.concatenate(self.levels)
+        weights = numpy.concatenate([numpy.full(len(v), 2.**level)
+                                     for level, v in enumerate(self.levels)])
+        return values, weights
+
+    def quantile(self, q):
+        """
+        Return the approximate value at each quantile ``q`` (a number or an array of numbers in the
+        range ``[0, 1]``).
+        """
+        if self.N == 0:
+            raise RuntimeError('Cannot compute quantiles of an empty QuantileSketch')
+        values, weights = self._weightedValues()
+        return self._weightedQuantile(values, weights, q)
+
+    @staticmethod
+    def _weightedQuantile(values, weights, q):
+        order = numpy.argsort(values)
+        values = values[order]
+        cumulative_weight = numpy.cumsum(weights[order])
+        target = numpy.asarray(q, dtype=float)*cumulative_weight[-1]
+        index = numpy.searchsorted(cumulative_weight, target, side='left')
+        return values[numpy.clip(index, 0, len(values)-1)]
+
+    def mad(self):
+        """
+        Return the approximate median absolute deviation: the weighted median of the absolute
+        deviations of the sketch values from the sketch median.  This is approximate in the same
+        sense as the quantiles, but, since the median it is measured from is itself approximate,
+        :attr:`rank_error` is a guide to its accuracy rather than a strict bound.
+        """
+        values, weights = self._weightedValues()
+        median = self._weightedQuantile(values, weights, 0.5)
+        return self._weightedQuantile(numpy.abs(values-median), weights, 0.5)
+
+
+def _mergeStatsPair(pair):
+    return pair[0].merge(pair[1])
+
+
+def MergeStats(stats_list):
+    """Merge a list of :class:`Stats` objects (each carrying its moments and sketch) into a single
+    Stats object describing all of their data.
+    """
+    if not stats_list:
+        raise RuntimeError("No Stats objects to merge!")
+    result = stats_list[0]
+    for stats in stats_list[1:]:
+        result = result.merge(stats)
+    return result
+
+
+def TreeReduceStats(stats_list, processes=None):
+    """Merge a list of :class:`Stats` objects (each carrying its moments and sketch) into a single
+    Stats object by pairwise merges in a balanced tree, with each level of the tree merged in
+    parallel across a :class:`multiprocessing.Pool`.  Since merging is associative, the result
+    agrees with that of :func:`MergeStats` (within the quoted ``rank_error`` for the order
+    statistics).
+
+    :param stats_list: A list of :class:`Stats` objects, or of states from
+                       :func:`Stats.getState`.
+    :param processes:  The number of worker processes.  [default: None, meaning the number of
+                       CPUs; 1 means merge serially in this process]
+
+    :returns: a Stats object.
+    """
+    stats_list = [stats if isinstance(stats, Stats) else Stats.fromState(stats)
+                  for stats in stats_list]
+    if not stats_list:
+        raise RuntimeError("No Stats objects to merge!")
+    if processes == 1 or len(stats_list) < 4:
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+    try:
+        while len(stats_list) > 1:
+            pairs = list(zip(stats_list[0::2], stats_list[1::2]))
+            merged = pool.map(_mergeStatsPair, pairs) if pool else list(map(_mergeStatsPair, pairs))
+            if len(stats_list) % 2:
+                merged.append(stats_list[-1])
+            stats_list = merged
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return stats_list[0]
+
+
 fieldNames = {
     'dec': 'the declination of the object',
     'ra': 'the RA of the object',
@@ -32,26 +32,34 @@ THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import numpy
 import stile
 from . import stile_utils
-try:
-    import treecorr
-    from treecorr.corr2 import corr2_valid_params
-    has_treecorr = True
-except ImportError:
-    has_treecorr = False
-    import warnings
-    warnings.warn("treecorr package cannot be imported. You may "+
-                  "wish to install it if you would like to use the correlation functions within "+
-                  "Stile.")
-
-try:
-    import matplotlib
-    # We should decide which backend to use (this line allows running matplotlib even on sessions
-    # without properly defined displays, eg through PBS)
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    has_matplotlib = True
-except ImportError:
-    has_matplotlib = False
+from .groupby import GroupBy
+from . import stat_kernels
+from .plot_queue import PlotSpec
+from .figure_templates import NewFigure, FigureTemplate
+
+
+def _importTreeCorr():
+    """
+    Import and return the treecorr module.  TreeCorr (like matplotlib and scipy) is slow to import
+    and only needed by some of the tests, so it is imported the first time it is used rather than
+    with the rest of Stile.
+    """
+    try:
+        import treecorr
+    except ImportError:
+        raise ImportError("treecorr package cannot be imported. You may wish to install it if you "
+                          "would like to use the correlation functions within Stile.")
+    return treecorr
+
+
+def _hasMatplotlib():
+    """Return True if matplotlib can be imported."""
+    try:
+        import matplotlib
+        return True
+    except ImportError:
+        return False
+
 
 class PlotNone(object):
     """
@@ -98,13 +106,53 @@ class SysTest(object):
             ``config`` arguments.  Additional args may be required by the base versions of different
             tests, but the specific implementations of those base versions should always have this
             call signature.
+
+    If the attribute ``defer_plots`` is set to True, tests which make plots return a
+    :class:`stile.plot_queue.PlotSpec` describing the plot instead of drawing it, so the plot can
+    be rendered later or in another process (for example, by a
+    :class:`stile.plot_queue.PlotQueue`).
+
+    Plots are drawn on figures which are not tracked by pyplot, so they are freed once they are no
+    longer used.  If the attribute ``reuse_figures`` is set to True, each kind of plot is instead
+    drawn on a :class:`stile.figure_templates.FigureTemplate` kept by the sys test, which is much
+    faster when making many plots with the same layout; the figure returned by one call is then
+    overwritten by the next call of the same kind, so it should be saved first.
+    :func:`closeFigures` releases the kept figures.
     """
     short_name = ''
     long_name = ''
+    defer_plots = False
+    reuse_figures = False
     def __init__(self):
         pass
     def __call__(self):
         raise NotImplementedError()
+    def _plot(self, method, *args, **kwargs):
+        """Call the plotting method named ``method``, or return a
+        :class:`stile.plot_queue.PlotSpec` for the call if ``self.defer_plots`` is True."""
+        if self.defer_plots:
+            return PlotSpec(self, method, *args, **kwargs)
+        return getattr(self, method)(*args, **kwargs)
+    def _getFigureTemplate(self, key, figsize=None, nrows=1, sharex=False):
+        """Return a :class:`stile.figure_templates.FigureTemplate` for a new plot: if
+        ``self.reuse_figures`` is True, the one kept for this ``key`` and layout (cleared of the
+        previous plot), else a new one.  ``key`` should describe everything about the plot that is
+        set up once rather than for each plot, such as axis scales."""
+        if figsize is not None:
+            figsize = tuple(figsize)
+        if not self.reuse_figures:
+            return FigureTemplate(figsize, nrows, sharex)
+        templates = self.__dict__.setdefault('_figure_templates', {})
+        full_key = (key, figsize, nrows, sharex)
+        if full_key in templates:
+            templates[full_key].reset()
+        else:
+            templates[full_key] = FigureTemplate(figsize, nrows, sharex)
+        return templates[full_key]
+    def closeFigures(self):
+        """Close and forget the figures kept for reuse (see ``reuse_figures``)."""
+        for template in self.__dict__.pop('_figure_templates', {}).values():
+            template.close()
     def plot(self, results):
         """
         If the results returned from the :func:`__call__` function of this class have
@@ -143,26 +191,56 @@ class PlotDetails(object):
         self.sigma_field = sigma_field  # 1-sigma error bar field
         self.y_title = y_title  # y-axis label
 
-if has_treecorr and treecorr.version < '3.1':
-    treecorr_func_dict = {'gg': treecorr.G2Correlation,
-                          'm2': treecorr.G2Correlation,
-                          'ng': treecorr.NGCorrelation,
-                          'nm': treecorr.NGCorrelation,
-                          'norm': treecorr.NGCorrelation,
-                          'nn': treecorr.N2Correlation,
-                          'kk': treecorr.K2Correlation,
-                          'nk': treecorr.NKCorrelation,
-                          'kg': treecorr.KGCorrelation}
-elif has_treecorr:
-    treecorr_func_dict = {'gg': treecorr.GGCorrelation,
-                          'm2': treecorr.GGCorrelation,
-                          'ng': treecorr.NGCorrelation,
-                          'nm': treecorr.NGCorrelation,
-                          'norm': treecorr.NGCorrelation,
-                          'nn': treecorr.NNCorrelation,
-                          'kk': treecorr.KKCorrelation,
-                          'nk': treecorr.NKCorrelation,
-                          'kg': treecorr.KGCorrelation}
+def _treecorrFuncDict():
+    """Return a dict of the TreeCorr correlation function classes for each correlation type."""
+    treecorr = _importTreeCorr()
+    if treecorr.version < '3.1':
+        return {'gg': treecorr.G2Correlation,
+                'm2': treecorr.G2Correlation,
+                'ng': treecorr.NGCorrelation,
+                'nm': treecorr.NGCorrelation,
+                'norm': treecorr.NGCorrelation,
+                'nn': treecorr.N2Correlation,
+                'kk': treecorr.K2Correlation,
+                'nk': treecorr.NKCorrelation,
+                'kg': treecorr.KGCorrelation}
+    return {'gg': treecorr.GGCorrelation,
+            'm2': treecorr.GGCorrelation,
+            'ng': treecorr.NGCorrelation,
+            'nm': treecorr.NGCorrelation,
+            'norm': treecorr.NGCorrelation,
+            'nn': treecorr.NNCorrelation,
+            'kk': treecorr.KKCorrelation,
+            'nk': treecorr.NKCorrelation,
+            'kg': treecorr.KGCorrelation}
+
+
+def _makeSysTest(registry, type, kind):
+    """
+    Return an instance of the class registered for ``type`` in ``registry``, a dict of class
+    names.  The classes are looked up by name when they are first requested, so a registry can be
+    defined before the classes it refers to.
+    """
+    if type not in registry:
+        raise ValueError('Unknown %s type %s given to type kwarg'%(kind, type))
+    return globals()[registry[type]]()
+
+
+# The classes made by the CorrelationFunctionSysTest factory for each value of its type kwarg.
+correlation_function_types = {None: 'BaseCorrelationFunctionSysTest',
+                              'GalaxyShear': 'GalaxyShearSysTest',
+                              'BrightStarShear': 'BrightStarShearSysTest',
+                              'StarXGalaxyDensity': 'StarXGalaxyDensitySysTest',
+                              'StarXGalaxyShear': 'StarXGalaxyShearSysTest',
+                              'StarXStarShear': 'StarXStarShearSysTest',
+                              'StarXStarSizeResidual': 'StarXStarSizeResidualSysTest',
+                              'GalaxyDensityCorrelation': 'GalaxyDensityCorrelationSysTest',
+                              'StarDensityCorrelation': 'StarDensityCorrelationSysTest',
+                              'Rho1': 'Rho1SysTest',
+                              'Rho2': 'Rho2SysTest',
+                              'Rho3': 'Rho3SysTest',
+                              'Rho4': 'Rho4SysTest',
+                              'Rho5': 'Rho5SysTest'}
 
 def CorrelationFunctionSysTest(type=None):
     """
@@ -225,36 +303,7 @@ def CorrelationFunctionSysTest(type=None):
     include options for A) automatic processing,  B) ease of understanding code, and C) suggesting
     tests that are useful to run.
     """
-    if type is None:
-        return BaseCorrelationFunctionSysTest()
-    elif type=='GalaxyShear':
-        return GalaxyShearSysTest()
-    elif type=='BrightStarShear':
-        return BrightStarShearSysTest()
-    elif type=='StarXGalaxyDensity':
-        return StarXGalaxyDensitySysTest()
-    elif type=='StarXGalaxyShear':
-        return StarXGalaxyShearSysTest()
-    elif type=='StarXStarShear':
-        return StarXStarShearSysTest()
-    elif type=='StarXStarSizeResidual':
-        return StarXStarSizeResidualSysTest()
-    elif type=='GalaxyDensityCorrelation':
-        return GalaxyDensityCorrelationSysTest()
-    elif type=='StarDensityCorrelation':
-        return StarDensityCorrelationSysTest()
-    elif type=='Rho1':
-        return Rho1SysTest()
-    elif type=='Rho2':
-        return Rho2SysTest()
-    elif type=='Rho3':
-        return Rho3SysTest()
-    elif type=='Rho4':
-        return Rho4SysTest()
-    elif type=='Rho5':
-        return Rho5SysTest()
-    else:
-        raise ValueError('Unknown correlation function type %s given to type kwarg'%type)
+    return _makeSysTest(correlation_function_types, type, 'correlation function')
 
 
 class BaseCorrelationFunctionSysTest(SysTest):
@@ -325,6 +374,7 @@ class BaseCorrelationFunctionSysTest(SysTest):
         ]
 
     def makeCatalog(self, data, config=None, use_as_k=None, use_chip_coords=False):
+        treecorr = _importTreeCorr()
         if data is None or isinstance(data, treecorr.Catalog):
             return data
         catalog_kwargs = {}
@@ -422,6 +472,9 @@ class BaseCorrelationFunctionSysTest(SysTest):
         import tempfile
         import os
 
+        treecorr = _importTreeCorr()
+        from treecorr.corr2 import corr2_valid_params
+        treecorr_func_dict = _treecorrFuncDict()
         if not correlation_function_type in treecorr_func_dict:
             raise ValueError('Unknown correlation function type: %s'%correlation_function_type)
 
@@ -584,7 +637,7 @@ class BaseCorrelationFunctionSysTest(SysTest):
                            :func:`.savefig()`, if matplotlib can be imported; else None.
         """
 
-        if not has_matplotlib:
+        if not _hasMatplotlib():
             return None
         fields = data.dtype.names
         # Pick which radius measurement to use
@@ -618,9 +671,6 @@ class BaseCorrelationFunctionSysTest(SysTest):
             yscale = 'log'
         else:
             yscale = 'linear'
-        fig = plt.figure()
-        fig.subplots_adjust(hspace=0)  # no space between stacked plots
-        plt.subplots(sharex=True)  # share x-axes
         # Figure out how many plots you'll need--never more than 3, so we just use a stacked column.
         if pd.datarandom_t_field:
             plot_data_only &= pd.datarandom_t_field+'d' in fields
@@ -631,9 +681,12 @@ class BaseCorrelationFunctionSysTest(SysTest):
             nrows = 1 + plot_data_only + plot_random_only
         else:
             nrows = 1
+        template = self._getFigureTemplate(('plot', yscale), nrows=nrows, sharex=True)
+        fig = template.figure
+        fig.subplots_adjust(hspace=0)  # no space between stacked plots
         # Plot the first thing
         curr_plot = 0
-        ax = fig.add_subplot(nrows, 1, 1)
+        ax = template.axes[0]
         ax.axhline(0, alpha=0.7, color='gray')
         ax.errorbar(data[r], data[pd.t_field], yerr=data[pd.sigma_field], color=colors[0],
                     label=pd.t_title)
@@ -652,7 +705,7 @@ class BaseCorrelationFunctionSysTest(SysTest):
         ax.legend()
         if pd.x_field and plot_bmode and pd.t_im_field:
             # Both yb and y_im: plot (y, yb) on one plot and (y_im, yb_im) on the other.
-            ax = fig.add_subplot(nrows, 1, 2)
+            ax = template.axes[1]
             ax.axhline(0, alpha=0.7, color='gray')
             ax.errorbar(data[r], data[pd.t_im_field], yerr=data[pd.sigma_field], color=colors[0],
                         label=pd.t_im_title)
@@ -666,7 +719,7 @@ class BaseCorrelationFunctionSysTest(SysTest):
             ax.legend()
         if plot_data_only and pd.datarandom_t_field:  # Plot the data-only measurements if requested
             curr_plot += 1
-            ax = fig.add_subplot(nrows, 1, 2)
+            ax = template.axes[1]
             ax.axhline(0, alpha=0.7, color='gray')
             ax.errorbar(data[r], data[pd.datarandom_t_field+'d'], yerr=data[pd.sigma_field],
                         color=colors[0], label=pd.datarandom_t_title+'d}$')
@@ -681,7 +734,7 @@ class BaseCorrelationFunctionSysTest(SysTest):
             ax.legend()
         # Plot the randoms-only measurements if requested
         if plot_random_only and pd.datarandom_t_field:
-            ax = fig.add_subplot(nrows, 1, nrows)
+            ax = template.axes[nrows-1]
             ax.axhline(0, alpha=0.7, color='gray')
             ax.errorbar(data[r], data[pd.datarandom_t_field+'r'], yerr=data[pd.sigma_field],
                         color=colors[0], label=pd.datarandom_t_title+'r}$')
@@ -695,7 +748,8 @@ class BaseCorrelationFunctionSysTest(SysTest):
             ax.set_ylabel(pd.y_title)
             ax.legend()
         ax.set_xlabel(r)
-        plt.tight_layout()
+        if template.uses == 1:
+            fig.tight_layout()
         return fig
 
     def __call__(self, *args, **kwargs):
@@ -1060,37 +1114,11 @@ class StatSysTest(SysTest):
         self.percentiles = percentiles
         self.field = field
 
-    def __call__(self, array, percentiles=None, field=None, verbose=False, ignore_bad=False):
-        """Calling a :class:`StatSysTest` with a given array argument as ``array`` will cause it to
-        carry out all the statistics tests and populate a :class:`stile.Stats` object with the
-        results, which it returns to the user.
-
-        :param array:           The tuple, list, NumPy array, or structured NumPy array/catalog on
-                                which to carry out the calculations.
-        :param percentiles:     The percentile levels to use for this particular calculation.
-                                [default: None, meaning use whatever levels were defined when
-                                initializing this :class:`StatSysTest` object]
-        :param field:           The name of the field to use in a NumPy structured array / catalog.
-                                [default: None, meaning use whatever field was defined when
-                                initializing this :class:`StatSysTest` object]
-        :param verbose:         If True, print the calculated statistics of the input ``array``
-                                to screen.  If False, silently return the
-                                :class:`Stats <stile.stile_utils.Stats>` object.
-                                [default: False.]
-        :param ignore_bad:      If True, search for values that are ``NaN`` or ``Inf``, and
-                                remove them before doing calculations.  [default: False.]
-
-        :returns: a :class:`stile.stile_utils.Stats` object
+    def _selectArray(self, array, use_field, ignore_bad, allow_empty=False):
+        """Return the data in ``array`` (or in its field ``use_field``, for catalogs) on which to
+        compute statistics, with ``NaN`` and ``Inf`` values removed if ``ignore_bad`` is True.
+        Unless ``allow_empty`` is True, raise an error if that leaves no values.
         """
-        # Set the percentile levels and field, if the user provided them.  Otherwise use what was
-        # set up at the time of initialization.
-        use_percentiles = percentiles if percentiles is not None else self.percentiles
-        use_field = field if field is not None else self.field
-
-        # Check to make sure that percentiles is iterable (list, numpy array, tuple, ...)
-        if not hasattr(use_percentiles, '__iter__'):
-            raise RuntimeError('List of percentiles is not an iterable (list, tuple, NumPy array)!')
-
         # Check types for input things and make sure it all makes sense, including consistency with
         # the field.  First of all, it should be iterable:
         if not hasattr(array, '__iter__'):
@@ -1129,9 +1157,52 @@ class StatSysTest(SysTest):
                  numpy.isinf(use_array) == False]
                 )
             use_array = use_array[cond]
-            if len(use_array) == 0:
+            if len(use_array) == 0 and not allow_empty:
                 raise RuntimeError("No good entries left to use after excluding bad values!")
 
+        return use_array
+
+    def __call__(self, array, percentiles=None, field=None, verbose=False, ignore_bad=False,
+                 keep_state=False, sketch_size=4096):
+        """Calling a :class:`StatSysTest` with a given array argument as ``array`` will cause it to
+        carry out all the statistics tests and populate a :class:`stile.Stats` object with the
+        results, which it returns to the user.
+
+        :param array:           The tuple, list, NumPy array, or structured NumPy array/catalog on
+                                which to carry out the calculations.
+        :param percentiles:     The percentile levels to use for this particular calculation.
+                                [default: None, meaning use whatever levels were defined when
+                                initializing this :class:`StatSysTest` object]
+        :param field:           The name of the field to use in a NumPy structured array / catalog.
+                                [default: None, meaning use whatever field was defined when
+                                initializing this :class:`StatSysTest` object]
+        :param verbose:         If True, print the calculated statistics of the input ``array``
+                                to screen.  If False, silently return the
+                                :class:`Stats <stile.stile_utils.Stats>` object.
+                                [default: False.]
+        :param ignore_bad:      If True, search for values that are ``NaN`` or ``Inf``, and
+                                remove them before doing calculations.  [default: False.]
+        :param keep_state:      If True, also attach a :class:`stile.stile_utils.RunningMoments`
+                                and a :class:`stile.stile_utils.QuantileSketch` of the data to the
+                                returned object, so it can later be merged with other results
+                                (see :class:`stile.stile_utils.Stats`).  The statistics themselves
+                                are still computed exactly.  [default: False.]
+        :param sketch_size:     The number of values kept per level of the quantile sketch, if
+                                ``keep_state=True``.  [default: 4096]
+
+        :returns: a :class:`stile.stile_utils.Stats` object
+        """
+        # Set the percentile levels and field, if the user provided them.  Otherwise use what was
+        # set up at the time of initialization.
+        use_percentiles = percentiles if percentiles is not None else self.percentiles
+        use_field = field if field is not None else self.field
+
+        # Check to make sure that percentiles is iterable (list, numpy array, tuple, ...)
+        if not hasattr(use_percentiles, '__iter__'):
+            raise RuntimeError('List of percentiles is not an iterable (list, tuple, NumPy array)!')
+
+        use_array = self._selectArray(array, use_field, ignore_bad)
+
         # Create the output object, a stile.Stats() object.  We gave to tell it which simple
         # statistics to calculate.  If we want to change this list, we need to change both the
         # `simple_stats` list below, and the code afterwards that calculates and populates the
@@ -1176,6 +1247,12 @@ class StatSysTest(SysTest):
         result.percentiles = use_percentiles
         result.values = numpy.percentile(use_array, use_percentiles)
 
+        if keep_state:
+            result.moments = stile_utils.RunningMoments()
+            result.moments.update(use_array)
+            result.sketch = stile_utils.QuantileSketch(size=sketch_size)
+            result.sketch.update(use_array)
+
         # Print, if verbose=True.
         if verbose:
             print((result.__str__()))
@@ -1183,6 +1260,249 @@ class StatSysTest(SysTest):
         # Return.
         return result
 
+    def streamStats(self, chunks, percentiles=None, field=None, verbose=False, ignore_bad=False,
+                    sketch_size=4096):
+        """Compute the same statistics as calling the :class:`StatSysTest`, but for data that
+        arrive as a sequence of chunks (for example, catalogs read one at a time from disk), so
+        the full data set never has to be held in memory.
+
+        The number of points, min, max, mean, standard deviation, variance, skewness and kurtosis
+        are exact (up to floating-point rounding), using a
+        :class:`stile.stile_utils.RunningMoments` object.  The median, MAD and percentile values
+        are approximate, using a :class:`stile.stile_utils.QuantileSketch`: the median and
+        percentile values are guaranteed to be the values at some rank within
+        ``result.rank_error*N`` of the requested rank, and the MAD is accurate to a similar
+        level.  For chunks of comparable size, ``result.rank_error`` is at most of order
+        ``log2(N/sketch_size)/sketch_size``, and is often far smaller.  Memory use is of order
+        ``sketch_size*log2(N/sketch_size)`` values plus the size of one chunk.  The returned
+        object keeps its moments and sketch, so it can be merged with other such results.
+
+        :param chunks:          An iterable of arrays or catalogs, each of a type that could be
+                                passed to :func:`__call__`.  It can be a generator.
+        :param percentiles:     The percentile levels to use for this particular calculation.
+                                [default: None, meaning use whatever levels were defined when
+                                initializing this :class:`StatSysTest` object]
+        :param field:           The name of the field to use in a NumPy structured array / catalog.
+                                [default: None, meaning use whatever field was defined when
+                                initializing this :class:`StatSysTest` object]
+        :param verbose:         If True, print the calculated statistics to screen.
+                                [default: False.]
+        :param ignore_bad:      If True, remove values that are ``NaN`` or ``Inf`` from each chunk
+                                before doing calculations.  [default: False.]
+        :param sketch_size:     The number of values kept per level of the quantile sketch; larger
+                                values are more accurate but use more memory.  [default: 4096]
+
+        :returns: a :class:`stile.stile_utils.Stats` object
+        """
+        use_percentiles = percentiles if percentiles is not None else self.percentiles
+        use_field = field if field is not None else self.field
+        if not hasattr(use_percentiles, '__iter__'):
+            raise RuntimeError('List of percentiles is not an iterable (list, tuple, NumPy array)!')
+
+        moments = stile_utils.RunningMoments()
+        sketch = stile_utils.QuantileSketch(size=sketch_size)
+        for chunk in chunks:
+            # A chunk with no (good) values, such as a CCD with no usable rows, is skipped; only
+            # the whole stream has to contain some.
+            use_array = numpy.asarray(self._selectArray(chunk, use_field, ignore_bad,
+                                                        allow_empty=True), dtype=float)
+            if not ignore_bad and not numpy.all(numpy.isfinite(use_array)):
+                raise RuntimeError("NaN or Inf values detected in input array!")
+            if len(use_array) == 0:
+                continue
+            moments.update(use_array)
+            sketch.update(use_array)
+        if moments.N == 0:
+            if ignore_bad:
+                raise RuntimeError("No good entries left to use after excluding bad values!")
+            raise RuntimeError("No data found in the input chunks!")
+        result = stile_utils.Stats.fromSketches(moments, sketch, use_percentiles)
+
+        if verbose:
+            print((result.__str__()))
+
+        return result
+
+    @staticmethod
+    def _partitionPercentiles(array, percentiles):
+        """Find the values at the given percentiles of ``array``, with the same linear
+        interpolation as :func:`numpy.percentile`, from a single in-place partition of ``array``
+        (which is therefore reordered).  The minimum and maximum come from the same partition.
+
+        :returns: a tuple of (the values at ``percentiles``, min, max).
+        """
+        n = len(array)
+        position = 0.01*numpy.asarray(percentiles, dtype=float)*(n-1)
+        lower = numpy.floor(position).astype(int)
+        upper = numpy.minimum(lower+1, n-1)
+        kth = numpy.unique(numpy.concatenate([[0, n-1], lower, upper]))
+        array.partition(kth)
+        values = array[lower] + (array[upper]-array[lower])*(position-lower)
+        return values, array[0], array[n-1]
+
+    def multiFieldStats(self, catalog, fields=None, percentiles=None, ignore_bad=False):
+        """Compute the statistics of many fields of a structured catalog at once, returning a
+        columnar table rather than one :class:`Stats <stile.stile_utils.Stats>` object per field.
+
+        This is much faster than calling the :class:`StatSysTest` once per field: each field is
+        copied once, the median, min, max and all percentiles come from one partition of that copy,
+        the moments come from one set of passes over it, and bad values are found with a single
+        ``numpy.isfinite`` mask.  (The MAD requires one further partition, of the absolute
+        deviations from the median.)  The results agree with those of :func:`__call__`.
+
+        :param catalog:         A structured NumPy array / catalog.
+        :param fields:          A list of field names for which to compute statistics.
+                                [default: None, meaning all fields of the catalog]
+        :param percentiles:     The percentile levels to use for this particular calculation.
+                                [default: None, meaning use whatever levels were defined when
+                                initializing this :class:`StatSysTest` object]
+        :param ignore_bad:      If True, remove values that are ``NaN`` or ``Inf`` from each
+                                field before doing calculations.  [default: False.]
+
+        :returns: a structured NumPy array with one row per field, with columns ``field``, ``N``,
+                  ``min``, ``max``, ``median``, ``mad``, ``mean``, ``stddev``, ``variance``,
+                  ``skew``, ``kurtosis``, and ``values``, the last of which holds the values at
+                  each of the requested percentiles (in order).
+        """
+        use_percentiles = percentiles if percentiles is not None else self.percentiles
+        if not hasattr(use_percentiles, '__iter__'):
+            raise RuntimeError('List of percentiles is not an iterable (list, tuple, NumPy array)!')
+        catalog = numpy.asarray(catalog)
+        if catalog.dtype.fields is None:
+            raise RuntimeError('multiFieldStats requires a structured catalog with field names!')
+        if fields is None:
+            fields = catalog.dtype.names
+        for field in fields:
+            if field not in catalog.dtype.fields:
+                raise RuntimeError('Field %s is not in this catalog, which contains %s!'%
+                                   (field, list(catalog.dtype.fields.keys())))
+
+        moment_names = ['N', 'min', 'max', 'median', 'mad', 'mean', 'stddev', 'variance', 'skew',
+                        'kurtosis']
+        dtype = ([('field', 'U%i'%max([len(field) for field in fields]+[1]))] +
+                 [(name, int if name == 'N' else float) for name in moment_names] +
+                 [('values', float, (len(use_percentiles),))])
+        result = numpy.zeros(len(fields), dtype=dtype)
+        # The median is computed along with the requested percentiles, as an extra last entry.
+        all_percentiles = list(use_percentiles)+[50.]
+        for i, field in enumerate(fields):
+            column = catalog[field].reshape(-1)
+            good = numpy.isfinite(column)
+            if good.all():
+                # Copy, since the partition is done in place.
+                column = column.astype(float)
+            elif ignore_bad:
+                column = column[good].astype(float)
+            else:
+                raise RuntimeError("NaN or Inf values detected in field %s!"%field)
+            if len(column) == 0:
+                raise RuntimeError("No good entries left to use after excluding bad values!")
+            moments = stile_utils.RunningMoments()
+            moments.update(column)
+            values, result['min'][i], result['max'][i] = self._partitionPercentiles(
+                column, all_percentiles)
+            median = values[-1]
+            # Reuse the column buffer for the absolute deviations.
+            numpy.subtract(column, median, out=column)
+            numpy.abs(column, out=column)
+            result['mad'][i] = self._partitionPercentiles(column, [50.])[0][0]
+            result['field'][i] = field
+            result['N'][i] = moments.N
+            result['median'][i] = median
+            result['values'][i] = values[:-1]
+            result['mean'][i] = moments.mean
+            result['stddev'][i] = moments.stddev
+            result['variance'][i] = moments.variance
+            result['skew'][i] = moments.skew
+            result['kurtosis'][i] = moments.kurtosis
+        return result
+
+    def groupStats(self, catalog, field=None, group_field=None, weight_field=None,
+                   percentiles=None, n_sigma=3., max_iter=10, ignore_bad=False):
+        """Compute weighted and robust statistics of one field of a catalog for every group (for
+        example, every CCD) at once, using the vectorized kernels in :mod:`stile.stat_kernels`.
+
+        :param catalog:         A structured NumPy array / catalog.
+        :param field:           The name of the field for which to compute statistics.
+                                [default: None, meaning use whatever field was defined when
+                                initializing this :class:`StatSysTest` object]
+        :param group_field:     The name of the field defining the groups, such as ``'CCD'``.
+                                [default: None, meaning treat the whole catalog as one group]
+        :param weight_field:    The name of a field of weights, such as ``'w'``, used for the mean
+                                and percentiles. [default: None, meaning equal weights]
+        :param percentiles:     The percentile levels to use for this particular calculation.
+                                [default: None, meaning use whatever levels were defined when
+                                initializing this :class:`StatSysTest` object]
+        :param n_sigma:         The threshold, in standard deviations, for the sigma-clipped mean.
+                                [default: 3.]
+        :param max_iter:        The maximum number of sigma-clipping iterations. [default: 10]
+        :param ignore_bad:      If True, remove rows where the field or weight is ``NaN`` or
+                                ``Inf`` before doing calculations.  [default: False.]
+
+        :returns: a structured NumPy array with one row per group, in sorted order of the groups,
+                  with columns ``group``, ``N``, ``mean`` (weighted, if ``weight_field`` is
+                  given), ``values`` (the weighted percentiles; see
+                  :func:`stile.stat_kernels.WeightedPercentiles`), ``clipped_mean``,
+                  ``clipped_stddev`` and ``clipped_N`` (the sigma-clipped mean, standard deviation
+                  and number of points kept), ``biweight_location`` and ``biweight_scale``.
+        """
+        use_percentiles = percentiles if percentiles is not None else self.percentiles
+        use_field = field if field is not None else self.field
+        if not hasattr(use_percentiles, '__iter__'):
+            raise RuntimeError('List of percentiles is not an iterable (list, tuple, NumPy array)!')
+        catalog = numpy.asarray(catalog)
+        if catalog.dtype.fields is None:
+            raise RuntimeError('groupStats requires a structured catalog with field names!')
+        for name in [use_field, group_field, weight_field]:
+            if name is not None and name not in catalog.dtype.fields:
+                raise RuntimeError('Field %s is not in this catalog, which contains %s!'%
+                                   (name, list(catalog.dtype.fields.keys())))
+        if use_field is None:
+            raise RuntimeError('StatSysTest called on a catalog without specifying a field!')
+
+        values = catalog[use_field].astype(float)
+        weights = catalog[weight_field].astype(float) if weight_field is not None else None
+        good = numpy.isfinite(values)
+        if weights is not None:
+            good &= numpy.isfinite(weights)
+        if not good.all():
+            if not ignore_bad:
+                raise RuntimeError("NaN or Inf values detected in input array!")
+            catalog = catalog[good]
+            values = values[good]
+            weights = weights[good] if weights is not None else None
+            if len(values) == 0:
+                raise RuntimeError("No good entries left to use after excluding bad values!")
+        if group_field is None:
+            grouped = GroupBy(numpy.zeros(len(values), dtype=int))
+        else:
+            grouped = GroupBy(catalog[group_field])
+
+        result = numpy.zeros(grouped.n_groups,
+                             dtype=[('group', grouped.keys.dtype), ('N', int), ('mean', float),
+                                    ('values', float, (len(use_percentiles),)),
+                                    ('clipped_mean', float), ('clipped_stddev', float),
+                                    ('clipped_N', int), ('biweight_location', float),
+                                    ('biweight_scale', float)])
+        result['group'] = grouped.keys
+        result['N'] = grouped.counts
+        result['mean'] = grouped.mean(values, weights)
+        result['values'] = stat_kernels.WeightedPercentiles(grouped, values, weights,
+                                                            use_percentiles)
+        (result['clipped_mean'], result['clipped_stddev'],
+         result['clipped_N']) = stat_kernels.SigmaClippedMean(grouped, values, weights,
+                                                              n_sigma=n_sigma, max_iter=max_iter)
+        result['biweight_location'] = stat_kernels.BiweightLocation(grouped, values)
+        result['biweight_scale'] = stat_kernels.BiweightScale(grouped, values,
+                                                              result['biweight_location'])
+        return result
+
+# The classes made by the WhiskerPlotSysTest factory for each value of its type kwarg.
+whisker_plot_types = {None: 'BaseWhiskerPlotSysTest',
+                      'Star': 'WhiskerPlotStarSysTest',
+                      'PSF': 'WhiskerPlotPSFSysTest',
+                      'Residual': 'WhiskerPlotResidualSysTest'}
+
 def WhiskerPlotSysTest(type=None):
     """
     Initialize an instance of a :class:`BaseWhiskerPlotSysTest` class, based on the ``type`` kwarg
@@ -1198,16 +1518,7 @@ def WhiskerPlotSysTest(type=None):
           signature than the other methods and that it lacks many of the convenience variables the
           other WhiskerPlots have, such as self.objects_list and self.required_quantities.
     """
-    if type=='Star':
-        return WhiskerPlotStarSysTest()
-    elif type=='PSF':
-        return WhiskerPlotPSFSysTest()
-    elif type=='Residual':
-        return WhiskerPlotResidualSysTest()
-    elif type is None:
-        return BaseWhiskerPlotSysTest()
-    else:
-        raise ValueError('Unknown whisker plot type %s given to type kwarg'%type)
+    return _makeSysTest(whisker_plot_types, type, 'whisker plot')
 
 class BaseWhiskerPlotSysTest(SysTest):
     """
@@ -1219,7 +1530,8 @@ class BaseWhiskerPlotSysTest(SysTest):
     short_name = 'whiskerplot'
     def whiskerPlot(self, x, y, g1, g2, size=None, linewidth=0.01, scale=None,
                     keylength=0.05, figsize=None, xlabel=None, ylabel=None,
-                    size_label=None, xlim=None, ylim=None, equal_axis=False):
+                    size_label=None, xlim=None, ylim=None, equal_axis=False, aggregate=False,
+                    cell_size=None, objects_per_cell=50, weights=None):
         """
         Draw a whisker plot and return a :class:`matplotlib.figure.Figure` object.
         This method has a bunch of options for controlling the appearance of a plot, which are
@@ -1259,11 +1571,21 @@ class BaseWhiskerPlotSysTest(SysTest):
         :param equal_axis:      If True, force equal scaling for the x and y axes (distance between
                                 ticks of the same numerical values are equal on the x and y axes).
                                 [default: False]
-        :returns: a :class:`matplotlib.figure.Figure` object.
+        :param aggregate:       If True, average the objects in the cells of a square grid and draw
+                                one whisker per cell instead of one per object (see
+                                :func:`gridAverage`); the per-cell results, including the number
+                                of objects in each cell, are then available from :func:`getData`.
+                                [default: False]
+        :param cell_size:       The side length of the grid cells, in the units of ``x`` and ``y``,
+                                if ``aggregate=True``.
+                                [default: None, meaning choose it from ``objects_per_cell``]
+        :param objects_per_cell: The average number of objects per cell used to choose the cell
+                                size automatically, if ``aggregate=True``. [default: 50]
+        :param weights:         Weights for the objects in the per-cell averages, if
+                                ``aggregate=True``. [default: None, meaning equal weights]
+        :returns: a :class:`matplotlib.figure.Figure` object, or a
+                  :class:`stile.plot_queue.PlotSpec` if ``self.defer_plots`` is True.
         """
-        fig = plt.figure(figsize=figsize)
-        ax = fig.add_subplot(1, 1, 1)
-
         # mask data with nan
         sel = numpy.logical_and.reduce(
             [numpy.isnan(x) == False, numpy.isnan(y) == False,
@@ -1275,6 +1597,26 @@ class BaseWhiskerPlotSysTest(SysTest):
         g2 = g2[sel]
         size = size[sel] if size is not None else size
 
+        if aggregate:
+            weights = numpy.asarray(weights)[sel] if weights is not None else None
+            self.data = self.gridAverage(x, y, g1, g2, size=size, weights=weights,
+                                         cell_size=cell_size, objects_per_cell=objects_per_cell,
+                                         xlim=xlim, ylim=ylim)
+            x, y, g1, g2 = self.data['x'], self.data['y'], self.data['g1'], self.data['g2']
+            size = self.data['size'] if size is not None else None
+
+        if self.defer_plots:
+            # Defer only the drawing: the (possibly much smaller) aggregated arrays go in the spec,
+            # and getData() already returns the cells.
+            return PlotSpec(self, 'whiskerPlot', x, y, g1, g2, size=size, linewidth=linewidth,
+                            scale=scale, keylength=keylength, figsize=figsize, xlabel=xlabel,
+                            ylabel=ylabel, size_label=size_label, xlim=xlim, ylim=ylim,
+                            equal_axis=equal_axis)
+
+        template = self._getFigureTemplate(('whiskerPlot', size is None, equal_axis), figsize)
+        fig = template.figure
+        ax = template.axes[0]
+
         # plot
         g = numpy.sqrt(g1*g1+g2*g2)
         theta = numpy.arctan2(g2, g1)/2
@@ -1290,11 +1632,11 @@ class BaseWhiskerPlotSysTest(SysTest):
                           headwidth=0., headlength=0., headaxislength=0.,
                           pivot='middle', width=linewidth,
                           scale=scale)
-            cb = fig.colorbar(q)
+            cb = template.colorbar(q)
             if size_label is not None:
                 cb.set_label(size_label)
 
-        qk = plt.quiverkey(q, 0.5, 0.92, keylength, r'$g= %s$' % str(keylength), labelpos='W')
+        qk = ax.quiverkey(q, 0.5, 0.92, keylength, r'$g= %s$' % str(keylength), labelpos='W')
         if xlabel is not None:
             ax.set_xlabel(xlabel)
         if ylabel is not None:
@@ -1306,6 +1648,86 @@ class BaseWhiskerPlotSysTest(SysTest):
         if ylim is not None:
             ax.set_ylim(*ylim)
         return fig
+
+    @staticmethod
+    def gridAverage(x, y, g1, g2, size=None, weights=None, cell_size=None, objects_per_cell=50,
+                    xlim=None, ylim=None):
+        """
+        Average shapes (and, optionally, sizes) of objects in the cells of a square grid.
+
+        The ellipticity components ``g1`` and ``g2`` are averaged separately, which is the correct
+        average for a spin-2 quantity (it averages the complex ellipticity ``g1+i*g2``); averaging
+        the whisker lengths and angles instead would be biased.  All the sums are computed with
+        :func:`numpy.bincount`, so this takes a few passes over the data regardless of the number
+        of cells.
+
+        :param x, y:            NumPy arrays of the object positions.
+        :param g1, g2:          NumPy arrays of the ellipticity components.
+        :param size:            A NumPy array of object sizes. [default: None]
+        :param weights:         A NumPy array of weights. [default: None, meaning equal weights]
+        :param cell_size:       The side length of the cells.
+                                [default: None, meaning choose a cell size such that there are
+                                ``objects_per_cell`` objects per cell on average]
+        :param objects_per_cell: The target mean number of objects per cell when choosing the cell
+                                size automatically. [default: 50]
+        :param xlim, ylim:      The (min, max) extent of the grid in each direction.
+                                [default: None, meaning the range of the data]
+        :returns: a structured NumPy array with one row per non-empty cell and fields ``x``,
+                  ``y`` (the cell centers), ``N`` (the number of objects in the cell), ``weight``
+                  (the sum of their weights), ``g1``, ``g2`` and, if ``size`` was given, ``size``
+                  (the weighted means).
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        if weights is None:
+            weights = numpy.ones(len(x))
+        weights = numpy.asarray(weights, dtype=float)
+        if xlim is None or xlim[0] is None or xlim[1] is None:
+            xlim = (numpy.min(x), numpy.max(x)) if len(x) else (0., 1.)
+        if ylim is None or ylim[0] is None or ylim[1] is None:
+            ylim = (numpy.min(y), numpy.max(y)) if len(y) else (0., 1.)
+        width = max(xlim[1]-xlim[0], 0.)
+        height = max(ylim[1]-ylim[0], 0.)
+        if cell_size is None:
+            n_cells = max(len(x)/float(objects_per_cell), 1.)
+            if width > 0 and height > 0:
+                cell_size = numpy.sqrt(width*height/n_cells)
+            else:
+                cell_size = max(width, height, 1.)/n_cells
+        if cell_size <= 0:
+            raise ValueError('cell_size must be positive')
+        nx = max(int(numpy.ceil(width/cell_size)), 1)
+        ny = max(int(numpy.ceil(height/cell_size)), 1)
+        ix = numpy.floor((x-xlim[0])/cell_size).astype(int)
+        iy = numpy.floor((y-ylim[0])/cell_size).astype(int)
+        # Objects exactly on the upper edges belong to the last cell.
+        ix[ix == nx] = nx-1
+        iy[iy == ny] = ny-1
+        use = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        cell = (iy*nx+ix)[use]
+        weights = weights[use]
+        counts = numpy.bincount(cell, minlength=nx*ny)
+        sum_weights = numpy.bincount(cell, weights=weights, minlength=nx*ny)
+        occupied = (counts > 0) & (sum_weights > 0)
+        fields = ['x', 'y', 'N', 'weight', 'g1', 'g2']
+        if size is not None:
+            fields.append('size')
+        result = numpy.zeros(numpy.sum(occupied),
+                             dtype=[(f, int if f == 'N' else float) for f in fields])
+        index = numpy.nonzero(occupied)[0]
+        result['x'] = xlim[0]+(index % nx+0.5)*cell_size
+        result['y'] = ylim[0]+(index//nx+0.5)*cell_size
+        result['N'] = counts[occupied]
+        result['weight'] = sum_weights[occupied]
+        quantities = [('g1', g1), ('g2', g2)]
+        if size is not None:
+            quantities.append(('size', size))
+        for name, values in quantities:
+            values = numpy.asarray(values, dtype=float)[use]
+            result[name] = (numpy.bincount(cell, weights=weights*values,
+                                           minlength=nx*ny)[occupied]/result['weight'])
+        return result
+
     def __call__(self, *args, **kwargs):
         return self.whiskerPlot(*args, **kwargs)
     def getData(self):
@@ -1321,7 +1743,7 @@ class WhiskerPlotStarSysTest(BaseWhiskerPlotSysTest):
     required_quantities = [('x', 'y', 'g1', 'g2', 'sigma')]
 
     def __call__(self, array, linewidth=0.01, scale=None, figsize=None,
-                 xlim=None, ylim=None):
+                 xlim=None, ylim=None, aggregate=False, cell_size=None, objects_per_cell=50):
         if 'CCD' in array.dtype.names:
             fields = list(self.required_quantities[0]) + ['CCD']
         else:
@@ -1331,7 +1753,9 @@ class WhiskerPlotStarSysTest(BaseWhiskerPlotSysTest):
                                 linewidth=linewidth, scale=scale, figsize=figsize,
                                 xlabel=r'$x$ [pixel]', ylabel=r'$y$ [pixel]',
                                 size_label=r'$\sigma$ [pixel]',
-                                xlim=xlim, ylim=ylim, equal_axis=True)
+                                xlim=xlim, ylim=ylim, equal_axis=True, aggregate=aggregate,
+                                cell_size=cell_size, objects_per_cell=objects_per_cell,
+                                weights=array['w'] if 'w' in array.dtype.names else None)
 
 
 class WhiskerPlotPSFSysTest(BaseWhiskerPlotSysTest):
@@ -1344,7 +1768,7 @@ class WhiskerPlotPSFSysTest(BaseWhiskerPlotSysTest):
     required_quantities = [('x', 'y', 'psf_g1', 'psf_g2', 'psf_sigma')]
 
     def __call__(self, array, linewidth=0.01, scale=None, figsize=None,
-                 xlim=None, ylim=None):
+                 xlim=None, ylim=None, aggregate=False, cell_size=None, objects_per_cell=50):
         if 'CCD' in array.dtype.names:
             fields = list(self.required_quantities[0]) + ['CCD']
         else:
@@ -1354,7 +1778,9 @@ class WhiskerPlotPSFSysTest(BaseWhiskerPlotSysTest):
                                 array['psf_sigma'], linewidth=linewidth, scale=scale,
                                 figsize=figsize, xlabel=r'$x$ [pixel]', ylabel=r'$y$ [pixel]',
                                 size_label=r'$\sigma$ [pixel]',
-                                xlim=xlim, ylim=ylim, equal_axis=True)
+                                xlim=xlim, ylim=ylim, equal_axis=True, aggregate=aggregate,
+                                cell_size=cell_size, objects_per_cell=objects_per_cell,
+                                weights=array['w'] if 'w' in array.dtype.names else None)
 
 
 class WhiskerPlotResidualSysTest(BaseWhiskerPlotSysTest):
@@ -1366,7 +1792,7 @@ class WhiskerPlotResidualSysTest(BaseWhiskerPlotSysTest):
     required_quantities = [('x', 'y', 'g1', 'g2', 'sigma', 'psf_g1', 'psf_g2', 'psf_sigma')]
 
     def __call__(self, array, linewidth=0.01, scale=None, figsize=None,
-                 xlim=None, ylim=None):
+                 xlim=None, ylim=None, aggregate=False, cell_size=None, objects_per_cell=50):
         data = [array['x'], array['y'], array['g1'] - array['psf_g1'],
                 array['g2'] - array['psf_g2'], array['sigma'] - array['psf_sigma']]
         fields = ['x', 'y', 'g1-psf_g1', 'g2-psf_g2', 'sigma-psf_sigma']
@@ -1379,7 +1805,329 @@ class WhiskerPlotResidualSysTest(BaseWhiskerPlotSysTest):
                                 linewidth=linewidth, scale=scale,
                                 figsize=figsize, xlabel=r'$x$ [pixel]', ylabel=r'$y$ [pixel]',
                                 size_label=r'$\sigma$ [pixel]',
-                                xlim=xlim, ylim=ylim, equal_axis=True)
+                                xlim=xlim, ylim=ylim, equal_axis=True, aggregate=aggregate,
+                                cell_size=cell_size, objects_per_cell=objects_per_cell,
+                                weights=array['w'] if 'w' in array.dtype.names else None)
+
+
+class FocalPlaneMap(object):
+    """
+    The results of a :class:`FocalPlaneMapSysTest`: counts, sums and sums of squares of a set of
+    quantities in the cells of a fixed (x, y) grid, plus the median of each quantity in each cell.
+
+    Maps made on the same grid (for example, one per visit) can be combined with :func:`merge`
+    into a single map (for example, for a whole survey).  Means and standard deviations are exact
+    for merged maps, since they come from the counts and sums; medians cannot be combined this way,
+    so a merged map has ``NaN`` medians.  Maps can be saved and restored with :func:`getState` and
+    :func:`fromState`, in the same way as :class:`stile.stile_utils.Stats` objects.
+
+    :param x_edges:    The bin edges of the grid in x.
+    :param y_edges:    The bin edges of the grid in y.
+    :param quantities: The names of the mapped quantities.
+    """
+    def __init__(self, x_edges, y_edges, quantities):
+        self.x_edges = numpy.asarray(x_edges, dtype=float)
+        self.y_edges = numpy.asarray(y_edges, dtype=float)
+        self.quantities = list(quantities)
+        shape = (len(self.y_edges)-1, len(self.x_edges)-1)
+        self.counts = numpy.zeros(shape, dtype=int)
+        self.sums = dict([(q, numpy.zeros(shape)) for q in self.quantities])
+        self.sums_sq = dict([(q, numpy.zeros(shape)) for q in self.quantities])
+        self.medians = dict([(q, numpy.full(shape, numpy.nan)) for q in self.quantities])
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    def mean(self, quantity):
+        """Return the mean of ``quantity`` in each cell (``NaN`` for empty cells)."""
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return self.sums[quantity]/self.counts
+
+    def std(self, quantity):
+        """Return the standard deviation of ``quantity`` in each cell (``NaN`` for empty cells)."""
+        mean = self.mean(quantity)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            variance = self.sums_sq[quantity]/self.counts-mean*mean
+        return numpy.sqrt(numpy.maximum(variance, 0.))
+
+    def median(self, quantity):
+        """Return the median of ``quantity`` in each cell (``NaN`` for empty cells, and for all
+        cells of merged maps)."""
+        return self.medians[quantity]
+
+    def merge(self, other):
+        """Return a new :class:`FocalPlaneMap` combining this map and ``other``, which must have
+        the same grid and quantities."""
+        if (not numpy.array_equal(self.x_edges, other.x_edges) or
+                not numpy.array_equal(self.y_edges, other.y_edges)):
+            raise ValueError('Only FocalPlaneMaps with the same grid can be merged')
+        if self.quantities != other.quantities:
+            raise ValueError('Only FocalPlaneMaps of the same quantities can be merged')
+        result = FocalPlaneMap(self.x_edges, self.y_edges, self.quantities)
+        result.counts = self.counts+other.counts
+        for q in self.quantities:
+            result.sums[q] = self.sums[q]+other.sums[q]
+            result.sums_sq[q] = self.sums_sq[q]+other.sums_sq[q]
+        return result
+
+    def getState(self):
+        """Return a dict of NumPy arrays from which :func:`fromState` can rebuild this object."""
+        state = {'x_edges': self.x_edges, 'y_edges': self.y_edges,
+                 'quantities': numpy.array(self.quantities), 'counts': self.counts}
+        for q in self.quantities:
+            state['sum_'+q] = self.sums[q]
+            state['sum_sq_'+q] = self.sums_sq[q]
+            state['median_'+q] = self.medians[q]
+        return state
+
+    @classmethod
+    def fromState(cls, state):
+        """Rebuild a :class:`FocalPlaneMap` from the output of :func:`getState`."""
+        result = cls(state['x_edges'], state['y_edges'], [str(q) for q in state['quantities']])
+        result.counts = numpy.asarray(state['counts'], dtype=int)
+        for q in result.quantities:
+            result.sums[q] = numpy.asarray(state['sum_'+q], dtype=float)
+            result.sums_sq[q] = numpy.asarray(state['sum_sq_'+q], dtype=float)
+            result.medians[q] = numpy.asarray(state['median_'+q], dtype=float)
+        return result
+
+    def getData(self):
+        """Return a structured NumPy array with one row per non-empty cell, containing the cell
+        center, the count, and the mean, median and standard deviation of each quantity."""
+        iy, ix = numpy.nonzero(self.counts)
+        x_centers = 0.5*(self.x_edges[:-1]+self.x_edges[1:])
+        y_centers = 0.5*(self.y_edges[:-1]+self.y_edges[1:])
+        data = [x_centers[ix], y_centers[iy], self.counts[iy, ix]]
+        names = ['x', 'y', 'N']
+        for q in self.quantities:
+            data += [self.mean(q)[iy, ix], self.median(q)[iy, ix], self.std(q)[iy, ix]]
+            names += ['mean_'+q, 'median_'+q, 'stddev_'+q]
+        return numpy.rec.fromarrays(data, names=names)
+
+    def plot(self, statistic='mean', figsize=None):
+        """Draw a map of each quantity and of the counts, and return the
+        :class:`matplotlib.figure.Figure`.
+
+        :param statistic: Which statistic to show, 'mean' or 'median'. [default: 'mean']
+        :param figsize:   Size of the figure ``(x, y)`` in units of inches.
+                          [default: None, meaning use the matplotlib default for each panel]
+        """
+        if statistic not in ['mean', 'median']:
+            raise ValueError("statistic should be 'mean' or 'median'")
+        n_panels = len(self.quantities)+1
+        if figsize is None:
+            figsize = (4.*n_panels, 3.5)
+        fig = NewFigure(figsize)
+        extent = [self.x_edges[0], self.x_edges[-1], self.y_edges[0], self.y_edges[-1]]
+        maps = [getattr(self, statistic)(q) for q in self.quantities]+[self.counts]
+        labels = ['%s %s' % (statistic, q) for q in self.quantities]+['N']
+        for i, (image, label) in enumerate(zip(maps, labels)):
+            ax = fig.add_subplot(1, n_panels, i+1)
+            if i < len(self.quantities):
+                # Residual maps use a symmetric color scale around zero.
+                vmax = numpy.nanmax(numpy.abs(image)) if numpy.any(numpy.isfinite(image)) else 1.
+                im = ax.imshow(image, origin='lower', extent=extent, cmap='RdBu_r',
+                               vmin=-vmax, vmax=vmax, aspect='equal', interpolation='nearest')
+            else:
+                im = ax.imshow(image, origin='lower', extent=extent, aspect='equal',
+                               interpolation='nearest')
+            ax.set_title(label)
+            ax.set_xlabel(r'$x$ [pixel]')
+            if i == 0:
+                ax.set_ylabel(r'$y$ [pixel]')
+            fig.colorbar(im, ax=ax)
+        fig.tight_layout()
+        return fig
+
+
+class FocalPlaneMapSysTest(SysTest):
+    """
+    A class to make binned maps of the (star-PSF) residuals in ``g1``, ``g2`` and ``sigma`` across
+    the focal plane (or any other flat (x, y) coordinate system), for data sets too large to draw
+    star by star.
+
+    The stars are assigned to the cells of a fixed grid, and the counts, sums and sums of squares
+    of the residuals are accumulated in one :func:`numpy.bincount` pass per quantity; the medians
+    of each cell come from a single group-by over the occupied cells.  The result is a
+    :class:`FocalPlaneMap`, which can be merged with maps made on the same grid (for example,
+    from other visits).  The grid should therefore be given explicitly (with ``xlim``, ``ylim``
+    and ``n_bins``) whenever maps are to be merged; if the limits are not given, they are taken
+    from the range of the data.
+
+    :param xlim:   The (min, max) limits of the grid in x. [default: None, meaning use the data]
+    :param ylim:   The (min, max) limits of the grid in y. [default: None, meaning use the data]
+    :param n_bins: The number of cells in (x, y), or a single number for both. [default: 50]
+    """
+    short_name = 'focalplane_map'
+    long_name = 'Make binned focal-plane maps of star-PSF residuals'
+    objects_list = ['star PSF']
+    required_quantities = [('x', 'y', 'g1', 'g2', 'sigma', 'psf_g1', 'psf_g2', 'psf_sigma')]
+    quantities = ['g1-psf_g1', 'g2-psf_g2', 'sigma-psf_sigma']
+
+    def __init__(self, xlim=None, ylim=None, n_bins=50):
+        self.xlim = xlim
+        self.ylim = ylim
+        self.n_bins = n_bins
+        self.data = None
+
+    @staticmethod
+    def _getEdges(values, lim, n_bins):
+        if lim is None or lim[0] is None or lim[1] is None:
+            lim = (numpy.min(values), numpy.max(values))
+            if lim[0] == lim[1]:
+                lim = (lim[0]-0.5, lim[1]+0.5)
+        return numpy.linspace(lim[0], lim[1], int(n_bins)+1)
+
+    def __call__(self, array, xlim=None, ylim=None, n_bins=None):
+        """Make a :class:`FocalPlaneMap` of the residuals of the stars in ``array``, a structured
+        NumPy array with the fields in ``required_quantities``.  Stars outside the grid are
+        ignored.  Keyword arguments override the values given at initialization.
+        """
+        use_xlim = xlim if xlim is not None else self.xlim
+        use_ylim = ylim if ylim is not None else self.ylim
+        use_n_bins = n_bins if n_bins is not None else self.n_bins
+        if not hasattr(use_n_bins, '__iter__'):
+            use_n_bins = (use_n_bins, use_n_bins)
+        x = numpy.asarray(array['x'], dtype=float)
+        y = numpy.asarray(array['y'], dtype=float)
+        values = [numpy.asarray(array['g1']-array['psf_g1'], dtype=float),
+                  numpy.asarray(array['g2']-array['psf_g2'], dtype=float),
+                  numpy.asarray(array['sigma']-array['psf_sigma'], dtype=float)]
+        good = numpy.isfinite(x) & numpy.isfinite(y)
+        for v in values:
+            good &= numpy.isfinite(v)
+        x_edges = self._getEdges(x[good], use_xlim, use_n_bins[0])
+        y_edges = self._getEdges(y[good], use_ylim, use_n_bins[1])
+        result = FocalPlaneMap(x_edges, y_edges, self.quantities)
+        nx = len(x_edges)-1
+        ny = len(y_edges)-1
+
+        # Assign cells.  The last edge is inclusive, as for numpy.histogram.
+        ix = numpy.searchsorted(x_edges, x, side='right')-1
+        iy = numpy.searchsorted(y_edges, y, side='right')-1
+        ix[x == x_edges[-1]] = nx-1
+        iy[y == y_edges[-1]] = ny-1
+        good &= (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        cell = (iy*nx+ix)[good]
+        result.counts = numpy.bincount(cell, minlength=nx*ny).reshape(ny, nx)
+        if len(cell):
+            grouped = GroupBy(cell)
+        for q, v in zip(self.quantities, values):
+            v = v[good]
+            result.sums[q] = numpy.bincount(cell, weights=v, minlength=nx*ny).reshape(ny, nx)
+            result.sums_sq[q] = numpy.bincount(cell, weights=v*v,
+                                               minlength=nx*ny).reshape(ny, nx)
+            if len(cell):
+                result.medians[q].reshape(-1)[grouped.keys] = grouped.median(v)
+        self.data = result.getData()
+        return result
+
+    def getData(self):
+        """Return the per-cell results of the last call as a structured NumPy array (see
+        :func:`FocalPlaneMap.getData`)."""
+        return self.data
+
+    def plot(self, results):
+        """Return a :class:`matplotlib.figure.Figure` with the maps in ``results``, a
+        :class:`FocalPlaneMap`."""
+        return results.plot()
+
+
+class HistogramCounts(object):
+    """
+    The (weighted) counts of a set of values in fixed histogram bins, plus the (weighted) number of
+    values below and above the binned range.
+
+    Counts can be accumulated from any number of arrays with :func:`update`, for example one per
+    CCD or per file chunk, and counts made with the same bin edges (for example, on different
+    nodes) can be combined with :func:`merge`, so a histogram of a whole tract never needs all the
+    data in memory at once.  Counts can be saved and restored with :func:`getState` and
+    :func:`fromState`, in the same way as :class:`FocalPlaneMap` objects.
+
+    :param edges: The bin edges, in increasing order.
+    """
+    def __init__(self, edges):
+        self.edges = numpy.asarray(edges, dtype=float).reshape(-1)
+        if len(self.edges) < 2 or numpy.any(numpy.diff(self.edges) <= 0):
+            raise ValueError('Histogram bin edges must be increasing, with at least one bin')
+        self.counts = numpy.zeros(len(self.edges)-1)
+        self.underflow = 0.
+        self.overflow = 0.
+        widths = numpy.diff(self.edges)
+        self._uniform = numpy.allclose(widths, widths[0], rtol=1.E-12, atol=0.)
+
+    @property
+    def widths(self):
+        return numpy.diff(self.edges)
+
+    @property
+    def centers(self):
+        return 0.5*(self.edges[:-1]+self.edges[1:])
+
+    def update(self, data, weights=None):
+        """Add the values in ``data`` (with optional ``weights``) to the counts, ignoring NaNs.
+        As for :func:`numpy.histogram`, the bins include their lower edges, and the last bin
+        also includes its upper edge.  Returns this object."""
+        data = numpy.asarray(data, dtype=float).reshape(-1)
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=float).reshape(-1)
+            if len(weights) != len(data):
+                raise ValueError('data and weights must have the same length')
+        finite = numpy.isfinite(data)
+        if not numpy.all(finite):
+            data = data[finite]
+            weights = weights[finite] if weights is not None else None
+        n_bins = len(self.counts)
+        if self._uniform:
+            # Equal-width bins: compute the bin index directly instead of searching the edges.
+            index = data-self.edges[0]
+            index *= n_bins/(self.edges[-1]-self.edges[0])
+            index = numpy.floor(index)
+        else:
+            index = numpy.searchsorted(self.edges, data, side='right')-1.
+        index[data == self.edges[-1]] = n_bins-1
+        below = index < 0
+        above = index >= n_bins
+        if weights is None:
+            self.underflow += numpy.sum(below)
+            self.overflow += numpy.sum(above)
+        else:
+            self.underflow += numpy.sum(weights[below])
+            self.overflow += numpy.sum(weights[above])
+        inside = ~(below | above)
+        self.counts += numpy.bincount(index[inside].astype(int), minlength=n_bins,
+                                      weights=weights[inside] if weights is not None else None)
+        return self
+
+    def merge(self, other):
+        """Return a new :class:`HistogramCounts` combining this one and ``other``, which must have
+        the same bin edges."""
+        if not numpy.array_equal(self.edges, other.edges):
+            raise ValueError('Only HistogramCounts with the same bin edges can be merged')
+        result = HistogramCounts(self.edges)
+        result.counts = self.counts+other.counts
+        result.underflow = self.underflow+other.underflow
+        result.overflow = self.overflow+other.overflow
+        return result
+
+    def density(self):
+        """Return the counts normalized so that they integrate to 1 over the binned range."""
+        return self.counts/(numpy.sum(self.counts)*self.widths)
+
+    def getState(self):
+        """Return a dict of NumPy arrays from which :func:`fromState` can rebuild this object."""
+        return {'edges': self.edges, 'counts': self.counts,
+                'outside': numpy.array([self.underflow, self.overflow])}
+
+    @classmethod
+    def fromState(cls, state):
+        """Rebuild a :class:`HistogramCounts` from the output of :func:`getState`."""
+        result = cls(state['edges'])
+        result.counts = numpy.asarray(state['counts'], dtype=float)
+        result.underflow, result.overflow = [float(o) for o in state['outside']]
+        return result
+
 
 class HistogramSysTest(SysTest):
     """
@@ -1392,6 +2140,10 @@ class HistogramSysTest(SysTest):
 
     See the documentation for the method :func:`HistoPlot` for a list of available kwargs.
 
+    Histograms are drawn from :class:`HistogramCounts` objects, which can also be accumulated
+    chunk by chunk with :func:`accumulate` and merged, so a histogram of a large data set does not
+    need all the data at once.
+
     This class uses some code from the AstroML package, (c) Jake Vanderplas 2012-2013, under a
     BSD license--please see the code file for the full text of the license.
     """
@@ -1405,7 +2157,7 @@ class HistogramSysTest(SysTest):
                  cumulative=False, align='mid', rwidth=0.9,
                  log=False, color='k', alpha=1.0,
                  text=None, text_x=0.90, text_y=0.90, fontsize=12,
-                 linewidth=2.0, vlines=None, vcolor='k'):
+                 linewidth=2.0, vlines=None, vcolor='k', max_sample=None):
         self.field = field
         self.binning_style = binning_style
         self.nbins = nbins
@@ -1433,6 +2185,7 @@ class HistogramSysTest(SysTest):
         self.linewidth = linewidth
         self.vlines = vlines
         self.vcolor = vcolor
+        self.max_sample = max_sample
 
     def get_param_value(self, param, ii, data_dim, multihist=False):
         if type(param) is list and multihist:
@@ -1446,17 +2199,37 @@ class HistogramSysTest(SysTest):
             param_use = param
         return param_use
 
+    @staticmethod
+    def _subsample(data, max_sample):
+        """Return ``data``, or a random subsample of ``max_sample`` of its points (with a fixed
+        seed, so the bins are reproducible) if it is larger than that."""
+        if max_sample is None or data.size <= max_sample:
+            return data
+        index = numpy.random.RandomState(data.size).randint(0, data.size, int(max_sample))
+        return data[index]
+
+    @staticmethod
+    def _binsFromWidth(low, high, dx):
+        if not dx > 0:
+            # All the data (or at least the middle half of it) have the same value.
+            dx = high-low if high > low else 1.
+        Nbins = max(1, int(numpy.ceil((high-low) * 1. / dx)))
+        return dx, low + dx * numpy.arange(Nbins + 1)
+
     """
     The Scott rule for bin size
-    This function is directly copied from the astroML library
+    This function is adapted from the astroML library
     (astroMl/density_estimation/histtool.py)
     with some updates to the doc style since we're not using numpydoc.
     """
-    def scotts_bin_width(self, data, return_bins=False):
+    def scotts_bin_width(self, data, return_bins=False, max_sample=None):
         r"""Return the optimal histogram bin width using Scott's rule:
 
         :param array-like data: observed (one-dimensional) data
         :param bool return_bins:  (optional) if True, then return the bin edges
+        :param int max_sample:  (optional) if the data has more points than this, estimate the
+                                standard deviation from a random subsample of this many points
+                                (the bins still cover the full range of the data)
 
         :returns: width(float), optimal bin width using Scott's rule; bins(ndarray), bin edges
                   returned if `return_bins` is True
@@ -1477,30 +2250,30 @@ class HistogramSysTest(SysTest):
             raise ValueError("data should be one-dimensional")
 
         n = data.size
-        sigma = numpy.std(data)
+        sigma = numpy.std(self._subsample(data, max_sample))
 
         dx = 3.5 * sigma * 1. / (n ** (1. / 3))
 
         if return_bins:
-            Nbins = numpy.ceil((data.max() - data.min()) * 1. / dx)
-            Nbins = max(1, Nbins)
-            bins = data.min() + dx * numpy.arange(Nbins + 1)
-            return dx, bins
+            return self._binsFromWidth(data.min(), data.max(), dx)
         else:
             return dx
 
     """
     The Freedman-Diaconis rule of bin size
-    This function is directly copied from the astroML library
+    This function is adapted from the astroML library
     (astroMl/density_estimation/histtool.py)
     with some updates to the doc style since we're not using numpydoc.
     """
-    def freedman_bin_width(self, data, return_bins=False):
+    def freedman_bin_width(self, data, return_bins=False, max_sample=None):
         r"""Return the optimal histogram bin width using the Freedman-Diaconis
             rule
 
         :param array-like data: observed (one-dimensional) data
         :param bool return_bins: (optional) if True, then return the bin edges
+        :param int max_sample:  (optional) if the data has more points than this, estimate the
+                                quartiles from a random subsample of this many points (the bins
+                                still cover the full range of the data)
 
         :returns: width(float), optimal bin width using the Freedman-Diaconis rule; bins(ndarray),
                   bin edges returned if `return_bins` is True
@@ -1514,6 +2287,10 @@ class HistogramSysTest(SysTest):
         where :math:`q_{N}` is the :math:`N` percent quartile of the data, and
         :math:`n` is the number of data points.
 
+        The quartiles come from a single call to :func:`numpy.partition` rather than a full sort
+        of the data, and the minimum and maximum from the outer quarters of the partitioned
+        copy.
+
         See Also: knuth_bin_width; scotts_bin_width; astroML.plotting.hist
         """
         data = numpy.asarray(data)
@@ -1524,17 +2301,86 @@ class HistogramSysTest(SysTest):
         if n < 4:
             raise ValueError("data should have more than three entries")
 
-        dsorted = numpy.sort(data)
-        v25 = dsorted[n / 4 - 1]
-        v75 = dsorted[(3 * n) / 4 - 1]
+        sample = self._subsample(data, max_sample)
+        n_sample = sample.size
+        k25 = n_sample // 4 - 1
+        k75 = (3 * n_sample) // 4 - 1
+        dpartitioned = numpy.partition(sample, [k25, k75])
+        v25 = dpartitioned[k25]
+        v75 = dpartitioned[k75]
+        if sample is data:
+            # After partitioning, the extremes are in the outer quarters.
+            low, high = dpartitioned[:k25 + 1].min(), dpartitioned[k75:].max()
+        else:
+            low, high = data.min(), data.max()
 
         dx = 2 * (v75 - v25) * 1. / (n ** (1. / 3))
 
         if return_bins:
-            Nbins = numpy.ceil((dsorted[-1] - dsorted[0]) * 1. / dx)
-            Nbins = max(1, Nbins)
-            bins = dsorted[0] + dx * numpy.arange(Nbins + 1)
-            return dx, bins
+            return self._binsFromWidth(low, high, dx)
+        else:
+            return dx
+
+    def knuth_bin_width(self, data, return_bins=False, max_bins=1000, n_fine=None):
+        r"""Return the optimal histogram bin width using Knuth's rule, which maximizes the
+        Bayesian posterior probability of a piecewise-constant model of the data with equal-width
+        bins:
+
+        :param array-like data: observed (one-dimensional) data
+        :param bool return_bins: (optional) if True, then return the bin edges
+        :param int max_bins:    (optional) the largest number of bins to consider [default: 1000]
+        :param int n_fine:      (optional) the number of bins of the fine histogram from which
+                                the candidates are evaluated [default: ``10*max_bins``]
+
+        :returns: width(float), optimal bin width using Knuth's rule; bins(ndarray), bin edges
+                  returned if `return_bins` is True
+
+        Notes:
+        The number of bins :math:`M` is chosen to maximize
+
+        .. math::
+            F(M) = n\log M + \log\Gamma\left(\frac{M}{2}\right)
+                   - M\log\Gamma\left(\frac{1}{2}\right) - \log\Gamma\left(n+\frac{M}{2}\right)
+                   + \sum_{k=1}^M \log\Gamma\left(n_k+\frac{1}{2}\right)
+
+        where :math:`n_k` is the number of points in bin :math:`k` (Knuth 2006,
+        arXiv:physics/0605197).  Rather than re-binning the data for each candidate :math:`M`, the
+        data are binned once into ``n_fine`` bins and the candidate counts :math:`n_k` are read
+        off the cumulative fine histogram, so the cost is a single pass over the data; the
+        candidate bin edges are rounded to the nearest fine bin edge.
+
+        See Also: scotts_bin_width; freedman_bin_width
+        """
+        try:
+            from scipy.special import gammaln
+        except ImportError:
+            import math
+            gammaln = numpy.vectorize(math.lgamma, otypes=[float])
+        data = numpy.asarray(data)
+        if data.ndim != 1:
+            raise ValueError("data should be one-dimensional")
+        data = data[numpy.invert(numpy.isnan(data))]
+        n = data.size
+        if n < 2:
+            raise ValueError("data should have more than one entry")
+        if n_fine is None:
+            n_fine = 10 * max_bins
+        low, high = data.min(), data.max()
+        if high == low:
+            return (1., numpy.array([low - 0.5, high + 0.5])) if return_bins else 1.
+        fine = HistogramCounts(numpy.linspace(low, high, n_fine + 1)).update(data).counts
+        cumulative = numpy.concatenate([[0.], numpy.cumsum(fine)])
+        log_posterior = numpy.empty(max_bins)
+        for M in range(1, max_bins + 1):
+            fine_edges = numpy.round(numpy.arange(M + 1) * (n_fine * 1. / M)).astype(int)
+            counts = numpy.diff(cumulative[fine_edges])
+            log_posterior[M - 1] = (n * numpy.log(M) + gammaln(0.5 * M) - M * gammaln(0.5)
+                                    - gammaln(n + 0.5 * M) + numpy.sum(gammaln(counts + 0.5)))
+        Nbins = numpy.argmax(log_posterior) + 1
+        dx = (high - low) * 1. / Nbins
+
+        if return_bins:
+            return dx, numpy.linspace(low, high, Nbins + 1)
         else:
             return dx
 
@@ -1551,7 +2397,7 @@ class HistogramSysTest(SysTest):
                   cumulative=None, align=None, rwidth=None,
                   log=None, color=None, alpha=None,
                   text=None, text_x=None, text_y=None, fontsize=None,
-                  linewidth=None, vlines=None, vcolor=None):
+                  linewidth=None, vlines=None, vcolor=None, max_sample=None):
 
         """
         Draw a histogram and return a :class:`matplotlib.figure.Figure` object.
@@ -1561,7 +2407,10 @@ class HistogramSysTest(SysTest):
 
         :param data_list:    The 1-dimensional NumPy array or a list of Numpy arrays
                              for plotting histograms; or, a formatted array plus a `field`
-                             parameter (either at class initalization or as a kwarg).
+                             parameter (either at class initalization or as a kwarg).  Any of
+                             these may instead be a :class:`HistogramCounts` object (for example,
+                             from :func:`accumulate`), which is drawn as it is.  The counts of
+                             each histogram drawn are kept in the attribute ``histogram_counts``.
         :param field:        The field of data to be used, if data_list is a formatted array.
                              This can be iterable if multiple formatted arrays are passed to
                              data_list, but must have the same length as data_list.
@@ -1572,11 +2421,15 @@ class HistogramSysTest(SysTest):
                               - 'scott' :   Use Scott's rule to decide the bin size.
                               - 'freedman': Use the Freedman-Diaconis rule to decide the bin
                                 size.
+                              - 'knuth' :   Use Knuth's rule to decide the bin size.
                               - 'manual' :  Manually select a fixed number of bins.
 
                              [default: binning_style='manual']
         :param nbins:        The number of bins if binning_style = 'manual' is selected.
                              [Default: nbins = 50]
+        :param max_sample:   For binning_style = 'scott' or 'freedman', estimate the bin size
+                             from a random subsample of this many points if the data are larger.
+                             [Default: max_sample = None, meaning use all the data]
         :param weights:      An array of weights, or True to use the 'w' column from
                              the data array. [Default: None]
         :param limits:       The [min, max] limits to trim the data before the
@@ -1640,83 +2493,49 @@ class HistogramSysTest(SysTest):
         """
 
         # Get defaults from the class attributes if necessary
-        for key_name in ['field', 'binning_style', 'nbins', 'weights', 'limits', 'figsize',
-                         'normed', 'histtype', 'xlabel', 'ylabel', 'xlim', 'ylim', 'hide_x',
-                         'hide_y', 'cumulative', 'align', 'rwidth', 'log', 'color', 'alpha', 'text',
-                         'text_x', 'text_y', 'fontsize', 'linewidth', 'vlines', 'vcolor']:
-            exec('if %s is None: %s = self.%s'%(key_name, key_name, key_name))
+        field = self.field if field is None else field
+        binning_style = self.binning_style if binning_style is None else binning_style
+        nbins = self.nbins if nbins is None else nbins
+        weights = self.weights if weights is None else weights
+        limits = self.limits if limits is None else limits
+        figsize = self.figsize if figsize is None else figsize
+        normed = self.normed if normed is None else normed
+        histtype = self.histtype if histtype is None else histtype
+        xlabel = self.xlabel if xlabel is None else xlabel
+        ylabel = self.ylabel if ylabel is None else ylabel
+        xlim = self.xlim if xlim is None else xlim
+        ylim = self.ylim if ylim is None else ylim
+        hide_x = self.hide_x if hide_x is None else hide_x
+        hide_y = self.hide_y if hide_y is None else hide_y
+        cumulative = self.cumulative if cumulative is None else cumulative
+        align = self.align if align is None else align
+        rwidth = self.rwidth if rwidth is None else rwidth
+        log = self.log if log is None else log
+        color = self.color if color is None else color
+        alpha = self.alpha if alpha is None else alpha
+        text = self.text if text is None else text
+        text_x = self.text_x if text_x is None else text_x
+        text_y = self.text_y if text_y is None else text_y
+        fontsize = self.fontsize if fontsize is None else fontsize
+        linewidth = self.linewidth if linewidth is None else linewidth
+        vlines = self.vlines if vlines is None else vlines
+        vcolor = self.vcolor if vcolor is None else vcolor
+        max_sample = self.max_sample if max_sample is None else max_sample
 
         ## Define the plot
-        hist = plt.figure(figsize=figsize)
-        ax   = hist.add_subplot(1, 1, 1)
+        template = self._getFigureTemplate(('HistoPlot', log, hide_x, hide_y), figsize)
+        hist = template.figure
+        ax   = template.axes[0]
 
+        if isinstance(data_list, HistogramCounts):
+            data_list = [data_list]
         data_dim = len(data_list)
-        for ii in range(data_dim):
-
-            if type(data_list[0]) is list or type(data_list[0]) is numpy.ndarray:
-                multihist = True
-                data = data_list[ii]
-            else:
-                multihist = False
-                data = data_list
-
-            if field is not None:
-                if not isinstance(field, str) and hasattr(field, '__iter__'):
-                    if len(field)!=data_dim or not multihist:
-                        raise RuntimeError('Different length lists of data & lists of fields!')
-                    data = data[field][ii]
-                else:
-                    data = data[field]
-
-
-            # mask data with NaN
-            data = data[numpy.isnan(data) == False]
-            data = numpy.asarray(data)
-
-            # trim the data if necessary
-            if limits is not None:
-                data = data[(data >= limits[0]) & (data <= limits[1])]
-
-            # decide which bin style to use
-            style_use = self.get_param_value(binning_style, ii, data_dim,
-                                             multihist=multihist)
-
-            # now support constant bin size, Scott rule, and Freedman rule
-            if style_use in ['scott', 'freedman', 'manual']:
-                if (style_use is 'scott'):
-                    "Use the Scott rule"
-                    dx, bins = self.scotts_bin_width(data, True)
-                elif style_use is 'freedman':
-                    "Use the Freedman rule"
-                    dx, bins = self.freedman_bin_width(data, True)
-                elif style_use is 'manual':
-                    bins = nbins
-            else:
-                print("Unrecognized code for binning style, use default instead!")
-                bins = nbins
-
-            if weights is True:
-                weights = data['w']
-
-            # decide if weight is presented
-            if weights is not None and multihist:
-                if len(weights) == data_dim:
-                    weight_use = weights[ii]
-                else:
-                    import warnings
-                    warnings.warn("Inconsistent shape between data and weights! No weight is used!")
-                    weight_use = None
-            elif weights is not None:
-                if len(weights) == len(data):
-                    weight_use = weights
-                else:
-                    import warnings
-                    warnings.warn("Inconsistent shape between data and weights! No weight is used!")
-                    weight_use = None
-            else:
-                import warnings
-                warnings.warn("The format of given weights cannot be understood! No weight is used!")
-                weight_use = None
+        multihist = isinstance(data_list[0], (list, numpy.ndarray, HistogramCounts))
+        self.histogram_counts = self.makeCounts(data_list, field=field,
+                                                binning_style=binning_style, nbins=nbins,
+                                                weights=weights, limits=limits,
+                                                max_sample=max_sample)
+        for ii, hist_counts in enumerate(self.histogram_counts):
 
             # decide which histtype to use
             hist_use = self.get_param_value(histtype, ii, data_dim,
@@ -1735,46 +2554,22 @@ class HistogramSysTest(SysTest):
                                               multihist=multihist)
 
             # make the histogram
-            counts, edges, patches = ax.hist(data, bins,
-                                             weights = weight_use,
-                                             histtype = hist_use,
-                                             color = color_use,
-                                             normed = normed,
-                                             cumulative = cumulative,
-                                             alpha = alpha_use,
-                                             rwidth = rwidth_use,
-                                             log = log,
-                                             align = align,
-                                             linewidth = lwidth_use
-                                            )
-
-            # outline the filled region
-            if hist_use is 'stepfilled':
-                counts, edges, patches = ax.hist(data, bins,
-                                                 weights = weight_use,
-                                                 histtype = 'step',
-                                                 color = 'k',
-                                                 normed = normed,
-                                                 cumulative = cumulative,
-                                                 alpha = 1.0,
-                                                 rwidth = rwidth_use,
-                                                 log = log,
-                                                 align = align,
-                                                 linewidth = 1.0
-                                                )
+            self._drawCounts(ax, hist_counts, histtype=hist_use, color=color_use,
+                             normed=normed, cumulative=cumulative, alpha=alpha_use,
+                             rwidth=rwidth_use, align=align, linewidth=lwidth_use)
+            if log:
+                ax.set_yscale('log')
 
             ymin, ymax = ax.get_ylim()
 
-            if not multihist:
-                break
-
         # add the text when necessary
         if text is not None:
             ax.text(text_x, text_y, text, transform=ax.transAxes,
                     ha='right', va='top', fontsize=fontsize)
 
         # add vertical lines when necessary
-        if vlines is not None and not hasattr(vlines, '__iter__'):
+        if vlines is not None:
+            vlines = numpy.atleast_1d(vlines)
             for jj in range(len(vlines)):
                 vline_use = vlines[jj]
 
@@ -1800,14 +2595,191 @@ class HistogramSysTest(SysTest):
         if ylim is not None:
             ax.set_ylim(*ylim)
 
+        from matplotlib.ticker import NullFormatter
         if hide_x:
-            ax.xaxis.set_major_formatter(plt.NullFormatter())
+            ax.xaxis.set_major_formatter(NullFormatter())
         if hide_y:
-            ax.yaxis.set_major_formatter(plt.NullFormatter())
+            ax.yaxis.set_major_formatter(NullFormatter())
 
         return hist
-    def __call__(self, *args, **kwargs):
-        return self.HistoPlot(*args, **kwargs)
+
+    def makeCounts(self, data_list, field=None, binning_style=None, nbins=None, weights=None,
+                   limits=None, max_sample=None):
+        """
+        Return a list of the :class:`HistogramCounts` for each histogram that :func:`HistoPlot`
+        would draw for ``data_list``, binning the data as described there.  Any
+        :class:`HistogramCounts` in ``data_list`` are returned as they are.  Defaults for the
+        keyword arguments are taken from the object as for :func:`HistoPlot`.
+        """
+        field = self.field if field is None else field
+        binning_style = self.binning_style if binning_style is None else binning_style
+        nbins = self.nbins if nbins is None else nbins
+        weights = self.weights if weights is None else weights
+        limits = self.limits if limits is None else limits
+        max_sample = self.max_sample if max_sample is None else max_sample
+
+        if isinstance(data_list, HistogramCounts):
+            data_list = [data_list]
+        data_dim = len(data_list)
+        multihist = isinstance(data_list[0], (list, numpy.ndarray, HistogramCounts))
+        counts_list = []
+        for ii in range(data_dim if multihist else 1):
+            data = data_list[ii] if multihist else data_list
+            if isinstance(data, HistogramCounts):
+                # Already-binned counts, eg merged from several CCDs: draw them as they are.
+                counts_list.append(data)
+                continue
+            if field is not None and not isinstance(field, str) and hasattr(field, '__iter__'):
+                if len(field)!=data_dim or not multihist:
+                    raise RuntimeError('Different length lists of data & lists of fields!')
+                field_use = field[ii]
+            else:
+                field_use = field
+
+            # decide if weight is presented
+            if weights is None or weights is True or not multihist:
+                weight_use = weights
+            elif len(weights) == data_dim:
+                weight_use = weights[ii]
+            else:
+                import warnings
+                warnings.warn("Inconsistent shape between data and weights! No weight is used!")
+                weight_use = None
+
+            data, weight_use = self._getData(data, field_use, weight_use, limits)
+
+            # decide which bin style to use
+            style_use = self.get_param_value(binning_style, ii, data_dim, multihist=multihist)
+            hist_counts = HistogramCounts(self.getEdges(data, style_use, nbins, limits,
+                                                        max_sample))
+            hist_counts.update(data, weight_use)
+            counts_list.append(hist_counts)
+        return counts_list
+
+    def _getData(self, data, field, weights, limits):
+        """Return the values of ``data`` (the ``field`` column, if given) and the matching weights
+        (``data['w']`` if ``weights`` is True), without NaNs and trimmed to ``limits``."""
+        if weights is True:
+            weights = data['w']
+        if field is not None:
+            data = data[field]
+        data = numpy.asarray(data, dtype=float).reshape(-1)
+        if weights is not None and len(weights) != len(data):
+            import warnings
+            warnings.warn("Inconsistent shape between data and weights! No weight is used!")
+            weights = None
+        use = numpy.invert(numpy.isnan(data))
+        if limits is not None:
+            use &= (data >= limits[0]) & (data <= limits[1])
+        if not numpy.all(use):
+            data = data[use]
+            weights = numpy.asarray(weights)[use] if weights is not None else None
+        return data, weights
+
+    def getEdges(self, data, binning_style='manual', nbins=50, limits=None, max_sample=None):
+        """
+        Return histogram bin edges for ``data`` following ``binning_style`` (see :func:`HistoPlot`).
+        For the 'manual' style, the ``nbins`` bins cover ``limits`` if it is given, so histograms
+        of different data sets share their edges and can be merged; otherwise they cover the range
+        of the data.  ``max_sample`` is passed to the 'scott' and 'freedman' rules.
+        """
+        if binning_style == 'scott':
+            dx, bins = self.scotts_bin_width(data, True, max_sample=max_sample)
+        elif binning_style == 'freedman':
+            dx, bins = self.freedman_bin_width(data, True, max_sample=max_sample)
+        elif binning_style == 'knuth':
+            dx, bins = self.knuth_bin_width(data, True)
+        else:
+            if binning_style != 'manual':
+                print("Unrecognized code for binning style, use default instead!")
+            if limits is not None:
+                low, high = limits
+            elif len(data):
+                low, high = numpy.min(data), numpy.max(data)
+            else:
+                low, high = 0., 1.
+            if low == high:
+                low, high = low-0.5, high+0.5
+            bins = numpy.linspace(low, high, nbins+1)
+        return bins
+
+    def accumulate(self, chunks, edges=None, field=None, weights=None, limits=None, nbins=None):
+        """
+        Accumulate the histogram counts of a sequence of data chunks (for example, the catalogs
+        of every CCD in a tract, or the chunks of a large file) into a single
+        :class:`HistogramCounts` object, without holding all the data in memory.  The result can
+        be merged with others made with the same edges and plotted by passing it to
+        :func:`HistoPlot`.
+
+        :param chunks:   An iterable of data arrays (or formatted arrays, with ``field``), or of
+                         :class:`HistogramCounts` objects with the same edges to merge in.
+        :param edges:    The bin edges.  [default: None, meaning ``nbins`` bins covering
+                         ``limits``]
+        :param field:    The field of the data to be used, if the chunks are formatted arrays.
+        :param weights:  True to weight each chunk by its 'w' column. [default: None]
+        :param limits:   The [min, max] limits of the histogram.
+        :param nbins:    The number of bins, if ``edges`` is not given.
+
+        Defaults for ``field``, ``limits`` and ``nbins`` are taken from the object as for
+        :func:`HistoPlot`.
+
+        :returns: a :class:`HistogramCounts` object.
+        """
+        field = self.field if field is None else field
+        limits = self.limits if limits is None else limits
+        nbins = self.nbins if nbins is None else nbins
+        if edges is None:
+            if limits is None:
+                raise ValueError('Accumulating histograms requires fixed bin edges or limits')
+            edges = numpy.linspace(limits[0], limits[1], nbins+1)
+        result = HistogramCounts(edges)
+        for chunk in chunks:
+            if isinstance(chunk, HistogramCounts):
+                result = result.merge(chunk)
+            else:
+                # The data are not trimmed to the limits, so that the values outside the bins are
+                # counted as underflow and overflow.
+                data, weight_use = self._getData(chunk, field, weights, None)
+                result.update(data, weight_use)
+        return result
+
+    @staticmethod
+    def _drawCounts(ax, hist_counts, histtype='stepfilled', color=None, normed=False,
+                    cumulative=False, alpha=1.0, rwidth=None, align='mid', linewidth=2.0):
+        """Draw a :class:`HistogramCounts` object on the axes ``ax``."""
+        edges = hist_counts.edges
+        widths = hist_counts.widths
+        values = hist_counts.density() if normed else hist_counts.counts
+        if cumulative:
+            values = numpy.cumsum(values*widths if normed else values)
+        if histtype == 'bar':
+            offset = {'left': -0.5, 'mid': 0., 'right': 0.5}[align]*widths
+            ax.bar(hist_counts.centers+offset, values, width=(rwidth or 1.)*widths,
+                   align='center', color=color, alpha=alpha, linewidth=linewidth)
+        elif histtype == 'step':
+            ax.stairs(values, edges, color=color, alpha=alpha, linewidth=linewidth)
+        else:
+            ax.stairs(values, edges, fill=True, color=color, alpha=alpha, linewidth=linewidth)
+            # outline the filled region
+            ax.stairs(values, edges, color='k', alpha=1.0, linewidth=1.0)
+    def __call__(self, data_list, **kwargs):
+        # The data are binned here, so a deferred plot only carries the counts, as for the
+        # aggregated cells of a whisker plot.
+        counts_kwargs = dict((key, kwargs.pop(key)) for key in
+                             ['field', 'binning_style', 'nbins', 'weights', 'limits', 'max_sample']
+                             if key in kwargs)
+        self.histogram_counts = self.makeCounts(data_list, **counts_kwargs)
+        return self._plot('HistoPlot', self.histogram_counts, **kwargs)
+
+# The classes made by the ScatterPlotSysTest factory for each value of its type kwarg.
+scatter_plot_types = {None: 'BaseScatterPlotSysTest',
+                      'StarVsPSFG1': 'ScatterPlotStarVsPSFG1SysTest',
+                      'StarVsPSFG2': 'ScatterPlotStarVsPSFG2SysTest',
+                      'StarVsPSFSigma': 'ScatterPlotStarVsPSFSigmaSysTest',
+                      'ResidualVsPSFG1': 'ScatterPlotResidualVsPSFG1SysTest',
+                      'ResidualVsPSFG2': 'ScatterPlotResidualVsPSFG2SysTest',
+                      'ResidualVsPSFSigma': 'ScatterPlotResidualVsPSFSigmaSysTest',
+                      'ResidualSigmaVsPSFMag': 'ScatterPlotResidualSigmaVsPSFMagSysTest'}
 
 def ScatterPlotSysTest(type=None):
     """
@@ -1829,22 +2801,7 @@ def ScatterPlotSysTest(type=None):
           the convenience variables the other ScatterPlots have, such as self.objects_list and
           self.required_quantities.
     """
-    if type=='StarVsPSFG1':
-        return ScatterPlotStarVsPSFG1SysTest()
-    elif type=='StarVsPSFG2':
-        return ScatterPlotStarVsPSFG2SysTest()
-    elif type=='StarVsPSFSigma':
-        return ScatterPlotStarVsPSFSigmaSysTest()
-    elif type=='ResidualVsPSFG1':
-        return ScatterPlotResidualVsPSFG1SysTest()
-    elif type=='ResidualVsPSFG2':
-        return ScatterPlotResidualVsPSFG2SysTest()
-    elif type=='ResidualVsPSFSigma':
-        return ScatterPlotResidualVsPSFSigmaSysTest()
-    elif type is None:
-        return BaseScatterPlotSysTest()
-    else:
-        raise ValueError('Unknown scatter plot type %s given to type kwarg'%type)
+    return _makeSysTest(scatter_plot_types, type, 'scatter plot')
 
 class BaseScatterPlotSysTest(SysTest):
     """
@@ -1856,7 +2813,8 @@ class BaseScatterPlotSysTest(SysTest):
     short_name = 'scatterplot'
     def __call__(self, array, x_field, y_field, yerr_field, z_field=None, residual=False,
                  per_ccd_stat=None, xlabel=None, ylabel=None, zlabel=None, color="",
-                 lim=None, equal_axis=False, linear_regression=False, reference_line=None):
+                 lim=None, equal_axis=False, linear_regression=False, reference_line=None,
+                 rasterize=None):
         """
         Draw a scatter plot and return a :class:`matplotlib.figure.Figure` object.
         This method has a bunch of options for controlling appearance of a plot, which is
@@ -1902,26 +2860,32 @@ class BaseScatterPlotSysTest(SysTest):
                                 ``x=y`` is drawn. If ``reference_line == 'zero'``, ``y=0`` is drawn.
                                 A user-specific function can be used by passing an object which
                                 has an attribute :func:`__call__` and returns a 1-d Numpy array.
+        :param rasterize:       If True, draw the point density as an image with a binned median
+                                trend line instead of the individual points; see
+                                :func:`scatterPlot`.
+                                [default: None, meaning rasterize only very large data sets]
         :returns:               a :class:`matplotlib.figure.Figure` object
         """
         if per_ccd_stat:
             if z_field is None:
                 z = None
-                x, y, yerr = self.getStatisticsPerCCD(array['CCD'], array[x_field],
-                                                      array[y_field], yerr=array[yerr_field],
-                                                      stat=per_ccd_stat)
-                self.data = numpy.rec.fromarrays([list(set(array['CCD'])), x,
+                ccds, x, y, yerr = self.getStatisticsPerCCD(array['CCD'], array[x_field],
+                                                            array[y_field], yerr=array[yerr_field],
+                                                            stat=per_ccd_stat, return_keys=True)
+                self.data = numpy.rec.fromarrays([ccds, x,
                                                   y, yerr],
                                                  names=['ccd',
                                                         x_field,
                                                         y_field,
                                                         yerr_field])
             else:
-                x, y, yerr, z = self.getStatisticsPerCCD(array['CCD'], array[x_field],
-                                                      array[y_field], yerr=array[yerr_field],
-                                                      z=array[z_field], stat=per_ccd_stat)
-                self.data = numpy.rec.fromarrays([list(set(array['CCD'])), x,
-                                                  y, yerr, zz],
+                ccds, x, y, yerr, z = self.getStatisticsPerCCD(array['CCD'], array[x_field],
+                                                               array[y_field],
+                                                               yerr=array[yerr_field],
+                                                               z=array[z_field], stat=per_ccd_stat,
+                                                               return_keys=True)
+                self.data = numpy.rec.fromarrays([ccds, x,
+                                                  y, yerr, z],
                                                  names=['ccd',
                                                         x_field,
                                                         y_field,
@@ -1943,10 +2907,11 @@ class BaseScatterPlotSysTest(SysTest):
                                                         yerr_field,
                                                         z_field])
         y = y-x if residual else y
-        return self.scatterPlot(x, y, yerr, z,
-                                xlabel=xlabel, ylabel=ylabel,
-                                color=color, lim=lim, equal_axis=False,
-                                linear_regression=True, reference_line=reference_line)
+        return self._plot('scatterPlot', x, y, yerr, z,
+                          xlabel=xlabel, ylabel=ylabel,
+                          color=color, lim=lim, equal_axis=False,
+                          linear_regression=True, reference_line=reference_line,
+                          rasterize=rasterize)
 
     def getData(self):
         """
@@ -1958,7 +2923,8 @@ class BaseScatterPlotSysTest(SysTest):
         return self.data
 
     def scatterPlot(self, x, y, yerr=None, z=None, xlabel=None, ylabel=None, zlabel=None, color="",
-                    lim=None, equal_axis=False, linear_regression=False, reference_line=None):
+                    lim=None, equal_axis=False, linear_regression=False, reference_line=None,
+                    rasterize=None, raster_threshold=100000, raster_bins=200, trend_bins=20):
         """
         Draw a scatter plot and return a :class:`matplotlib.figure.Figure` object.
         This method has a bunch of options for controlling appearance of a plot, which is
@@ -1998,11 +2964,21 @@ class BaseScatterPlotSysTest(SysTest):
                                 A user-specific function can be used by passing an object which has
                                 an attribute :func:`__call__` and returns a 1-d Numpy array.
                                 [default: False]
+        :param rasterize:       If True, draw a 2-d histogram image of the point density (or, if
+                                ``z`` is given, of the mean ``z`` in each pixel) instead of the
+                                individual points, with the binned median of ``y`` overlaid as a
+                                trend line; this is much faster and smaller for large data sets.
+                                Linear regression and reference lines are drawn as usual.
+                                [default: None, meaning rasterize if there are more than
+                                ``raster_threshold`` points]
+        :param raster_threshold: The number of points above which to rasterize automatically.
+                                [default: 100000]
+        :param raster_bins:     The number of pixels along each axis of the rasterized image.
+                                [default: 200]
+        :param trend_bins:      The number of x bins for the median trend line of the rasterized
+                                plot. [default: 20]
         :returns:                a :class:`matplotlib.figure.Figure` object
         """
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1)
-
         # mask data with nan. Emit a warning if an array has nan in it.
         x_isnan = numpy.isnan(x)
         y_isnan = numpy.isnan(y)
@@ -2024,10 +3000,12 @@ class BaseScatterPlotSysTest(SysTest):
                 warnings.warn('There are %s nans in z, out of %s.'
                              % (numpy.sum(z_isnan), len(z_isnan)))
             sel = numpy.logical_and(sel, numpy.invert(z_isnan))
-        x = x[sel]
-        y = y[sel]
-        yerr = yerr[sel] if yerr is not None else None
-        z = z[sel] if z is not None else None
+        # Skip the copies if nothing needs to be removed, since the arrays may be very large.
+        if not numpy.all(sel):
+            x = x[sel]
+            y = y[sel]
+            yerr = yerr[sel] if yerr is not None else None
+            z = z[sel] if z is not None else None
 
         # load axis limits if argument lim is ((xmin, xmax), (ymin, ymax))
         if isinstance(lim, tuple):
@@ -2057,7 +3035,33 @@ class BaseScatterPlotSysTest(SysTest):
                 ylim = None
 
         # plot
-        if z is None:
+        if rasterize is None:
+            rasterize = len(x) > raster_threshold
+        template = self._getFigureTemplate(('scatterPlot', bool(rasterize), z is None,
+                                            equal_axis))
+        fig = template.figure
+        ax = template.axes[0]
+        if rasterize:
+            used_color = color if color else "r"
+            raster_xlim = xlim if xlim is not None else (numpy.min(x), numpy.max(x))
+            raster_ylim = ylim if ylim is not None else (numpy.min(y), numpy.max(y))
+            image = self._rasterize(x, y, z, raster_xlim, raster_ylim, raster_bins)
+            extent = list(raster_xlim)+list(raster_ylim)
+            if z is None:
+                from matplotlib.colors import LogNorm
+                im = ax.imshow(image, origin='lower', extent=extent, aspect='auto',
+                               interpolation='nearest', cmap='Greys', norm=LogNorm())
+                cb = template.colorbar(im)
+                if zlabel is None:
+                    cb.set_label('N')
+            else:
+                im = ax.imshow(image, origin='lower', extent=extent, aspect='auto',
+                               interpolation='nearest')
+                cb = template.colorbar(im)
+            x_trend, y_trend, y_trend_err = self._binnedMedian(x, y, raster_xlim, raster_ylim,
+                                                                trend_bins)
+            ax.errorbar(x_trend, y_trend, y_trend_err, fmt="o-", color=used_color, zorder=2)
+        elif z is None:
             if yerr is None:
                 p = ax.plot(x, y, ".%s" % color)
             else:
@@ -2066,9 +3070,9 @@ class BaseScatterPlotSysTest(SysTest):
             used_color = p[0].get_color()
         else:
             if yerr is not None:
-                plt.errorbar(x, y, yerr=yerr, linestyle="None", color="k", zorder=0)
-            plt.scatter(x, y, c=z, zorder=1)
-            cb = plt.colorbar()
+                ax.errorbar(x, y, yerr=yerr, linestyle="None", color="k", zorder=0)
+            sc = ax.scatter(x, y, c=z, zorder=1)
+            cb = template.colorbar(sc)
             used_color = "b"
 
         # make axes ticks equal to each other if specified
@@ -2104,10 +3108,10 @@ class BaseScatterPlotSysTest(SysTest):
         if linear_regression:
             if yerr is None:
                 m, c = self.linearRegression(x, y)
-                ax.plot(xtmp, m*xtmp+c, "--%s" % used_color)
+                ax.plot(xtmp, m*xtmp+c, "--", color=used_color)
             else:
                 m, c, cov_m, cov_c, cov_mc = self.linearRegression(x, y, err=yerr)
-                ax.plot(xtmp, m*xtmp+c, "--%s" % used_color)
+                ax.plot(xtmp, m*xtmp+c, "--", color=used_color)
                 y = m*xtmp+c
                 # calculate yerr using the covariance
                 yerr = numpy.sqrt(xtmp**2*cov_m + 2.*xtmp*cov_mc + cov_c)
@@ -2142,10 +3146,78 @@ class BaseScatterPlotSysTest(SysTest):
         if zlabel is not None:
             cb.set_label(zlabel)
 
-        fig.tight_layout()
+        if template.uses == 1:
+            fig.tight_layout()
 
         return fig
 
+    @staticmethod
+    def _pixelIndex(x, lim, n_bins):
+        """Return the (float-valued) index of the ``n_bins`` equal-width bins covering ``lim`` which
+        contains each of ``x``, with points exactly on the upper edge in the last bin."""
+        index = x-lim[0]
+        index *= n_bins/(float(lim[1]-lim[0]) or 1.)
+        numpy.floor(index, out=index)
+        index[x == lim[1]] = n_bins-1
+        return index
+
+    @staticmethod
+    def _rasterize(x, y, z, xlim, ylim, n_bins):
+        """Return an image (indexed [y, x]) of the number of points, or the mean of ``z`` if it is
+        not None, in an ``n_bins`` x ``n_bins`` grid covering ``xlim`` and ``ylim``.  Empty pixels
+        are masked."""
+        use = (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+        pixel = BaseScatterPlotSysTest._pixelIndex(y, ylim, n_bins)
+        pixel *= n_bins
+        pixel += BaseScatterPlotSysTest._pixelIndex(x, xlim, n_bins)
+        pixel = pixel[use].astype(int)
+        counts = numpy.bincount(pixel, minlength=n_bins*n_bins).reshape(n_bins, n_bins)
+        if z is None:
+            image = counts.astype(float)
+        else:
+            sums = numpy.bincount(pixel, weights=z[use],
+                                  minlength=n_bins*n_bins).reshape(n_bins, n_bins)
+            image = sums/numpy.maximum(counts, 1)
+        return numpy.ma.masked_where(counts == 0, image)
+
+    @staticmethod
+    def _binnedMedian(x, y, xlim, ylim, n_bins, n_fine=1000):
+        """Return the centers of ``n_bins`` equal-width bins in x covering ``xlim``, the median y in
+        each, and the error on that median, for the bins that contain points.
+
+        Rather than sorting the data, the medians are interpolated from a histogram of y with
+        ``n_fine`` bins across ``ylim`` (plus one bin each for the points below and above it) in
+        each x bin, so they are accurate to a small fraction of the plotted range.  Medians which
+        lie outside ``ylim`` are NaN."""
+        use = (x >= xlim[0]) & (x <= xlim[1])
+        x = x[use]
+        y = y[use]
+        x_index = BaseScatterPlotSysTest._pixelIndex(x, xlim, n_bins).astype(int)
+        y_index = BaseScatterPlotSysTest._pixelIndex(y, ylim, n_fine)
+        numpy.clip(y_index, -1, n_fine, out=y_index)
+        y_index += 1
+        n_cols = n_fine+2
+        counts = numpy.bincount(x_index*n_cols+y_index.astype(int),
+                                minlength=n_bins*n_cols).reshape(n_bins, n_cols)
+        N = numpy.sum(counts, axis=1)
+        sum_y = numpy.bincount(x_index, weights=y, minlength=n_bins)
+        sum_y2 = numpy.bincount(x_index, weights=y*y, minlength=n_bins)
+        filled = N > 0
+        counts, N, sum_y, sum_y2 = counts[filled], N[filled], sum_y[filled], sum_y2[filled]
+        cumulative = numpy.cumsum(counts, axis=1)
+        half = 0.5*N
+        k = numpy.argmax(cumulative >= half[:, numpy.newaxis], axis=1)
+        rows = numpy.arange(len(k))
+        fraction = (half-cumulative[rows, k]+counts[rows, k])/counts[rows, k]
+        fine_width = float(ylim[1]-ylim[0])/n_fine
+        median = ylim[0]+(k-1+fraction)*fine_width
+        median[(k == 0) | (k == n_cols-1)] = numpy.nan
+        std = numpy.sqrt(numpy.maximum(sum_y2/N-(sum_y/N)**2, 0.))
+        median_err = numpy.sqrt(numpy.pi/2.)*std/numpy.sqrt(N)
+        edges = numpy.linspace(xlim[0], xlim[1], n_bins+1)
+        centers = 0.5*(edges[:-1]+edges[1:])[filled]
+        return centers, median, median_err
+
     def linearRegression(self, x, y, err=None):
         """
         Perform linear regression (y=mx+c). If error is given, it returns covariance.
@@ -2174,10 +3246,13 @@ class BaseScatterPlotSysTest(SysTest):
             cov_mc = -Sx/Delta
             return m, c, cov_m, cov_c, cov_mc
 
-    def getStatisticsPerCCD(self, ccds, x, y, yerr=None, z=None, stat="median"):
+    def getStatisticsPerCCD(self, ccds, x, y, yerr=None, z=None, stat="median", return_keys=False):
         """
         Calculate median or mean for x and y (and z if specified) for each ccd.
 
+        The CCDs are grouped with a :class:`stile.groupby.GroupBy` object, so the results are in
+        sorted order of the CCD identifiers, and all CCDs are handled in a few vectorized passes.
+
         :param ccds:       NumPy array for ccds, an array in which each element indicates
                            ccd id of each data point.
         :param x:          NumPy array for x.
@@ -2186,48 +3261,35 @@ class BaseScatterPlotSysTest(SysTest):
                            [default: None, meaning do not consider y error]
         :param z:          NumPy array for z.
                            [default: None, meaning do not statistics for z]
-        :returns:          x_ave, y_ave, y_ave_std.
+        :param stat:       Which statistic to compute, "median" or "mean". [default: "median"]
+        :param return_keys: If True, also return the CCD identifiers, in the same order as the
+                           statistics, as the first item of the returned tuple. [default: False]
+        :returns:          x_ave, y_ave, y_ave_std (and z_ave, if z is given).
         """
+        grouped = GroupBy(ccds)
         if stat == "mean":
-            x_ave = numpy.array([numpy.average(x[ccds == ccd])
-                                 for ccd in set(ccds)])
+            x_ave = grouped.mean(x)
             if yerr is None:
-                y_ave = numpy.array([numpy.average(y[ccds == ccd])
-                                     for ccd in set(ccds)])
-                y_ave_std = numpy.array([numpy.std(y[ccds == ccd])/
-                                         numpy.sqrt(len(y[ccds == ccd]))
-                                         for ccd in set(ccds)])
+                y_ave = grouped.mean(y)
+                y_ave_std = grouped.std(y)/numpy.sqrt(grouped.counts)
             # calculate y and its std under the inverse variance weight if yerr is given
             else:
-                y_ave = numpy.array([numpy.sum(y[ccds == ccd]/
-                                               yerr[ccds == ccd]**2)/
-                                     numpy.sum(1./yerr[ccds == ccd]**2)
-                                     for ccd in set(ccds)])
-                y_ave_std = numpy.array([numpy.sqrt(1./numpy.sum(1./yerr[ccds == ccd]**2
-                                                                 ))
-                                         for ccd in set(ccds)])
+                y_ave, y_ave_std = grouped.inverseVarianceMean(y, yerr)
+            results = [x_ave, y_ave, y_ave_std]
             if z is not None:
-                z_ave = numpy.array([numpy.average(z[ccds == ccd])
-                                     for ccd in set(ccds)])
-                return x_ave, y_ave, y_ave_std, z_ave
-            else:
-                return x_ave, y_ave, y_ave_std
+                results.append(grouped.mean(z))
         elif stat == "median":
-            x_med = numpy.array([numpy.median(x[ccds == ccd])
-                                 for ccd in set(ccds)])
-            y_med = numpy.array([numpy.median(y[ccds == ccd])
-                                 for ccd in set(ccds)])
-            y_med_std = numpy.array([numpy.sqrt(numpy.pi/2.)*numpy.std(y[ccds == ccd])
-                                     /numpy.sqrt(len(y[ccds == ccd]))
-                                     for ccd in set(ccds)])
+            x_med = grouped.median(x)
+            y_med = grouped.median(y)
+            y_med_std = numpy.sqrt(numpy.pi/2.)*grouped.std(y)/numpy.sqrt(grouped.counts)
+            results = [x_med, y_med, y_med_std]
             if z is not None:
-                z_med = numpy.array([numpy.median(z[ccds == ccd])
-                                     for ccd in set(ccds)])
-                return x_med, y_med, y_med_std, z_med
-            else:
-                return x_med, y_med, y_med_std
+                results.append(grouped.median(z))
         else:
             raise ValueError('stat should be mean or median.')
+        if return_keys:
+            results = [grouped.keys]+results
+        return tuple(results)
 
 class ScatterPlotStarVsPSFG1SysTest(BaseScatterPlotSysTest):
     """
@@ -2238,13 +3300,13 @@ class ScatterPlotStarVsPSFG1SysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('g1', 'g1_err', 'psf_g1')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotStarVsPSFG1SysTest,
                      self).__call__(array, 'psf_g1', 'g1', 'g1_err', residual=False,
                                     per_ccd_stat=per_ccd_stat, xlabel=r'$g^{\rm PSF}_1$',
                                     ylabel=r'$g^{\rm star}_1$', color=color, lim=lim,
                                     equal_axis=False, linear_regression=True,
-                                    reference_line='one-to-one')
+                                    reference_line='one-to-one', rasterize=rasterize)
 
 
 class ScatterPlotStarVsPSFG2SysTest(BaseScatterPlotSysTest):
@@ -2256,13 +3318,13 @@ class ScatterPlotStarVsPSFG2SysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('g2', 'g2_err', 'psf_g2')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotStarVsPSFG2SysTest,
                      self).__call__(array, 'psf_g2', 'g2', 'g2_err', residual=False,
                                     per_ccd_stat=per_ccd_stat, xlabel=r'$g^{\rm PSF}_2$',
                                     ylabel=r'$g^{\rm star}_2$', color=color, lim=lim,
                                     equal_axis=False, linear_regression=True,
-                                    reference_line='one-to-one')
+                                    reference_line='one-to-one', rasterize=rasterize)
 
 
 class ScatterPlotStarVsPSFSigmaSysTest(BaseScatterPlotSysTest):
@@ -2274,14 +3336,15 @@ class ScatterPlotStarVsPSFSigmaSysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('sigma', 'sigma_err', 'psf_sigma')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotStarVsPSFSigmaSysTest,
                      self).__call__(array, 'psf_sigma', 'sigma', 'sigma_err', residual=False,
                                     per_ccd_stat=per_ccd_stat,
                                     xlabel=r'$\sigma^{\rm PSF}$ [arcsec]',
                                     ylabel=r'$\sigma^{\rm star}$ [arcsec]',
                                     color=color, lim=lim, equal_axis=False,
-                                    linear_regression=True, reference_line='one-to-one')
+                                    linear_regression=True, reference_line='one-to-one',
+                                    rasterize=rasterize)
 
 
 class ScatterPlotResidualVsPSFG1SysTest(BaseScatterPlotSysTest):
@@ -2293,13 +3356,14 @@ class ScatterPlotResidualVsPSFG1SysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('g1', 'g1_err', 'psf_g1')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotResidualVsPSFG1SysTest,
                      self).__call__(array, 'psf_g1', 'g1', 'g1_err', residual=True,
                                     per_ccd_stat=per_ccd_stat, xlabel=r'$g^{\rm PSF}_1$',
                                     ylabel=r'$g^{\rm star}_1 - g^{\rm PSF}_1$',
                                     color=color, lim=lim, equal_axis=False,
-                                    linear_regression=True, reference_line='zero')
+                                    linear_regression=True, reference_line='zero',
+                                    rasterize=rasterize)
 
 
 class ScatterPlotResidualVsPSFG2SysTest(BaseScatterPlotSysTest):
@@ -2311,13 +3375,14 @@ class ScatterPlotResidualVsPSFG2SysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('g2', 'g2_err', 'psf_g2')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotResidualVsPSFG2SysTest,
                      self).__call__(array, 'psf_g2', 'g2', 'g2_err', residual=True,
                                     per_ccd_stat=per_ccd_stat, xlabel=r'$g^{\rm PSF}_2$',
                                     ylabel=r'$g^{\rm star}_2 - g^{\rm PSF}_2$',
                                     color=color, lim=lim, equal_axis=False,
-                                    linear_regression=True, reference_line='zero')
+                                    linear_regression=True, reference_line='zero',
+                                    rasterize=rasterize)
 
 
 class ScatterPlotResidualVsPSFSigmaSysTest(BaseScatterPlotSysTest):
@@ -2329,14 +3394,15 @@ class ScatterPlotResidualVsPSFSigmaSysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('sigma', 'sigma_err', 'psf_sigma')]
 
-    def __call__(self, array, per_ccd_stat=None, color='', lim=None):
+    def __call__(self, array, per_ccd_stat=None, color='', lim=None, rasterize=None):
         return super(ScatterPlotResidualVsPSFSigmaSysTest,
                      self).__call__(array, 'psf_sigma', 'sigma', 'sigma_err', residual=True,
                                     per_ccd_stat=per_ccd_stat,
                                     xlabel=r'$\sigma^{\rm PSF}$ [arcsec]',
                                     ylabel=r'$\sigma^{\rm star} - \sigma^{\rm PSF}$ [arcsec]',
                                     color=color, lim=lim, equal_axis=False,
-                                    linear_regression=True, reference_line='zero')
+                                    linear_regression=True, reference_line='zero',
+                                    rasterize=rasterize)
 
 
 class ScatterPlotResidualSigmaVsPSFMagSysTest(BaseScatterPlotSysTest):
@@ -2348,7 +3414,7 @@ class ScatterPlotResidualSigmaVsPSFMagSysTest(BaseScatterPlotSysTest):
     objects_list = ['star PSF']
     required_quantities = [('sigma', 'sigma_err', 'psf_sigma', 'mag_inst')]
 
-    def __call__(self, array, per_ccd_stat='None', color='', lim=None):
+    def __call__(self, array, per_ccd_stat='None', color='', lim=None, rasterize=None):
         self.per_ccd_stat = None if per_ccd_stat == 'None' else per_ccd_stat
         import numpy.lib.recfunctions
         use_array = numpy.copy(array)
@@ -2367,5 +3433,6 @@ class ScatterPlotResidualSigmaVsPSFMagSysTest(BaseScatterPlotSysTest):
                                     ylabel=
                                     r'$(\sigma^{\rm star} - \sigma^{\rm PSF})/\sigma^{\rm PSF}$',
                                     color=color, lim=lim, equal_axis=False,
-                                    linear_regression=True, reference_line='zero')
+                                    linear_regression=True, reference_line='zero',
+                                    rasterize=rasterize)
 
@@ -4,8 +4,6 @@ program.
 """
 import numpy
 from . import file_io
-import treecorr
-from treecorr.corr2 import corr2_valid_params
 
 
 def Parser():
@@ -117,6 +115,7 @@ def PickTreeCorrKeys(input_dict):
     """
     if not input_dict:
         return {}
+    from treecorr.corr2 import corr2_valid_params
     if 'treecorr_kwargs' in input_dict:
         treecorr_dict = input_dict['treecorr_kwargs']
     else:
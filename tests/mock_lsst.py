@@ -0,0 +1,175 @@
+"""
+Lightweight stand-ins for the parts of the LSST source catalog interface used by the LSST-free
+modules of stile.hsc, so that those can be tested without the LSST stack.
+"""
+import threading
+import time
+import numpy
+
+
+class MockKey(object):
+    """A schema key for a column, or for one element (``index``) of an array-valued column."""
+    def __init__(self, name, index=()):
+        self.name = name
+        self.index = index
+
+    def __getitem__(self, index):
+        return MockKey(self.name, tuple(index))
+
+
+class MockMomentsKey(MockKey):
+    """A key for a moments field, stored in the columns ``name.xx``, ``name.yy`` and ``name.xy``."""
+    def getIxx(self):
+        return MockKey(self.name+'.xx')
+
+    def getIyy(self):
+        return MockKey(self.name+'.yy')
+
+    def getIxy(self):
+        return MockKey(self.name+'.xy')
+
+
+class MockMoments(object):
+    def __init__(self, ixx, iyy, ixy):
+        self.ixx, self.iyy, self.ixy = ixx, iyy, ixy
+
+    def getIxx(self):
+        return self.ixx
+
+    def getIyy(self):
+        return self.iyy
+
+    def getIxy(self):
+        return self.ixy
+
+
+class MockSchemaItem(object):
+    def __init__(self, key):
+        self.key = key
+
+
+class MockSchema(object):
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __contains__(self, name):
+        return name in self.columns or name+'.xx' in self.columns
+
+    def find(self, name):
+        if name in self.columns:
+            return MockSchemaItem(MockKey(name))
+        elif name+'.xx' in self.columns:
+            return MockSchemaItem(MockMomentsKey(name))
+        raise KeyError(name)
+
+
+class MockRecord(object):
+    def __init__(self, catalog, row):
+        self.catalog = catalog
+        self.row = row
+
+    def get(self, key):
+        if isinstance(key, MockMomentsKey):
+            return MockMoments(*[self.get(k) for k in (key.getIxx(), key.getIyy(), key.getIxy())])
+        return self.catalog.columns[key.name][(self.row,)+key.index]
+
+    __getitem__ = get
+
+    def getX(self):
+        return self.catalog.columns['centroid.x'][self.row]
+
+    def getY(self):
+        return self.catalog.columns['centroid.y'][self.row]
+
+
+class MockCatalog(object):
+    """
+    A source catalog holding a dict of NumPy ``columns``.  Indexing with a boolean mask returns a
+    non-contiguous catalog, which (like an LSST catalog) can only be read one record at a time.
+    """
+    def __init__(self, columns, contiguous=True):
+        self.columns = columns
+        self.schema = MockSchema(columns)
+        self.contiguous = contiguous
+        self.n_record_reads = 0
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def isContiguous(self):
+        return self.contiguous
+
+    def get(self, key):
+        if not self.contiguous:
+            raise RuntimeError('Record data is not contiguous in memory')
+        return self.columns[key.name][(slice(None),)+key.index]
+
+    def getX(self):
+        return self.get(MockKey('centroid.x'))
+
+    def getY(self):
+        return self.get(MockKey('centroid.y'))
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.get(MockKey(item))
+        return MockCatalog(dict((name, column[item]) for name, column in self.columns.items()),
+                           contiguous=False)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            self.n_record_reads += 1
+            yield MockRecord(self, row)
+
+    def copy(self, deep=True):
+        return MockCatalog(dict((name, column.copy()) for name, column in self.columns.items()))
+
+
+class MockDataRef(object):
+    """
+    A dataRef whose :func:`get` returns ``catalog`` after sleeping for ``latency`` seconds, like a
+    butler read, or raises a RuntimeError (as the butler does for a missing patch) if ``catalog`` is
+    None.  The start and end times and thread of each read are kept in ``reads``.
+    """
+    def __init__(self, data_id, catalog=None, latency=0.):
+        self.dataId = data_id
+        self.catalog = catalog
+        self.latency = latency
+        self.reads = []
+
+    def get(self, dataset, immediate=True, **kwargs):
+        start = time.time()
+        time.sleep(self.latency)
+        self.reads.append((start, time.time(), threading.current_thread().name))
+        if self.catalog is None:
+            raise RuntimeError('No %s found for %s'%(dataset, self.dataId))
+        return self.catalog
+
+
+def MakeMockCatalog(n, seed=None):
+    """Return a :class:`MockCatalog` of ``n`` sources with random positions, fluxes and shapes."""
+    rng = numpy.random.RandomState(seed)
+    ixx = rng.uniform(2., 4., n)
+    iyy = rng.uniform(2., 4., n)
+    ixy = rng.uniform(-1., 1., n)
+    covariances = numpy.zeros((n, 3, 3))
+    for i in range(3):
+        covariances[:, i, i] = rng.uniform(0.01, 0.02, n)
+    covariances[:, 0, 1] = covariances[:, 1, 0] = 0.001
+    flux = rng.uniform(100., 10000., n)
+    columns = {'centroid.x': rng.uniform(0., 2048., n), 'centroid.y': rng.uniform(0., 4176., n),
+               'coord.ra': rng.uniform(0.5, 0.6, n), 'coord.dec': rng.uniform(-0.1, 0.1, n),
+               'shape.sdss.xx': ixx, 'shape.sdss.yy': iyy, 'shape.sdss.xy': ixy,
+               'shape.sdss.err': covariances,
+               'shape.sdss.psf.xx': 0.9*ixx, 'shape.sdss.psf.yy': 0.9*iyy,
+               'shape.sdss.psf.xy': 0.9*ixy,
+               'shape.hsm.regauss.e1': rng.uniform(-0.3, 0.3, n),
+               'shape.hsm.regauss.e2': rng.uniform(-0.3, 0.3, n),
+               'shape.hsm.regauss.sigma': rng.uniform(0.1, 0.2, n),
+               'flux.psf': flux, 'flux.psf.err': rng.uniform(1., 10., n),
+               'classification.extendedness': (rng.rand(n) < 0.7).astype(float),
+               'calib.psf.used': rng.rand(n) < 0.2}
+    for flag in ['flux.psf.flags', 'shape.sdss.flags', 'shape.sdss.centroid.flags',
+                 'shape.hsm.regauss.flags']:
+        columns[flag] = rng.rand(n) < 0.05
+    return MockCatalog(columns)
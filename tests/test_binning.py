@@ -332,6 +332,58 @@ class TestBinning(unittest.TestCase):
         self.assertRaises(TypeError, stile.BinList, [1, 3, 2])
         self.assertRaises(TypeError, stile.BinList, 'c')
 
+    def test_BinKDTree(self):
+        """Test that BinKDTree objects make equal-count cells that stay fixed for new data."""
+        numpy.random.seed(271828)
+        n_points = 10000
+        data = numpy.zeros(n_points, dtype=[('x', float), ('y', float)])
+        # A very non-uniform distribution, which would leave most cells of a regular grid empty.
+        data['x'] = numpy.random.exponential(size=n_points)
+        data['y'] = 100*numpy.random.randn(n_points)
+        for n_bins in [1, 2, 7, 16]:
+            obj = stile.BinKDTree('x', 'y', n_bins, data=data)
+            assignments = obj.assign(data)
+            counts = numpy.bincount(assignments, minlength=n_bins)
+            self.assertEqual(len(counts), n_bins)
+            self.assertLessEqual(counts.max()-counts.min(), 2,
+                                 msg='BinKDTree made unequal cells: %s'%counts)
+            # The cell bounds should contain exactly the objects assigned to them.
+            for i, (xmin, xmax, ymin, ymax) in enumerate(obj.bounds):
+                in_bounds = ((data['x'] >= xmin) & (data['x'] < xmax) &
+                             (data['y'] >= ymin) & (data['y'] < ymax))
+                numpy.testing.assert_equal(in_bounds, assignments == i)
+        # Calling the object returns SingleFunctionBins that select the same rows, descending the
+        # tree once for all of them.
+        single_bins = obj()
+        self.assertEqual(len(single_bins), 16)
+        n_assigned = []
+        assign = obj.assign
+        obj.assign = lambda data: n_assigned.append(len(data)) or assign(data)
+        other_data = data.copy()
+        for i, single_bin in enumerate(single_bins):
+            numpy.testing.assert_equal(single_bin(other_data), data[assignments == i])
+        self.assertEqual(n_assigned, [n_points])
+        del obj.assign
+        # New data, including some outside the fitted range and some with NaNs, is binned with the
+        # old cells.
+        new_data = data.copy()
+        new_data['x'] = 2*numpy.random.exponential(size=n_points)
+        new_data['y'][:10] = numpy.nan
+        new_assignments = obj.assign(new_data)
+        numpy.testing.assert_equal(new_assignments[:10], -1)
+        self.assertTrue(numpy.all(new_assignments[10:] >= 0))
+        for i, (xmin, xmax, ymin, ymax) in enumerate(obj.bounds):
+            in_bounds = ((new_data['x'] >= xmin) & (new_data['x'] < xmax) &
+                         (new_data['y'] >= ymin) & (new_data['y'] < ymax))
+            numpy.testing.assert_equal(in_bounds, new_assignments == i)
+        # And it can be combined with the other binning schemes.
+        results = stile.ExpandBinList([stile.BinStep('x', low=0, high=4, n_bins=2), obj])
+        self.assertEqual(len(results), 32)
+        self.assertRaises(RuntimeError, stile.BinKDTree('x', 'y', 4).assign, data)
+        self.assertRaises(ValueError, stile.BinKDTree, 'x', 'y', 0)
+        self.assertRaises(ValueError, stile.BinKDTree, 'x', 'y', 20, data[:10])
+        self.assertRaises(TypeError, stile.BinKDTree, 0, 'y', 4)
+
     def test_singlebin_input_errors(self):
         """Test that SingleBin objects appropriately object to strange input."""
         sb = stile.binning.SingleBin('field_0', low=0, high=10, short_name='boo')
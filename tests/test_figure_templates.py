@@ -0,0 +1,81 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestFigureTemplates(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1414)
+        self.n = 500
+        fields = ['x', 'y', 'g1', 'g2', 'sigma', 'g1_err', 'psf_g1', 'psf_g2', 'psf_sigma']
+        self.array = numpy.zeros(self.n, dtype=[(f, float) for f in fields])
+        for field in fields:
+            self.array[field] = numpy.random.rand(self.n)
+        self.cf = numpy.zeros(10, dtype=[(f, float) for f in
+                                         ['R_nom', 'xip', 'xim', 'xip_im', 'sigma_xi']])
+        self.cf['R_nom'] = numpy.logspace(0, 2, 10)
+        for field in ['xip', 'xim', 'xip_im', 'sigma_xi']:
+            self.cf[field] = numpy.random.rand(10)
+
+    def test_untracked(self):
+        """Test that plots don't leave figures open in pyplot."""
+        import matplotlib.pyplot as plt
+        n_open = len(plt.get_fignums())
+        stile.ScatterPlotSysTest('StarVsPSFG1')(self.array)
+        stile.WhiskerPlotSysTest('Star')(self.array)
+        stile.HistogramSysTest(field='g1')(self.array)
+        fig = stile.CorrelationFunctionSysTest('StarXStarShear').plot(self.cf)
+        self.assertEqual(len(fig.axes), 2)
+        self.assertEqual(len(plt.get_fignums()), n_open)
+
+    def test_reuse(self):
+        """Test that reused figures are cleared and show only the latest plot."""
+        sys_test = stile.ScatterPlotSysTest('StarVsPSFG1')
+        sys_test.reuse_figures = True
+        first = sys_test(self.array)
+        n_artists = [len(ax.get_children()) for ax in first.axes]
+        second = sys_test(self.array[:100])
+        self.assertIs(first, second)
+        self.assertEqual([len(ax.get_children()) for ax in second.axes], n_artists)
+        # Points, error bars, and the regression and reference lines.
+        self.assertEqual(len(second.axes[0].lines[0].get_xdata()), 100)
+        # Different layouts get different figures.
+        third = sys_test(self.array, rasterize=True)
+        self.assertIsNot(third, first)
+        self.assertEqual(len(third.axes[0].images), 1)
+        fourth = sys_test(self.array, rasterize=True)
+        self.assertEqual(len(fourth.axes), 2)  # the axes and one colorbar
+        self.assertEqual(len(fourth.axes[0].images), 1)
+        sys_test.closeFigures()
+        self.assertIsNot(sys_test(self.array), first)
+
+        sys_test = stile.WhiskerPlotSysTest('Residual')
+        sys_test.reuse_figures = True
+        first = sys_test(self.array)
+        second = sys_test(self.array)
+        self.assertIs(first, second)
+        self.assertEqual(len(second.axes), 2)
+        self.assertEqual(len(second.axes[0].collections), 1)
+
+        sys_test = stile.HistogramSysTest(field='g1')
+        sys_test.reuse_figures = True
+        first = sys_test(self.array, xlabel='g1')
+        second = sys_test(self.array)
+        self.assertIs(first, second)
+        self.assertEqual(second.axes[0].get_xlabel(), '')
+
+        sys_test = stile.CorrelationFunctionSysTest('StarXStarShear')
+        sys_test.reuse_figures = True
+        first = sys_test.plot(self.cf)
+        second = sys_test.plot(self.cf)
+        self.assertIs(first, second)
+        self.assertEqual(len(second.axes), 2)
+        self.assertEqual(len(second.axes[0].get_legend().get_texts()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
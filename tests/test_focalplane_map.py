@@ -0,0 +1,75 @@
+import numpy
+import os
+import tempfile
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestFocalPlaneMap(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(5678)
+        self.n = 20000
+        fields = ['x', 'y', 'g1', 'g2', 'sigma', 'psf_g1', 'psf_g2', 'psf_sigma']
+        self.array = numpy.zeros(self.n, dtype=[(f, float) for f in fields])
+        self.array['x'] = 100.*numpy.random.rand(self.n)
+        self.array['y'] = 50.*numpy.random.rand(self.n)
+        self.array['psf_g1'] = 0.01*numpy.random.randn(self.n)
+        self.array['g1'] = self.array['psf_g1'] + 1.E-3*self.array['x']
+        self.array['g2'] = 0.02*numpy.random.randn(self.n)
+        self.array['sigma'] = 2.
+        self.array['psf_sigma'] = 1.5
+
+    def test_map(self):
+        """Test the binned residual maps against a direct calculation."""
+        sys_test = stile.FocalPlaneMapSysTest(xlim=(0., 100.), ylim=(0., 50.), n_bins=(4, 2))
+        result = sys_test(self.array)
+        numpy.testing.assert_equal(result.shape, (2, 4))
+        numpy.testing.assert_equal(numpy.sum(result.counts), self.n)
+        dg1 = self.array['g1']-self.array['psf_g1']
+        for iy in range(2):
+            for ix in range(4):
+                mask = ((self.array['x'] >= 25.*ix) & (self.array['x'] < 25.*(ix+1)) &
+                        (self.array['y'] >= 25.*iy) & (self.array['y'] < 25.*(iy+1)))
+                numpy.testing.assert_equal(result.counts[iy, ix], numpy.sum(mask))
+                numpy.testing.assert_allclose(result.mean('g1-psf_g1')[iy, ix],
+                                              numpy.mean(dg1[mask]))
+                numpy.testing.assert_allclose(result.median('g1-psf_g1')[iy, ix],
+                                              numpy.median(dg1[mask]))
+                numpy.testing.assert_allclose(result.std('g1-psf_g1')[iy, ix],
+                                              numpy.std(dg1[mask]), rtol=1.E-6)
+        numpy.testing.assert_allclose(result.mean('sigma-psf_sigma'), 0.5)
+        data = sys_test.getData()
+        numpy.testing.assert_equal(len(data), 8)
+        numpy.testing.assert_equal(numpy.sum(data['N']), self.n)
+        # Points off the grid are dropped.
+        result = sys_test(self.array, xlim=(0., 50.))
+        numpy.testing.assert_equal(numpy.sum(result.counts), numpy.sum(self.array['x'] <= 50.))
+
+    def test_merge(self):
+        """Test that merged maps agree with a map of all the data."""
+        sys_test = stile.FocalPlaneMapSysTest(xlim=(0., 100.), ylim=(0., 50.), n_bins=5)
+        full = sys_test(self.array)
+        first = sys_test(self.array[:self.n//3])
+        second = sys_test(self.array[self.n//3:])
+        # Round-trip one of them through a file.
+        handle, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(handle)
+        numpy.savez(filename, **second.getState())
+        second = stile.sys_tests.FocalPlaneMap.fromState(numpy.load(filename))
+        os.remove(filename)
+        merged = first.merge(second)
+        numpy.testing.assert_equal(merged.counts, full.counts)
+        for q in full.quantities:
+            numpy.testing.assert_allclose(merged.mean(q), full.mean(q), atol=1.E-12)
+            numpy.testing.assert_allclose(merged.std(q), full.std(q), atol=1.E-8)
+            self.assertTrue(numpy.all(numpy.isnan(merged.median(q))))
+        other_grid = stile.FocalPlaneMapSysTest(n_bins=5)(self.array)
+        self.assertRaises(ValueError, full.merge, other_grid)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestGroupBy(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1234)
+        self.n = 5000
+        self.ccds = numpy.random.choice(['1_42', '1_7', '2_0', '10_3'], size=self.n)
+        self.x = numpy.random.randn(self.n)
+        self.y = 2.*self.x + numpy.random.randn(self.n)
+        self.yerr = 0.5+numpy.random.rand(self.n)
+        self.z = numpy.random.rand(self.n)
+
+    def test_GroupBy(self):
+        """Test the group statistics against a loop over the groups."""
+        grouped = stile.GroupBy(self.ccds)
+        numpy.testing.assert_equal(grouped.keys, sorted(set(self.ccds)))
+        numpy.testing.assert_equal(len(grouped), 4)
+        masks = [self.ccds == key for key in grouped.keys]
+        numpy.testing.assert_equal(grouped.count(), [numpy.sum(m) for m in masks])
+        numpy.testing.assert_allclose(grouped.sum(self.x), [numpy.sum(self.x[m]) for m in masks])
+        numpy.testing.assert_allclose(grouped.mean(self.x), [numpy.mean(self.x[m]) for m in masks])
+        numpy.testing.assert_allclose(grouped.mean(self.x, weights=self.z),
+                                      [numpy.average(self.x[m], weights=self.z[m]) for m in masks])
+        numpy.testing.assert_allclose(grouped.std(self.x), [numpy.std(self.x[m]) for m in masks])
+        numpy.testing.assert_allclose(grouped.std(self.x, ddof=1),
+                                      [numpy.std(self.x[m], ddof=1) for m in masks])
+        numpy.testing.assert_equal(grouped.min(self.x), [numpy.min(self.x[m]) for m in masks])
+        numpy.testing.assert_equal(grouped.max(self.x), [numpy.max(self.x[m]) for m in masks])
+        numpy.testing.assert_allclose(grouped.median(self.x),
+                                      [numpy.median(self.x[m]) for m in masks])
+        mean, err = grouped.inverseVarianceMean(self.y, self.yerr)
+        numpy.testing.assert_allclose(mean, [numpy.average(self.y[m], weights=self.yerr[m]**-2)
+                                             for m in masks])
+        numpy.testing.assert_allclose(err, [numpy.sum(self.yerr[m]**-2)**-0.5 for m in masks])
+        numpy.testing.assert_allclose(grouped.apply(numpy.ptp, self.x),
+                                      [numpy.ptp(self.x[m]) for m in masks])
+        # Even-sized groups use the mean of the two central values, like numpy.median.
+        grouped = stile.GroupBy([3, 1, 3, 1, 1, 3, 1])
+        numpy.testing.assert_equal(grouped.keys, [1, 3])
+        numpy.testing.assert_equal(grouped.median([0., 1., 2., 4., 3., 6., 2.]), [2.5, 2.])
+        self.assertRaises(ValueError, grouped.mean, [1., 2.])
+
+    def test_getStatisticsPerCCD(self):
+        """Test that the scatter plot per-CCD statistics use the group-by engine consistently."""
+        scatter = stile.ScatterPlotSysTest()
+        keys = sorted(set(self.ccds))
+        masks = [self.ccds == key for key in keys]
+        ccds, x, y, yerr, z = scatter.getStatisticsPerCCD(self.ccds, self.x, self.y, yerr=self.yerr,
+                                                          z=self.z, stat="mean", return_keys=True)
+        numpy.testing.assert_equal(ccds, keys)
+        numpy.testing.assert_allclose(x, [numpy.mean(self.x[m]) for m in masks])
+        numpy.testing.assert_allclose(z, [numpy.mean(self.z[m]) for m in masks])
+        numpy.testing.assert_allclose(yerr, [numpy.sum(self.yerr[m]**-2)**-0.5 for m in masks])
+        x, y, yerr = scatter.getStatisticsPerCCD(self.ccds, self.x, self.y, stat="median")
+        numpy.testing.assert_allclose(y, [numpy.median(self.y[m]) for m in masks])
+        numpy.testing.assert_allclose(yerr, [numpy.sqrt(numpy.pi/2.)*numpy.std(self.y[m]) /
+                                             numpy.sqrt(numpy.sum(m)) for m in masks])
+        self.assertRaises(ValueError, scatter.getStatisticsPerCCD, self.ccds, self.x, self.y,
+                          stat="mode")
+
+if __name__ == '__main__':
+    unittest.main()
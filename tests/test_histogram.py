@@ -0,0 +1,123 @@
+import numpy
+import os
+import tempfile
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(1618)
+        self.n = 10000
+        self.array = numpy.zeros(self.n, dtype=[('g1', float), ('w', float)])
+        self.array['g1'] = 0.1*numpy.random.randn(self.n)
+        self.array['w'] = numpy.random.rand(self.n)
+
+    def test_counts(self):
+        """Test HistogramCounts against numpy.histogram, and merging of chunked counts."""
+        edges = numpy.linspace(-0.2, 0.2, 41)
+        g1, w = self.array['g1'], self.array['w']
+        counts = stile.sys_tests.HistogramCounts(edges).update(g1, w)
+        numpy.testing.assert_allclose(counts.counts, numpy.histogram(g1, edges, weights=w)[0])
+        numpy.testing.assert_allclose(counts.underflow, numpy.sum(w[g1 < -0.2]))
+        numpy.testing.assert_allclose(counts.overflow, numpy.sum(w[g1 > 0.2]))
+        numpy.testing.assert_allclose(counts.density(),
+                                      numpy.histogram(g1, edges, weights=w, density=True)[0])
+        # Uneven edges take a different path.
+        uneven = numpy.array([-0.3, -0.1, -0.05, 0., 0.2])
+        numpy.testing.assert_equal(stile.sys_tests.HistogramCounts(uneven).update(g1).counts,
+                                   numpy.histogram(g1, uneven)[0])
+        # The upper edge belongs to the last bin; NaNs are ignored.
+        numpy.testing.assert_equal(
+            stile.sys_tests.HistogramCounts([0., 1., 2.]).update([0., 2., numpy.nan, 3.]).counts,
+            [1, 1])
+
+        sys_test = stile.HistogramSysTest(field='g1', limits=[-0.2, 0.2], nbins=40)
+        chunks = [self.array[:3000], self.array[3000:7000], self.array[7000:]]
+        first = sys_test.accumulate(chunks[:2], weights=True)
+        second = sys_test.accumulate(chunks[2:], weights=True)
+        # Round-trip one of them through a file.
+        handle, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(handle)
+        numpy.savez(filename, **second.getState())
+        second = stile.sys_tests.HistogramCounts.fromState(numpy.load(filename))
+        os.remove(filename)
+        merged = first.merge(second)
+        inside = numpy.abs(g1) <= 0.2
+        numpy.testing.assert_allclose(merged.counts,
+                                      numpy.histogram(g1[inside], edges, weights=w[inside])[0])
+        # The values outside the limits are kept as underflow and overflow.
+        numpy.testing.assert_allclose(merged.underflow, numpy.sum(w[g1 < -0.2]))
+        numpy.testing.assert_allclose(merged.overflow, numpy.sum(w[g1 > 0.2]))
+        self.assertGreater(merged.underflow, 0.)
+        numpy.testing.assert_allclose(sys_test.accumulate([first, second]).counts, merged.counts)
+        self.assertRaises(ValueError, merged.merge, stile.sys_tests.HistogramCounts(uneven))
+        self.assertRaises(ValueError, stile.HistogramSysTest().accumulate, chunks)
+
+    def test_plot(self):
+        """Test that histograms are drawn from the counts."""
+        sys_test = stile.HistogramSysTest(field='g1', nbins=20)
+        for histtype in ['bar', 'step', 'stepfilled']:
+            fig = sys_test(self.array, histtype=histtype, normed=True, vlines=0.)
+            self.assertTrue(hasattr(fig, 'savefig'))
+        counts = sys_test.histogram_counts[0]
+        numpy.testing.assert_equal(numpy.sum(counts.counts), self.n)
+        numpy.testing.assert_equal(len(counts.counts), 20)
+        # Pre-accumulated counts can be drawn directly, alone or with other data.
+        fig = sys_test(counts)
+        self.assertIs(sys_test.histogram_counts[0], counts)
+        sys_test = stile.HistogramSysTest()
+        fig = sys_test([counts, self.array['g1'][:100]], cumulative=True, log=True)
+        numpy.testing.assert_equal(numpy.sum(sys_test.histogram_counts[1].counts), 100)
+
+    def test_bin_widths(self):
+        """Test the automatic bin-width rules."""
+        sys_test = stile.HistogramSysTest()
+        data = self.array['g1']
+        n = len(data)
+        dsorted = numpy.sort(data)
+        dx, bins = sys_test.freedman_bin_width(data, True)
+        numpy.testing.assert_allclose(
+            dx, 2*(dsorted[3*n//4-1]-dsorted[n//4-1])/n**(1./3))
+        numpy.testing.assert_equal(bins[0], dsorted[0])
+        self.assertGreaterEqual(bins[-1], dsorted[-1])
+        dx, bins = sys_test.scotts_bin_width(data, True)
+        numpy.testing.assert_allclose(dx, 3.5*numpy.std(data)/n**(1./3))
+        self.assertGreaterEqual(bins[-1], dsorted[-1])
+        # Subsampled estimates are close, and the bins still cover all the data.
+        for rule in [sys_test.freedman_bin_width, sys_test.scotts_bin_width]:
+            dx, bins = rule(data, True, max_sample=2000)
+            numpy.testing.assert_allclose(dx, rule(data), rtol=0.1)
+            self.assertLessEqual(bins[0], dsorted[0])
+            self.assertGreaterEqual(bins[-1], dsorted[-1])
+        self.assertRaises(ValueError, sys_test.freedman_bin_width, data[:3])
+        # Identical values don't give zero-width bins.
+        self.assertEqual(len(sys_test.freedman_bin_width(numpy.ones(10), True)[1]), 2)
+
+        # Knuth's rule matches a direct search over re-binned data.
+        try:
+            from scipy.special import gammaln
+        except ImportError:
+            import math
+            gammaln = numpy.vectorize(math.lgamma)
+        data = data[:1000]
+        log_posterior = []
+        for M in range(1, 51):
+            counts = numpy.histogram(data, M)[0]
+            log_posterior.append(len(data)*numpy.log(M)+gammaln(0.5*M)-M*gammaln(0.5)-
+                                 gammaln(len(data)+0.5*M)+numpy.sum(gammaln(counts+0.5)))
+        M = numpy.argmax(log_posterior)+1
+        dx, bins = sys_test.knuth_bin_width(data, True, max_bins=50, n_fine=50*49*47)
+        numpy.testing.assert_equal(len(bins), M+1)
+        numpy.testing.assert_allclose(dx, (data.max()-data.min())/M)
+        fig = sys_test(data, binning_style='knuth')
+        numpy.testing.assert_equal(len(sys_test.histogram_counts[0].counts), len(
+            sys_test.knuth_bin_width(data, True)[1])-1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile.hsc.calib import LRUCache, CorrectionGrid
+
+
+class TestHSCCalib(unittest.TestCase):
+    def test_lru_cache(self):
+        """Test that the cache keeps the most recently used items and counts hits."""
+        fetched = []
+        def fetch(key):
+            fetched.append(key)
+            return {'FLUXMAG0': 1.E11*key}
+        cache = LRUCache(2)
+        self.assertEqual(cache.hit_rate, 0.)
+        self.assertEqual(cache.get(1, lambda: fetch(1)), {'FLUXMAG0': 1.E11})
+        cache.get(2, lambda: fetch(2))
+        self.assertIs(cache.get(1, lambda: fetch(1)), cache.get(1, lambda: fetch(1)))
+        # Adding a third item drops 2, the least recently used.
+        cache.get(3, lambda: fetch(3))
+        self.assertEqual(len(cache), 2)
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        cache.get(2, lambda: fetch(2))
+        self.assertEqual(fetched, [1, 2, 3, 2])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertAlmostEqual(cache.hit_rate, 1./3)
+        self.assertIn('hit rate 0.33', str(cache))
+        # Nothing is cached if the fetch fails.
+        def fail():
+            raise RuntimeError('No such dataset')
+        self.assertRaises(RuntimeError, cache.get, 4, fail)
+        self.assertNotIn(4, cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertRaises(ValueError, LRUCache, 0)
+
+    def test_correction_grid(self):
+        """Test interpolating a smooth photometric correction against exact evaluation."""
+        def evaluate(x, y):
+            # A correction of a few hundredths of a magnitude, like a meas_mosaic FluxFitParams.
+            return 0.02*numpy.sin(x/2000.)+0.01*numpy.cos(y/3000.)-0.005
+        rng = numpy.random.RandomState(271)
+        x = rng.uniform(0., 2048., 2000)
+        y = rng.uniform(0., 4176., 2000)
+        grid = CorrectionGrid(evaluate, (0., 2048.), (0., 4176.), tolerance=1.E-4)
+        self.assertFalse(grid.exact)
+        self.assertLessEqual(grid.max_error, 1.E-4)
+        n_evaluations = grid.n_evaluations
+        correction = grid(x, y)
+        self.assertEqual(grid.n_evaluations, n_evaluations)
+        self.assertLess(n_evaluations, len(x))
+        self.assertEqual(correction.shape, x.shape)
+        numpy.testing.assert_allclose(correction, evaluate(x, y), rtol=0, atol=2.E-4)
+        exact_grid = CorrectionGrid(evaluate, (0., 2048.), (0., 4176.), tolerance=1.E-12,
+                                    max_cells=64)
+        self.assertTrue(exact_grid.exact)
+        numpy.testing.assert_allclose(exact_grid(x, y), evaluate(x, y))
+
+if __name__ == '__main__':
+    unittest.main()
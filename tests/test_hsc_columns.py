@@ -0,0 +1,142 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile.hsc.columns import CatalogColumns, AsColumns, ConfigKey, ColumnStore
+from mock_lsst import MakeMockCatalog
+
+
+class TestHSCColumns(unittest.TestCase):
+    def setUp(self):
+        self.n = 300
+        self.catalog = MakeMockCatalog(self.n, seed=314)
+        self.flags = ['flux.psf.flags', 'shape.sdss.flags', 'shape.sdss.centroid.flags']
+
+    def test_columns(self):
+        """Test that columns are read whole, once, and match the catalog."""
+        columns = CatalogColumns(self.catalog)
+        self.assertEqual(len(columns), self.n)
+        self.assertTrue(columns.isContiguous())
+        numpy.testing.assert_equal(columns['flux.psf'], self.catalog.columns['flux.psf'])
+        self.assertIs(columns['flux.psf'], columns['flux.psf'])
+        numpy.testing.assert_equal(columns.getX(), self.catalog.columns['centroid.x'])
+        numpy.testing.assert_equal(columns.get(self.catalog.schema.find('shape.sdss.err').key),
+                                   self.catalog.columns['shape.sdss.err'])
+        self.assertIs(AsColumns(columns), columns)
+        self.assertEqual(self.catalog.n_record_reads, 0)
+
+    def test_select(self):
+        """Test that (nested) subsets match masking the column arrays directly."""
+        columns = CatalogColumns(self.catalog)
+        mask = self.catalog.columns['classification.extendedness'] == 1
+        subset = columns[mask]
+        self.assertEqual(len(subset), numpy.sum(mask))
+        numpy.testing.assert_equal(subset['flux.psf'], self.catalog.columns['flux.psf'][mask])
+        numpy.testing.assert_equal(subset.getY(), self.catalog.columns['centroid.y'][mask])
+        inner_mask = subset['flux.psf'] > 5000.
+        inner = subset[inner_mask]
+        numpy.testing.assert_equal(inner['coord.ra'],
+                                   self.catalog.columns['coord.ra'][mask][inner_mask])
+        numpy.testing.assert_equal(inner.get(self.catalog.schema.find('shape.sdss.xx').key),
+                                   self.catalog.columns['shape.sdss.xx'][mask][inner_mask])
+        numpy.testing.assert_equal(columns[numpy.array([3, 1, 4])]['flux.psf.err'],
+                                   self.catalog.columns['flux.psf.err'][[3, 1, 4]])
+        self.assertRaises(ValueError, columns.select, mask[:-1])
+        # An already-masked (non-contiguous) catalog is copied once rather than read by record.
+        masked_catalog = self.catalog[mask]
+        from_masked = CatalogColumns(masked_catalog)
+        numpy.testing.assert_equal(from_masked['flux.psf'], subset['flux.psf'])
+        self.assertEqual(masked_catalog.n_record_reads, 0)
+
+    def test_flag_mask(self):
+        """Test combining several flags against combining one mask per flag."""
+        columns = CatalogColumns(self.catalog)
+        expected = numpy.logical_and.reduce([self.catalog.columns[flag] == False
+                                             for flag in self.flags])
+        numpy.testing.assert_equal(columns.flagMask(self.flags), expected)
+        expected = numpy.logical_and(expected, self.catalog.columns['calib.psf.used'])
+        numpy.testing.assert_equal(columns.flagMask(self.flags, ['calib.psf.used']), expected)
+        numpy.testing.assert_equal(columns.flagMask(), numpy.ones(self.n, dtype=bool))
+        subset = columns[columns.flagMask(self.flags)]
+        self.assertFalse(numpy.any(subset.flagMask(keep_true=self.flags)))
+        self.assertTrue(numpy.all(subset.flagMask(self.flags)))
+
+    def test_cached_mask(self):
+        """Test that each cached mask is computed once per catalog and can't be changed."""
+        columns = CatalogColumns(self.catalog)
+        calls = []
+        def MaskStar(data):
+            calls.append(len(data))
+            return data['classification.extendedness'] == 0
+        key = ('star', MaskStar, ConfigKey(None))
+        mask = columns.cachedMask(key, MaskStar)
+        self.assertIs(columns.cachedMask(key, MaskStar), mask)
+        self.assertEqual(calls, [self.n])
+        numpy.testing.assert_equal(mask, self.catalog.columns['classification.extendedness'] == 0)
+        self.assertFalse(mask.flags.writeable)
+        self.assertRaises(ValueError, mask.__setitem__, 0, True)
+        # Subsets keep their own masks.
+        subset = columns[mask]
+        self.assertTrue(numpy.all(subset.cachedMask(key, MaskStar)))
+        self.assertEqual(calls, [self.n, numpy.sum(mask)])
+        self.assertRaises(ValueError, columns.cachedMask, 'bad', lambda data: [True])
+
+    def test_config_key(self):
+        """Test the config keys for LSST-like, hashable and unhashable configs."""
+        class Config(object):
+            def __init__(self, cutoff):
+                self.cutoff = cutoff
+            def toDict(self):
+                return {'cutoff': self.cutoff, 'flags': ['a', 'b']}
+        self.assertEqual(ConfigKey(Config(50)), ConfigKey(Config(50)))
+        self.assertNotEqual(ConfigKey(Config(50)), ConfigKey(Config(80)))
+        self.assertEqual(ConfigKey(None), None)
+        config = {'cutoff': 50}
+        self.assertEqual(ConfigKey(config), id(config))
+
+    def test_column_store(self):
+        """Test that arrays selected from a store match masking and concatenating each catalog."""
+        catalogs = [CatalogColumns(MakeMockCatalog(n, seed=n)) for n in (40, 25, 60)]
+        masks = [catalog['classification.extendedness'] == 0 for catalog in catalogs]
+        extra = [{'CCD': numpy.array(['%03i'%i]*len(catalog), dtype='S7'),
+                  'w': numpy.ones(len(catalog))} for i, catalog in enumerate(catalogs)]
+        store = ColumnStore([len(catalog) for catalog in catalogs])
+        store.addColumn('flux.psf', [catalog['flux.psf'] for catalog in catalogs])
+        store.addColumn('shape.sdss.err', [catalog['shape.sdss.err'] for catalog in catalogs])
+        for name in ['CCD', 'w']:
+            store.addColumn(name, [e[name] for e in extra])
+        self.assertEqual(len(store), 125)
+        self.assertIn('CCD', store)
+        self.assertEqual(store.names(), ['flux.psf', 'shape.sdss.err', 'CCD', 'w'])
+        data = store.makeArray(['flux.psf', 'CCD', 'flux.psf', 'g1', 'shape.sdss.err'],
+                               numpy.concatenate(masks))
+        self.assertEqual(data.dtype.names, ('flux.psf', 'CCD', 'shape.sdss.err'))
+        n_selected = sum(numpy.sum(mask) for mask in masks)
+        self.assertEqual(data['shape.sdss.err'].shape, (n_selected, 3, 3))
+        numpy.testing.assert_equal(data['flux.psf'], numpy.concatenate(
+            [catalog['flux.psf'][mask] for catalog, mask in zip(catalogs, masks)]))
+        numpy.testing.assert_equal(data['CCD'], numpy.concatenate(
+            [e['CCD'][mask] for e, mask in zip(extra, masks)]))
+        numpy.testing.assert_equal(store.makeArray(['w'], [0, 124])['w'], [1., 1.])
+        self.assertEqual(len(store.makeArray(['w'])), 125)
+        # Stores for separate catalogs can be joined.
+        parts = []
+        for catalog, e in zip(catalogs, extra):
+            part = ColumnStore([len(catalog)])
+            part.addColumn('flux.psf', [catalog['flux.psf']])
+            part.addColumn('CCD', [e['CCD']])
+            parts.append(part)
+        parts[1].addColumn('w', [extra[1]['w']])
+        joined = ColumnStore.concatenate(parts)
+        self.assertEqual(joined.names(), ['flux.psf', 'CCD'])
+        numpy.testing.assert_equal(joined['CCD'], store['CCD'])
+        self.assertRaises(ValueError, store.addColumn, 'x', [numpy.zeros(40)])
+        self.assertRaises(ValueError, store.addColumn, 'x', [numpy.zeros(n) for n in (40, 25, 6)])
+        self.assertRaises(ValueError, store.makeArray, ['w'], masks[0])
+
+if __name__ == '__main__':
+    unittest.main()
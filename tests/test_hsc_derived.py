@@ -0,0 +1,127 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile.hsc.derived import DerivedColumns
+from stile.hsc.columns import AsColumns, ColumnStore
+from mock_lsst import MakeMockCatalog
+
+
+class TestHSCDerived(unittest.TestCase):
+    def setUp(self):
+        self.n = 200
+        self.columns = AsColumns(MakeMockCatalog(self.n, seed=161))
+        self.calls = []
+        self.derived = DerivedColumns(self.n)
+        columns = self.columns
+        derived = self.derived
+
+        def computeErrors(rows, mask_type=None):
+            self.calls.append(('errors', len(rows), mask_type))
+            err = columns['shape.sdss.err'][rows]
+            return {'g1_err': numpy.sqrt(err[:, 0, 0]), 'g2_err': numpy.sqrt(err[:, 1, 1]),
+                    'unused': numpy.zeros(len(rows))}, None
+
+        def computeWeights(rows, mask_type=None):
+            self.calls.append(('w', len(rows), mask_type))
+            return {'w': 1./(0.51**2+derived['g1_err'][rows]**2+derived['g2_err'][rows]**2)}, None
+
+        def computeMag(rows, mask_type=None):
+            self.calls.append(('mag', len(rows), mask_type))
+            # Negative fluxes give genuinely nan magnitudes, which are flagged as unusable.
+            flux = numpy.where(rows%7 == 0, -1., columns['flux.psf'][rows])
+            with numpy.errstate(invalid='ignore'):
+                mag = 27.-2.5*numpy.log10(flux)
+            return {'mag': mag}, columns[rows].flagMask(['flux.psf.flags']) & (flux > 0)
+
+        # Defined out of order, to check that dependencies are computed first.
+        derived.define(['w'], ['g1_err', 'g2_err'], computeWeights)
+        derived.define(['g1_err', 'g2_err'], ['shape.sdss.err'], computeErrors)
+        derived.define(['mag'], ['flux.psf', 'flux.psf.flags', 'calib'], computeMag)
+
+    def test_dependencies(self):
+        """Test that inputs are computed first, and each row of each quantity only once."""
+        self.assertEqual(self.derived.order(['w', 'mag']), ['g1_err', 'g2_err', 'w', 'mag'])
+        galaxy = self.columns['classification.extendedness'] == 1
+        n_galaxy = numpy.sum(galaxy)
+        valid = self.derived.compute(['w'], galaxy, mask_type='galaxy')
+        self.assertTrue(numpy.all(valid))
+        self.assertEqual(self.calls, [('errors', n_galaxy, 'galaxy'), ('w', n_galaxy, 'galaxy')])
+        self.assertIn('w', self.derived)
+        self.assertNotIn('unused', self.derived)
+        self.assertNotIn('mag', self.derived)
+        numpy.testing.assert_equal(self.derived.computed('g1_err'), galaxy)
+        err = self.columns['shape.sdss.err'][galaxy]
+        numpy.testing.assert_allclose(self.derived['w'][galaxy],
+                                      1./(0.51**2+err[:, 0, 0]+err[:, 1, 1]))
+        # Only the rows not already computed are computed, in one batch per group.
+        everything = numpy.ones(self.n, dtype=bool)
+        self.derived.compute(['g2_err', 'w'], everything, mask_type='star')
+        self.assertEqual(self.calls[2:], [('errors', self.n-n_galaxy, 'star'),
+                                          ('w', self.n-n_galaxy, 'star')])
+        self.derived.compute(['w'], galaxy)
+        self.assertEqual(len(self.calls), 4)
+        self.assertTrue(numpy.all(self.derived.computed('w')))
+        self.assertFalse(self.derived.computed('w').flags.writeable)
+
+    def test_validity(self):
+        """Test that unusable (and nan) rows are masked every time without being recomputed."""
+        galaxy = self.columns['classification.extendedness'] == 1
+        expected = self.columns.flagMask(['flux.psf.flags'])
+        expected[::7] = False
+        valid = self.derived.compute(['mag'], galaxy)
+        numpy.testing.assert_equal(valid, expected | ~galaxy)
+        self.assertTrue(numpy.all(numpy.isnan(self.derived['mag'][::7][galaxy[::7]])))
+        valid = self.derived.compute(['mag', 'w'], galaxy)
+        numpy.testing.assert_equal(valid, expected | ~galaxy)
+        self.assertEqual([call[0] for call in self.calls], ['mag', 'errors', 'w'])
+
+    def test_empty_mask(self):
+        """Test that the columns are made even when no rows are asked for, so that catalogs with
+        empty masks can be concatenated with the others."""
+        nothing = numpy.zeros(self.n, dtype=bool)
+        valid = self.derived.compute(['w'], nothing, mask_type='galaxy')
+        self.assertTrue(numpy.all(valid))
+        self.assertEqual(self.calls, [('errors', 0, 'galaxy'), ('w', 0, 'galaxy')])
+        for name in ['g1_err', 'g2_err', 'w']:
+            self.assertIn(name, self.derived)
+            self.assertEqual(self.derived[name].shape, (self.n,))
+            self.assertFalse(numpy.any(self.derived.computed(name)))
+        # Calling again for no rows (or for rows already computed) doesn't compute anything.
+        self.derived.compute(['w'], nothing)
+        self.assertEqual(len(self.calls), 2)
+        # So the column of a catalog with an empty mask is kept when it is combined with the others
+        # (as in the tasks' makeColumnStore).
+        other = DerivedColumns(10)
+        other['w'] = numpy.ones(10)
+        store = ColumnStore([self.n, 10])
+        store.addColumn('w', [derived['w'] for derived in [self.derived, other] if 'w' in derived])
+        self.assertEqual(len(store['w']), self.n+10)
+
+    def test_set_and_errors(self):
+        """Test columns set directly, and the errors for undefined or badly defined columns."""
+        ccd = numpy.array(['042']*self.n)
+        self.derived['CCD'] = ccd
+        self.assertIs(self.derived['CCD'], ccd)
+        self.assertTrue(self.derived.isDefined('CCD'))
+        self.assertTrue(numpy.all(self.derived.computed('CCD')))
+        valid = self.derived.compute(['CCD'], numpy.ones(self.n, dtype=bool))
+        self.assertTrue(numpy.all(valid))
+        self.assertFalse(self.derived.isDefined('g1_sky'))
+        mask = numpy.ones(self.n, dtype=bool)
+        self.assertRaises(ValueError, self.derived.compute, ['g1_sky'], mask)
+        self.assertRaises(ValueError, self.derived.compute, ['w'], mask[1:])
+        self.assertRaises(ValueError, self.derived.define, ['mag', 'mag_err'], [], None)
+        self.assertRaises(ValueError, self.derived.__setitem__, 'w', numpy.zeros(self.n))
+        self.assertRaises(ValueError, self.derived.__setitem__, 'x', numpy.zeros(3))
+        self.derived.define(['a'], ['b'], None)
+        self.derived.define(['b'], ['a'], None)
+        self.assertRaises(ValueError, self.derived.order, ['a'])
+        self.assertEqual(self.calls, [])
+
+if __name__ == '__main__':
+    unittest.main()
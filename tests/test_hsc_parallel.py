@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile.hsc.parallel import PrefetchCatalogs, ProcessMap, GatherColumns
+from stile.hsc.columns import AsColumns, ColumnStore
+from mock_lsst import MakeMockCatalog, MockDataRef
+
+
+# Set in each worker process by _initWorker, like the task in the HSC tasks' process pool.
+_worker_cutoff = None
+
+
+def _initWorker(cutoff):
+    global _worker_cutoff
+    _worker_cutoff = cutoff
+
+
+def _catalogColumns(seed):
+    # The columns and masks for two "sys tests" of one catalog, like computeCatalogColumns.
+    columns = AsColumns(MakeMockCatalog(40, seed=seed))
+    galaxy = columns['classification.extendedness'] == 1
+    bright = columns['flux.psf']/columns['flux.psf.err'] > _worker_cutoff
+    store = ColumnStore([len(columns)])
+    store.addColumn('ra', [columns['coord.ra']])
+    store.addColumn('x', [columns.getX()])
+    store.addColumn('CCD', [numpy.zeros(len(columns), dtype=int)+seed])
+    store.addColumn('pid', [numpy.zeros(len(columns), dtype=int)+os.getpid()])
+    return store, [[galaxy], [bright, galaxy]]
+
+
+class TestHSCParallel(unittest.TestCase):
+    def setUp(self):
+        self.latency = 0.05
+        self.n_ccds = 16
+        # CCD 5 is missing, like a patch with no catalog.
+        self.data_refs = [MockDataRef({'visit': 1228, 'ccd': ccd},
+                                      None if ccd == 5 else MakeMockCatalog(50, seed=ccd),
+                                      latency=self.latency)
+                          for ccd in range(self.n_ccds)]
+
+    def load(self, data_ref):
+        return data_ref.get('src', immediate=True)
+
+    def test_prefetch(self):
+        """Test that catalogs are read concurrently and processed in the calling thread."""
+        processed = []
+        def process(data_ref, catalog):
+            processed.append((time.time(), threading.current_thread().name))
+            columns = AsColumns(catalog)
+            return columns[columns.flagMask(['flux.psf.flags'])]
+        skipped = []
+        start = time.time()
+        loaded = PrefetchCatalogs(self.data_refs, self.load, process, n_threads=8,
+                                  on_skip=lambda data_ref, e: skipped.append((data_ref, str(e))))
+        elapsed = time.time()-start
+        # Reading 16 catalogs 8 at a time takes about 2 latencies rather than 16.
+        self.assertLess(elapsed, 0.5*self.n_ccds*self.latency)
+        self.assertEqual([data_ref.dataId['ccd'] for data_ref, catalog in loaded],
+                         [ccd for ccd in range(self.n_ccds) if ccd != 5])
+        self.assertEqual(len(skipped), 1)
+        self.assertIs(skipped[0][0], self.data_refs[5])
+        self.assertIn('No src found', skipped[0][1])
+        for data_ref, catalog in loaded:
+            numpy.testing.assert_equal(
+                catalog['flux.psf'],
+                data_ref.catalog.columns['flux.psf'][~data_ref.catalog.columns['flux.psf.flags']])
+        # Processing happened in this thread, and started before the last catalog was read.
+        self.assertEqual(set(name for t, name in processed),
+                         set([threading.current_thread().name]))
+        self.assertLess(processed[0][0], max(data_ref.reads[0][1] for data_ref in self.data_refs))
+        self.assertGreater(len(set(data_ref.reads[0][2] for data_ref in self.data_refs)), 1)
+
+    def test_serial(self):
+        """Test that one thread gives the same results, without using a pool."""
+        loaded = PrefetchCatalogs(self.data_refs[:4], self.load, n_threads=1)
+        self.assertEqual([data_ref.dataId['ccd'] for data_ref, catalog in loaded], [0, 1, 2, 3])
+        self.assertIs(loaded[2][1], self.data_refs[2].catalog)
+        self.assertEqual(set(data_ref.reads[0][2] for data_ref in self.data_refs[:4]),
+                         set([threading.current_thread().name]))
+
+    def test_errors(self):
+        """Test that errors other than the skipped ones are raised."""
+        def process(data_ref, catalog):
+            raise ValueError('Bad catalog')
+        self.assertRaises(ValueError, PrefetchCatalogs, self.data_refs[:4], self.load, process)
+        self.assertRaises(RuntimeError, PrefetchCatalogs, self.data_refs, self.load,
+                          skip_errors=())
+
+    def test_process_map(self):
+        """Test computing columns per catalog in processes and gathering them for all catalogs."""
+        seeds = list(range(6))
+        _initWorker(500.)
+        serial = [_catalogColumns(seed) for seed in seeds]
+        parallel = ProcessMap(_catalogColumns, seeds, n_processes=3, initializer=_initWorker,
+                              initargs=(500.,))
+        self.assertEqual(len(parallel), len(seeds))
+        store, masks = GatherColumns(parallel)
+        self.assertEqual(len(store), 40*len(seeds))
+        self.assertEqual(store.lengths, [40]*len(seeds))
+        self.assertEqual([len(sys_test) for sys_test in masks], [1, 2])
+        for column in ['ra', 'x', 'CCD']:
+            numpy.testing.assert_equal(store[column],
+                                       numpy.concatenate([s[column] for s, m in serial]))
+        numpy.testing.assert_equal(masks[1][0], numpy.concatenate([m[1][0] for s, m in serial]))
+        data = store.makeArray(['ra', 'CCD'], masks[0][0])
+        numpy.testing.assert_equal(data['ra'], numpy.concatenate(
+            [s['ra'][m[0][0]] for s, m in serial]))
+        self.assertNotIn(os.getpid(), store['pid'])
+        store, masks = GatherColumns([])
+        self.assertEqual((len(store), masks), (0, []))
+        mismatched = [serial[0], (serial[1][0], [[serial[1][1][0][0]]])]
+        self.assertRaises(ValueError, GatherColumns, mismatched)
+
+if __name__ == '__main__':
+    unittest.main()
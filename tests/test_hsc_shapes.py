@@ -0,0 +1,98 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile.hsc import shapes
+from mock_lsst import MakeMockCatalog
+
+
+class TestHSCShapes(unittest.TestCase):
+    def setUp(self):
+        self.n = 200
+        self.catalog = MakeMockCatalog(self.n, seed=1729)
+        rng = numpy.random.RandomState(1729)
+        # Something like a pixel-to-sky Jacobian in degrees per pixel, with a little shear.
+        self.transforms = 4.7E-5*(numpy.eye(2)+0.05*rng.randn(self.n, 2, 2))
+
+    def test_columns(self):
+        """Test reading whole columns from contiguous and non-contiguous catalogs."""
+        mask = numpy.arange(self.n) % 3 == 0
+        subset = self.catalog[mask]
+        key = self.catalog.schema.find('flux.psf').key
+        numpy.testing.assert_equal(shapes.GetColumn(subset, key),
+                                   shapes.GetColumn(self.catalog, key)[mask])
+        self.assertEqual(self.catalog.n_record_reads, 0)
+        for field in ['shape.sdss', 'shape.sdss.psf']:
+            moments = shapes.MomentColumns(self.catalog, field)
+            numpy.testing.assert_equal(moments[0], self.catalog.columns[field+'.xx'])
+            numpy.testing.assert_equal(moments[2], self.catalog.columns[field+'.xy'])
+            for column, subset_column in zip(moments, shapes.MomentColumns(subset, field)):
+                numpy.testing.assert_equal(column[mask], subset_column)
+        covariances = shapes.CovarianceColumns(self.catalog, 'shape.sdss.err')
+        numpy.testing.assert_equal(covariances, self.catalog.columns['shape.sdss.err'])
+        numpy.testing.assert_equal(shapes.CovarianceColumns(subset, 'shape.sdss.err'),
+                                   covariances[mask])
+
+    def test_transforms(self):
+        """Test the batched transforms against the per-object matrix calculation."""
+        ixx, iyy, ixy = shapes.MomentColumns(self.catalog, 'shape.sdss')
+        covariances = shapes.CovarianceColumns(self.catalog, 'shape.sdss.err')
+        new_moments = shapes.TransformMoments(ixx, iyy, ixy, self.transforms)
+        new_variances = shapes.TransformMomentVariances(
+            covariances[:, 0, 0], covariances[:, 1, 1], covariances[:, 2, 2], self.transforms)
+        for i in range(0, self.n, 17):
+            lt = self.transforms[i]
+            matrix = lt.dot(numpy.array([[ixx[i], ixy[i]], [ixy[i], iyy[i]]])).dot(lt.T)
+            numpy.testing.assert_allclose([m[i] for m in new_moments],
+                                          [matrix[0, 0], matrix[1, 1], matrix[0, 1]])
+            cov = covariances[i]
+            expected_var_ixy = ((lt[0, 0]*lt[1, 0])**2*cov[0, 0] +
+                                (lt[0, 0]*lt[1, 1]+lt[0, 1]*lt[1, 0])**2*cov[2, 2] +
+                                (lt[0, 1]*lt[1, 1])**2*cov[1, 1])
+            numpy.testing.assert_allclose(new_variances[2][i], expected_var_ixy)
+
+        g1, g2, sigma = shapes.ShapesFromMoments(ixx, iyy, ixy)
+        numpy.testing.assert_allclose(g1, (ixx-iyy)/(ixx+iyy))
+        numpy.testing.assert_allclose(sigma**4, ixx*iyy-ixy**2)
+        # The errors match a numerical derivative.
+        errors = shapes.ShapeErrorsFromMoments(ixx, iyy, ixy, 1.E-8, 0., 0.)
+        step = shapes.ShapesFromMoments(ixx+1.E-4, iyy, ixy)
+        for error, value, stepped in zip(errors, (g1, g2, sigma), step):
+            numpy.testing.assert_allclose(error, numpy.abs(stepped-value), rtol=1.E-3)
+
+    def test_jacobian_grid(self):
+        """Test interpolating the Jacobian of a smooth distortion against exact evaluation."""
+        def linearize(x, y):
+            # A smoothly varying Jacobian in degrees per pixel, with a 0.1% distortion.
+            wave = 1.E-3*numpy.sin(x/1500.)*numpy.cos(y/2500.)
+            return 4.7E-5*numpy.array([[1.+wave, 0.5*wave], [0.2*wave, 1.-wave]])
+        x, y = shapes.CentroidColumns(self.catalog)
+        numpy.testing.assert_equal(x, shapes.CentroidColumns(self.catalog[x > 0])[0])
+        grid = shapes.JacobianGrid(linearize, (0., 2048.), (0., 4176.), tolerance=1.E-5)
+        self.assertFalse(grid.exact)
+        self.assertLessEqual(grid.max_error, 1.E-5)
+        n_evaluations = grid.n_evaluations
+        transforms = grid(x, y)
+        self.assertEqual(grid.n_evaluations, n_evaluations)
+        self.assertEqual(transforms.shape, (self.n, 2, 2))
+        exact = numpy.array([linearize(xx, yy) for xx, yy in zip(x, y)])
+        numpy.testing.assert_allclose(transforms, exact, rtol=0, atol=2.E-5*4.7E-5)
+        self.assertLessEqual(grid.maxError(x, y), 2.E-5)
+        # The grid nodes themselves are exact.
+        numpy.testing.assert_allclose(grid(grid.x_nodes[[0, 2]], grid.y_nodes[[1, -1]]),
+                                      [linearize(grid.x_nodes[0], grid.y_nodes[1]),
+                                       linearize(grid.x_nodes[2], grid.y_nodes[-1])])
+        # A tighter tolerance needs a finer grid; one that can't be met uses exact evaluation.
+        fine = shapes.JacobianGrid(linearize, (0., 2048.), (0., 4176.), tolerance=1.E-7)
+        self.assertGreater(fine.n_cells[0], grid.n_cells[0])
+        exact_grid = shapes.JacobianGrid(linearize, (0., 2048.), (0., 4176.), tolerance=1.E-12,
+                                         max_cells=64)
+        self.assertTrue(exact_grid.exact)
+        numpy.testing.assert_allclose(exact_grid(x, y), exact)
+
+if __name__ == '__main__':
+    unittest.main()
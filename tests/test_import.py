@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+try:
+    import stile
+except ImportError:
+    sys.path.append('..')
+    import stile
+
+
+class TestImport(unittest.TestCase):
+    def test_lazy_imports(self):
+        """Test that importing Stile does not import its heavy optional dependencies."""
+        code = ("import sys; import stile; "
+                "print(' '.join(m for m in ['stile.sys_tests', 'matplotlib', 'treecorr', 'scipy', "
+                "'pyfits', 'astropy'] if m in sys.modules))")
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(stile.__file__)))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(output.decode().split(), [])
+
+    def test_registry(self):
+        """Test that the sys test factories make the registered classes."""
+        for factory, registry in [
+                (stile.CorrelationFunctionSysTest, stile.sys_tests.correlation_function_types),
+                (stile.WhiskerPlotSysTest, stile.sys_tests.whisker_plot_types),
+                (stile.ScatterPlotSysTest, stile.sys_tests.scatter_plot_types)]:
+            for type, class_name in registry.items():
+                self.assertEqual(factory(type).__class__.__name__, class_name)
+            self.assertRaises(ValueError, factory, 'NotAType')
+        self.assertIn('HistogramSysTest', dir(stile))
+        self.assertRaises(AttributeError, getattr, stile, 'NotASysTest')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(2236)
+        self.dir = tempfile.mkdtemp()
+        self.data = numpy.zeros(100, dtype=[('x', float), ('g1', float), ('ccd', int)])
+        self.data['x'] = numpy.random.rand(100)
+        self.data['g1'] = numpy.random.randn(100)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_hash(self):
+        """Test that the input hash changes with the data and the configuration only."""
+        config = {'nbins': 20, 'min_sep': 0.005}
+        input_hash = stile.RunManifest.hashInputs(self.data, None, config=config)
+        self.assertEqual(input_hash, stile.RunManifest.hashInputs(
+            self.data.copy(), None, config={'min_sep': 0.005, 'nbins': 20}))
+        self.assertNotEqual(input_hash,
+                            stile.RunManifest.hashInputs(self.data, None, config={'nbins': 20}))
+        changed = self.data.copy()
+        changed['g1'][50] += 1.E-10
+        self.assertNotEqual(input_hash, stile.RunManifest.hashInputs(changed, None, config=config))
+        self.assertNotEqual(input_hash, stile.RunManifest.hashInputs(self.data[::2], None,
+                                                                     config=config))
+
+    def test_manifest(self):
+        """Test recording, skipping and querying units of work."""
+        file_name = os.path.join(self.dir, 'manifest.sqlite')
+        output = os.path.join(self.dir, 'Rho1-1228-049.png')
+        open(output, 'w').close()
+        input_hash = stile.RunManifest.hashInputs(self.data)
+        data_id = {'visit': 1228, 'ccd': 49}
+        with stile.RunManifest(file_name) as manifest:
+            self.assertFalse(manifest.isDone('Rho1', data_id, input_hash))
+            manifest.record('Rho1', data_id, input_hash, [output, output+'.npz::Rho1/ccd=49'])
+            manifest.record('Rho1', {'visit': 1228, 'ccd': 50}, input_hash, [])
+            manifest.record('Stats', data_id, input_hash, [], bins=['x', 0])
+        # Records persist, and are matched on the test, data ID and bins.
+        manifest = stile.RunManifest(file_name)
+        self.assertFalse(manifest.isDone('Rho1', {'ccd': 49, 'visit': 1228}, input_hash))
+        open(output+'.npz', 'w').close()
+        self.assertTrue(manifest.isDone('Rho1', {'ccd': 49, 'visit': 1228}, input_hash))
+        self.assertFalse(manifest.isDone('Rho1', data_id, 'another hash'))
+        self.assertFalse(manifest.isDone('Stats', data_id, input_hash))
+        self.assertTrue(manifest.isDone('Stats', data_id, input_hash, bins=['x', 0]))
+        os.remove(output)
+        self.assertFalse(manifest.isDone('Rho1', data_id, input_hash))
+        self.assertEqual(len(manifest.query()), 3)
+        self.assertEqual(len(manifest.query('Rho1')), 2)
+        records = manifest.query(ccd=49)
+        self.assertEqual(sorted(record['sys_test'] for record in records), ['Rho1', 'Stats'])
+        self.assertEqual(manifest.get('Rho1', data_id)['outputs'][0], output)
+        self.assertIsNone(manifest.get('Rho1', data_id, bins='x'))
+        manifest.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestPlotQueue(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(2718)
+        self.n = 1000
+        fields = ['x', 'y', 'g1', 'g2', 'sigma', 'g1_err', 'psf_g1', 'psf_g2', 'psf_sigma']
+        self.array = numpy.zeros(self.n, dtype=[(f, float) for f in fields])
+        for field in fields:
+            self.array[field] = numpy.random.rand(self.n)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_defer(self):
+        """Test that sys tests return plot specs when defer_plots is set."""
+        sys_test = stile.ScatterPlotSysTest('StarVsPSFG1')
+        sys_test.defer_plots = True
+        spec = sys_test(self.array)
+        self.assertIsInstance(spec, stile.PlotSpec)
+        self.assertEqual(spec.method, 'scatterPlot')
+        # The spec draws the same plot as an immediate call, and the original is untouched.
+        self.assertTrue(sys_test.defer_plots)
+        self.assertFalse(hasattr(spec.obj, 'data'))
+        fig = spec.render()
+        self.assertTrue(hasattr(fig, 'savefig'))
+
+        sys_test = stile.WhiskerPlotSysTest('Residual')
+        sys_test.defer_plots = True
+        spec = sys_test(self.array, aggregate=True, cell_size=0.25)
+        self.assertIsInstance(spec, stile.PlotSpec)
+        # Aggregation happens before the plot is deferred, so the cells are available at once
+        # and only they go into the spec.
+        numpy.testing.assert_equal(len(sys_test.getData()), 16)
+        numpy.testing.assert_equal(len(spec.args[0]), 16)
+
+        sys_test = stile.HistogramSysTest(field='g1')
+        sys_test.defer_plots = True
+        spec = sys_test(self.array, nbins=20)
+        self.assertIsInstance(spec, stile.PlotSpec)
+        # Likewise, the data are binned before the plot is deferred, and only the counts go into
+        # the spec.
+        self.assertEqual(len(sys_test.histogram_counts), 1)
+        self.assertEqual(numpy.sum(sys_test.histogram_counts[0].counts), self.n)
+        self.assertEqual(len(spec.args[0]), 1)
+        self.assertIsInstance(spec.args[0][0], stile.sys_tests.HistogramCounts)
+        self.assertEqual(len(spec.args[0][0].counts), 20)
+        self.assertTrue(hasattr(spec.render(), 'savefig'))
+
+    def test_queue(self):
+        """Test rendering plots in background processes."""
+        sys_test = stile.ScatterPlotSysTest('StarVsPSFG1')
+        sys_test.defer_plots = True
+        filenames = [os.path.join(self.dir, 'plot%d.png' % i) for i in range(5)]
+        with stile.PlotQueue(processes=2, max_pending=2) as plot_queue:
+            for i, filename in enumerate(filenames):
+                plot_queue.submit(sys_test(self.array), filename)
+                # Backpressure keeps the number of outstanding plots bounded.
+                self.assertLessEqual(len(plot_queue._pending), 2)
+                # Only the plots still waiting or rendering are unwritten.
+                self.assertLessEqual(len(plot_queue.unwritten()), 2)
+                for written in set(filenames[:i+1])-plot_queue.unwritten():
+                    self.assertTrue(os.path.exists(written))
+            plot_queue.wait()
+            self.assertEqual(plot_queue.unwritten(), set())
+        for filename in filenames:
+            self.assertTrue(os.path.exists(filename))
+        # Without worker processes, plots (and ordinary figures) are saved immediately.
+        plot_queue = stile.PlotQueue(processes=0)
+        filename = os.path.join(self.dir, 'hist.png')
+        plot_queue.submit(stile.PlotSpec(stile.HistogramSysTest(), 'HistoPlot',
+                                         self.array['g1']), filename)
+        self.assertTrue(os.path.exists(filename))
+        filename = os.path.join(self.dir, 'fig.png')
+        plot_queue.submit(sys_test.scatterPlot(self.array['x'], self.array['y']), filename)
+        self.assertTrue(os.path.exists(filename))
+        plot_queue.close()
+        # Errors while rendering are raised in the main process.
+        plot_queue = stile.PlotQueue(processes=1)
+        plot_queue.submit(stile.PlotSpec(sys_test, 'scatterPlot', self.array['x'], None),
+                          os.path.join(self.dir, 'bad.png'))
+        self.assertRaises(TypeError, plot_queue.close)
+        self.assertEqual(plot_queue.unwritten(), set([os.path.join(self.dir, 'bad.png')]))
+
+if __name__ == '__main__':
+    unittest.main()
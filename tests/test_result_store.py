@@ -0,0 +1,67 @@
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(3141)
+        self.dir = tempfile.mkdtemp()
+        self.results = numpy.zeros(20, dtype=[('R_nom', float), ('xip', float), ('npairs', int)])
+        self.results['R_nom'] = numpy.logspace(0, 2, 20)
+        self.results['xip'] = numpy.random.randn(20)
+        self.results['npairs'] = numpy.arange(20)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_store(self):
+        """Test writing, reading back and listing results."""
+        file_name = os.path.join(self.dir, 'results.npz')
+        with stile.ResultStore(file_name, flush_size=3) as store:
+            for ccd in range(5):
+                store.write('StarXStarShear', self.results[ccd:], visit=1228, ccd=ccd)
+            store.write('Stats', numpy.arange(4.), visit=1228, ccd=0, bin='a')
+            # Results not yet flushed can be read too.
+            numpy.testing.assert_equal(store.read('Stats', visit=1228, ccd=0, bin='a'),
+                                       numpy.arange(4.))
+        store = stile.ResultStore(file_name)
+        numpy.testing.assert_equal(store.read('StarXStarShear', ccd=3, visit=1228),
+                                   self.results[3:])
+        self.assertEqual(len(store.keys()), 6)
+        self.assertEqual(store.keys('Stats'), [('Stats', {'visit': 1228, 'ccd': 0, 'bin': 'a'})])
+        self.assertEqual(len(store.keys(ccd=0)), 2)
+        # Rewriting a dataset replaces it, and the old copy is dropped from the file on closing,
+        # so rerunning the same tests doesn't make the file grow.
+        size = os.path.getsize(file_name)
+        for i in range(3):
+            store.write('StarXStarShear', self.results[:2], visit=1228, ccd=3)
+            store.close()
+            store = stile.ResultStore(file_name)
+            numpy.testing.assert_equal(store.read('StarXStarShear', ccd=3, visit=1228),
+                                       self.results[:2])
+            self.assertEqual(len(store.keys()), 6)
+        self.assertLessEqual(os.path.getsize(file_name), size)
+        with zipfile.ZipFile(file_name) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 6)
+        # The archive is an ordinary .npz file.
+        npz = numpy.load(file_name)
+        numpy.testing.assert_equal(npz['StarXStarShear/ccd=1/visit=1228'], self.results[1:])
+        npz.close()
+        self.assertRaises(KeyError, store.read, 'StarXStarShear', visit=1228, ccd=5)
+        self.assertRaises(ValueError, store.write, 'Stats', self.results, patch='1/2')
+        self.assertRaises(TypeError, store.write, 'Stats', numpy.array([None]))
+        store.close()
+        self.assertRaises(ValueError, stile.ResultStore, file_name, backend='csv')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import numpy
+import time
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestScatterPlot(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(31415)
+        self.n = 1000000
+        fields = ['psf_g1', 'g1', 'g1_err']
+        self.array = numpy.zeros(self.n, dtype=[(f, float) for f in fields])
+        self.array['psf_g1'] = 0.05*numpy.random.randn(self.n)
+        self.array['g1'] = 1.1*self.array['psf_g1'] + 0.01*numpy.random.randn(self.n)
+        self.array['g1_err'] = 0.01
+
+    def test_rasterize(self):
+        """Test the density image and trend line used for large scatter plots."""
+        x = self.array['psf_g1']
+        y = self.array['g1']
+        z = numpy.abs(x)
+        image = stile.sys_tests.BaseScatterPlotSysTest._rasterize(x, y, None, (-0.1, 0.1),
+                                                                  (-0.1, 0.1), 20)
+        inside = (numpy.abs(x) <= 0.1) & (numpy.abs(y) <= 0.1)
+        numpy.testing.assert_equal(numpy.sum(image), numpy.sum(inside))
+        numpy.testing.assert_equal(image.shape, (20, 20))
+        # Images are indexed [y, x]: x increases to the right along a row.
+        mask = (x >= 0.09) & (x < 0.1) & (y >= 0.09) & (y < 0.1)
+        numpy.testing.assert_equal(image[19, 19], numpy.sum(mask))
+        mean_z = stile.sys_tests.BaseScatterPlotSysTest._rasterize(x, y, z, (-0.1, 0.1),
+                                                                   (-0.1, 0.1), 20)
+        numpy.testing.assert_allclose(mean_z[19, 19], numpy.mean(z[mask]))
+        self.assertTrue(numpy.ma.is_masked(mean_z[0, 19]))
+        # The trend line has the median y in each x bin.
+        centers, median, median_err = stile.sys_tests.BaseScatterPlotSysTest._binnedMedian(
+            x, y, (-0.1, 0.1), (-0.2, 0.2), 10)
+        numpy.testing.assert_allclose(centers, numpy.linspace(-0.09, 0.09, 10), atol=1.E-12)
+        for i, center in enumerate(centers):
+            mask = numpy.abs(x-center) < 0.01
+            # The medians come from a histogram with 1000 bins across the y range.
+            numpy.testing.assert_allclose(median[i], numpy.median(y[mask]), atol=4.E-4)
+        centers, median, median_err = stile.sys_tests.BaseScatterPlotSysTest._binnedMedian(
+            x, y, (-0.1, 0.1), (0., 0.2), 10)
+        self.assertTrue(numpy.all(numpy.isnan(median[:4])))
+        numpy.testing.assert_array_less(median_err, 1.E-3)
+
+        sys_test = stile.ScatterPlotSysTest('ResidualVsPSFG1')
+        start = time.time()
+        fig = sys_test(self.array)
+        elapsed = time.time()-start
+        self.assertTrue(hasattr(fig, 'savefig'))
+        # A rasterized plot has a single image instead of one artist per point.
+        self.assertEqual(len(fig.axes[0].images), 1)
+        self.assertLess(elapsed, 5.)
+        fig = sys_test(self.array[:1000])
+        self.assertEqual(len(fig.axes[0].images), 0)
+        fig = sys_test(self.array[:1000], rasterize=True)
+        self.assertEqual(len(fig.axes[0].images), 1)
+
+if __name__ == '__main__':
+    unittest.main()
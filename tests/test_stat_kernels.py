@@ -0,0 +1,121 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+from stile import stat_kernels
+
+
+def biweight_location(x, c=6.):
+    """A direct, single-group implementation of the biweight location for comparison."""
+    median = numpy.median(x)
+    mad = numpy.median(numpy.abs(x-median))
+    u = (x-median)/(c*mad)
+    w = numpy.where(numpy.abs(u) < 1, (1-u*u)**2, 0.)
+    return median+numpy.sum((x-median)*w)/numpy.sum(w)
+
+
+def biweight_scale(x, c=9.):
+    """A direct, single-group implementation of the biweight scale for comparison."""
+    median = numpy.median(x)
+    mad = numpy.median(numpy.abs(x-median))
+    u = (x-median)/(c*mad)
+    inside = numpy.abs(u) < 1
+    d = x-median
+    return (numpy.sqrt(len(x)*numpy.sum((d*d*(1-u*u)**4)[inside])) /
+            numpy.abs(numpy.sum(((1-u*u)*(1-5*u*u))[inside])))
+
+
+def sigma_clipped_mean(x, n_sigma=3.):
+    """A direct, single-group implementation of the sigma-clipped mean for comparison."""
+    keep = numpy.ones(len(x), dtype=bool)
+    while True:
+        mean = numpy.mean(x[keep])
+        std = numpy.std(x[keep])
+        new_keep = numpy.abs(x-mean) <= n_sigma*std
+        if numpy.all(new_keep == keep):
+            return mean, std, numpy.sum(keep)
+        keep = new_keep
+
+
+class TestStatKernels(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(271828)
+        self.x = numpy.concatenate([numpy.random.randn(3000), [50., 60., -40., 80.]])
+        self.ccd = numpy.random.randint(0, 4, len(self.x))
+        self.w = numpy.random.rand(len(self.x))
+        self.grouped = stile.GroupBy(self.ccd)
+        self.masks = [self.ccd == key for key in self.grouped.keys]
+
+    def test_robust(self):
+        """Test the sigma-clipping and biweight kernels against single-group versions."""
+        mean, std, n_kept = stat_kernels.SigmaClippedMean(self.grouped, self.x)
+        expected = numpy.array([sigma_clipped_mean(self.x[m]) for m in self.masks])
+        numpy.testing.assert_allclose(mean, expected[:, 0])
+        numpy.testing.assert_allclose(std, expected[:, 1])
+        numpy.testing.assert_equal(n_kept, expected[:, 2])
+        # Outliers are clipped from every group.
+        numpy.testing.assert_array_less(numpy.abs(mean), 0.2)
+        numpy.testing.assert_allclose(stat_kernels.BiweightLocation(self.grouped, self.x),
+                                      [biweight_location(self.x[m]) for m in self.masks])
+        numpy.testing.assert_allclose(stat_kernels.BiweightScale(self.grouped, self.x),
+                                      [biweight_scale(self.x[m]) for m in self.masks])
+        # Iterating the location converges to a fixed point.
+        location = stat_kernels.BiweightLocation(self.grouped, self.x, max_iter=50)
+        numpy.testing.assert_allclose(location,
+            stat_kernels.BiweightLocation(self.grouped, self.x, max_iter=51), atol=1.E-7)
+        # A single group can be given as None.
+        numpy.testing.assert_allclose(stat_kernels.BiweightLocation(None, self.x),
+                                      [biweight_location(self.x)])
+
+    def test_WeightedPercentiles(self):
+        """Test the grouped weighted percentiles."""
+        # Integer weights are equivalent to repeating the points.
+        x = numpy.array([1., 2., 3., 4., 10.])
+        w = numpy.array([1, 0, 2, 1, 0])
+        numpy.testing.assert_allclose(
+            stat_kernels.WeightedPercentiles(None, x, w, [0., 50., 100.]),
+            stat_kernels.WeightedPercentiles(None, [1., 3., 3., 4.], None, [0., 50., 100.]))
+        numpy.testing.assert_allclose(
+            stat_kernels.WeightedPercentiles(None, [1., 3., 3., 4.], None, [0., 50., 100.]),
+            [[1., 3., 4.]])
+        # With many points and uniform weights, they approach numpy.percentile.
+        result = stat_kernels.WeightedPercentiles(self.grouped, self.x, None, [10., 50., 90.])
+        numpy.testing.assert_allclose(result, [numpy.percentile(self.x[m], [10., 50., 90.])
+                                               for m in self.masks], atol=0.01)
+        # Weighted medians of the groups bracket half the weight on each side.
+        result = stat_kernels.WeightedPercentiles(self.grouped, self.x, self.w, [50.])[:, 0]
+        for m, median in zip(self.masks, result):
+            below = numpy.sum(self.w[m][self.x[m] < median])/numpy.sum(self.w[m])
+            self.assertLess(abs(below-0.5), 0.01)
+        self.assertRaises(ValueError, stat_kernels.WeightedPercentiles, None, x, -w, [50.])
+
+    def test_groupStats(self):
+        """Test the StatSysTest interface to the kernels."""
+        catalog = numpy.zeros(len(self.x), dtype=[('CCD', int), ('g1', float), ('w', float)])
+        catalog['CCD'] = self.ccd
+        catalog['g1'] = self.x
+        catalog['w'] = self.w
+        result = stile.StatSysTest(field='g1').groupStats(catalog, group_field='CCD',
+                                                          weight_field='w')
+        numpy.testing.assert_equal(result['group'], [0, 1, 2, 3])
+        numpy.testing.assert_equal(result['N'], [numpy.sum(m) for m in self.masks])
+        numpy.testing.assert_allclose(result['mean'], [numpy.average(self.x[m], weights=self.w[m])
+                                                       for m in self.masks])
+        numpy.testing.assert_equal(result['values'].shape, (4, 5))
+        numpy.testing.assert_allclose(result['biweight_location'],
+                                      [biweight_location(self.x[m]) for m in self.masks])
+        single = stile.StatSysTest().groupStats(catalog, field='g1')
+        numpy.testing.assert_equal(single['N'], [len(self.x)])
+        catalog['g1'][0] = numpy.nan
+        self.assertRaises(RuntimeError, stile.StatSysTest().groupStats, catalog, field='g1')
+        result = stile.StatSysTest().groupStats(catalog, field='g1', group_field='CCD',
+                                                ignore_bad=True)
+        numpy.testing.assert_equal(numpy.sum(result['N']), len(self.x)-1)
+        self.assertRaises(RuntimeError, stile.StatSysTest().groupStats, catalog, field='g2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -120,5 +120,147 @@ class TestStats(unittest.TestCase):
         numpy.testing.assert_almost_equal((test_len-1.), res3.mean, decimal=7)
         numpy.testing.assert_almost_equal(0.5*(test_len-1.), res4.mean, decimal=7)
 
+    def test_statsystest_stream(self):
+        """Test the streaming StatSysTest mode and the sketches it relies on."""
+        numpy.random.seed(self.rand_seed)
+        test_vec = self.gaussian_sigma*numpy.random.randn(self.n_points_test) + self.gaussian_mean
+        chunks = numpy.array_split(test_vec, 13)
+
+        test_obj = stile.StatSysTest()
+        result = test_obj.streamStats(iter(chunks))
+        self.check_results(result)
+        numpy.testing.assert_almost_equal(result.mean, numpy.mean(test_vec), decimal=10)
+        numpy.testing.assert_almost_equal(result.variance/numpy.var(test_vec), 1., decimal=10)
+        numpy.testing.assert_equal(result.min, numpy.min(test_vec))
+        numpy.testing.assert_equal(result.max, numpy.max(test_vec))
+        # Quantiles must be within the advertised rank error.
+        sorted_vec = numpy.sort(test_vec)
+        for perc, val in zip(result.percentiles, result.values):
+            rank = numpy.searchsorted(sorted_vec, val)/float(len(test_vec))
+            self.assertLessEqual(abs(rank-0.01*perc), result.rank_error+1./len(test_vec))
+        self.assertLess(result.rank_error, 0.01)
+        numpy.testing.assert_almost_equal(
+            result.mad/numpy.median(numpy.abs(test_vec-numpy.median(test_vec))), 1., decimal=2)
+
+        # Moments and sketches built from separate pieces should merge into the same answer.
+        moments = [stile.stile_utils.RunningMoments() for i in range(2)]
+        sketches = [stile.stile_utils.QuantileSketch(size=1024) for i in range(2)]
+        for i, chunk in enumerate(chunks):
+            moments[i%2].update(chunk)
+            sketches[i%2].update(chunk)
+        merged = moments[0].merge(moments[1])
+        import scipy.stats
+        numpy.testing.assert_almost_equal(merged.skew, scipy.stats.skew(test_vec), decimal=8)
+        numpy.testing.assert_almost_equal(merged.kurtosis, scipy.stats.kurtosis(test_vec),
+                                          decimal=8)
+        merged_sketch = sketches[0].merge(sketches[1])
+        numpy.testing.assert_equal(merged_sketch.N, len(test_vec))
+        rank = numpy.searchsorted(sorted_vec, merged_sketch.quantile(0.5))/float(len(test_vec))
+        self.assertLessEqual(abs(rank-0.5), merged_sketch.rank_error+1./len(test_vec))
+
+        # Catalog chunks and bad-value handling work as for the ordinary call.
+        schema = [("item1", float), ("item2", float)]
+        cat = numpy.zeros(10, dtype=numpy.dtype(schema))
+        cat["item1"] = numpy.arange(10)
+        cat["item2"][3] = numpy.nan
+        res = test_obj.streamStats([cat[:5], cat[5:]], field='item1')
+        numpy.testing.assert_equal(res.N, 10)
+        numpy.testing.assert_almost_equal(res.mean, 4.5)
+        self.assertRaises(RuntimeError, test_obj.streamStats, [cat], field='item2')
+        res = test_obj.streamStats([cat], field='item2', ignore_bad=True)
+        numpy.testing.assert_equal(res.N, 9)
+        self.assertRaises(RuntimeError, test_obj.streamStats, [])
+        # Chunks with no good values (all NaN, or empty) are skipped rather than ending the stream,
+        # and only a stream with no good values at all is an error.
+        bad_chunks = [numpy.arange(10.), numpy.array([numpy.nan, numpy.nan]), numpy.array([]),
+                      numpy.arange(5.)]
+        res = test_obj.streamStats(bad_chunks, ignore_bad=True)
+        numpy.testing.assert_equal(res.N, 15)
+        numpy.testing.assert_almost_equal(res.mean, 55./15.)
+        res = test_obj.streamStats([numpy.arange(10.), numpy.array([])])
+        numpy.testing.assert_equal(res.N, 10)
+        self.assertRaises(RuntimeError, test_obj.streamStats, bad_chunks)
+        self.assertRaises(RuntimeError, test_obj.streamStats,
+                          [numpy.array([numpy.nan]), numpy.array([])], ignore_bad=True)
+
+    def test_statsystest_multifield(self):
+        """Test that the batched multi-field statistics agree with single-field calls."""
+        numpy.random.seed(self.rand_seed)
+        n = 1001
+        schema = [("item1", float), ("item2", numpy.float32), ("item3", int)]
+        cat = numpy.zeros(n, dtype=numpy.dtype(schema))
+        cat["item1"] = self.gaussian_sigma*numpy.random.randn(n) + self.gaussian_mean
+        cat["item2"] = numpy.random.rand(n)
+        cat["item3"] = numpy.arange(n) % 7
+
+        test_obj = stile.StatSysTest()
+        table = test_obj.multiFieldStats(cat)
+        numpy.testing.assert_equal(table['field'], ["item1", "item2", "item3"])
+        for row in table:
+            res = test_obj(cat, field=row['field'])
+            numpy.testing.assert_equal(row['N'], res.N)
+            for name in ['min', 'max', 'median', 'mad', 'mean', 'stddev', 'variance']:
+                # Loose tolerance, since single-field calls on the float32 column accumulate in
+                # single precision.
+                numpy.testing.assert_allclose(row[name], getattr(res, name), rtol=1.E-6,
+                                              atol=1.E-10)
+            numpy.testing.assert_allclose(row['values'], res.values, rtol=1.E-6)
+            if 'skew' in res.simple_stats:
+                numpy.testing.assert_allclose(row['skew'], res.skew, rtol=1.E-5, atol=1.E-6)
+                numpy.testing.assert_allclose(row['kurtosis'], res.kurtosis, rtol=1.E-5)
+
+        # Field selection, percentiles, and bad values.
+        cat["item1"][5] = numpy.inf
+        self.assertRaises(RuntimeError, test_obj.multiFieldStats, cat)
+        table = test_obj.multiFieldStats(cat, fields=["item1"], percentiles=[50.],
+                                         ignore_bad=True)
+        numpy.testing.assert_equal(len(table), 1)
+        numpy.testing.assert_equal(table['N'][0], n-1)
+        numpy.testing.assert_allclose(table['values'][0], [table['median'][0]])
+        self.assertRaises(RuntimeError, test_obj.multiFieldStats, cat, fields=["item4"])
+        self.assertRaises(RuntimeError, test_obj.multiFieldStats, numpy.arange(10.))
+
+    def test_stats_merge(self):
+        """Test merging, serializing and tree-reducing Stats objects that keep their state."""
+        import os
+        import tempfile
+        numpy.random.seed(self.rand_seed)
+        test_vec = self.gaussian_sigma*numpy.random.randn(self.n_points_test) + self.gaussian_mean
+        pieces = numpy.array_split(test_vec, 9)
+
+        test_obj = stile.StatSysTest()
+        per_piece = [test_obj(piece, keep_state=True) for piece in pieces]
+        self.assertIsNone(test_obj(pieces[0]).moments)
+        self.assertRaises(RuntimeError, test_obj(pieces[0]).merge, per_piece[0])
+        # Exact statistics are unchanged by keeping the state.
+        numpy.testing.assert_equal(per_piece[0].median, numpy.median(pieces[0]))
+
+        # Round-trip the states through files, as the HSC tasks do.
+        states = []
+        tmpdir = tempfile.mkdtemp()
+        for i, stats in enumerate(per_piece):
+            filename = os.path.join(tmpdir, 'stats%i.npz'%i)
+            numpy.savez(filename, **stats.getState())
+            states.append(dict(numpy.load(filename)))
+            os.remove(filename)
+        os.rmdir(tmpdir)
+
+        serial = stile.stile_utils.MergeStats(per_piece)
+        tree = stile.stile_utils.TreeReduceStats(states, processes=2)
+        sorted_vec = numpy.sort(test_vec)
+        for result in [serial, tree]:
+            self.check_results(result)
+            numpy.testing.assert_almost_equal(result.mean, numpy.mean(test_vec), decimal=10)
+            numpy.testing.assert_almost_equal(result.variance/numpy.var(test_vec), 1., decimal=10)
+            numpy.testing.assert_equal(result.min, numpy.min(test_vec))
+            numpy.testing.assert_equal(result.max, numpy.max(test_vec))
+            for perc, val in zip(result.percentiles, result.values):
+                rank = numpy.searchsorted(sorted_vec, val)/float(len(test_vec))
+                self.assertLessEqual(abs(rank-0.01*perc), result.rank_error+1./len(test_vec))
+            # Printing includes the accuracy of the order statistics.
+            self.assertIn('rank error', str(result))
+        numpy.testing.assert_almost_equal(serial.skew, tree.skew, decimal=10)
+        self.assertRaises(RuntimeError, stile.stile_utils.MergeStats, [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+import numpy
+import unittest
+try:
+    import stile
+except ImportError:
+    import sys
+    sys.path.append('..')
+    import stile
+
+
+class TestWhiskerPlot(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(9876)
+        self.n = 10000
+        fields = ['x', 'y', 'g1', 'g2', 'sigma', 'w']
+        self.array = numpy.zeros(self.n, dtype=[(f, float) for f in fields])
+        self.array['x'] = 200.*numpy.random.rand(self.n)
+        self.array['y'] = 100.*numpy.random.rand(self.n)
+        self.array['g1'] = 0.05 + 0.1*numpy.random.randn(self.n)
+        self.array['g2'] = -0.02 + 0.1*numpy.random.randn(self.n)
+        self.array['sigma'] = 2.+numpy.random.rand(self.n)
+        self.array['w'] = numpy.random.rand(self.n)
+
+    def test_gridAverage(self):
+        """Test the per-cell spin-2 averages against a direct calculation."""
+        a = self.array
+        cells = stile.sys_tests.BaseWhiskerPlotSysTest.gridAverage(
+            a['x'], a['y'], a['g1'], a['g2'], size=a['sigma'], weights=a['w'], cell_size=50.)
+        numpy.testing.assert_equal(len(cells), 8)
+        numpy.testing.assert_equal(numpy.sum(cells['N']), self.n)
+        for cell in cells:
+            mask = ((numpy.abs(a['x']-cell['x']) <= 25.) & (numpy.abs(a['y']-cell['y']) <= 25.))
+            numpy.testing.assert_equal(cell['N'], numpy.sum(mask))
+            # The components are averaged separately, not the whisker lengths and angles.
+            numpy.testing.assert_allclose(cell['g1'], numpy.average(a['g1'][mask],
+                                                                    weights=a['w'][mask]))
+            numpy.testing.assert_allclose(cell['g2'], numpy.average(a['g2'][mask],
+                                                                    weights=a['w'][mask]))
+            numpy.testing.assert_allclose(cell['size'], numpy.average(a['sigma'][mask],
+                                                                      weights=a['w'][mask]))
+        # The automatic cell size gives roughly the requested number of objects per cell.
+        cells = stile.sys_tests.BaseWhiskerPlotSysTest.gridAverage(
+            a['x'], a['y'], a['g1'], a['g2'], objects_per_cell=100)
+        self.assertTrue(80 <= len(cells) <= 120)
+        self.assertNotIn('size', cells.dtype.names)
+
+    def test_aggregate(self):
+        """Test that the aggregated whisker plots return the cell counts through getData()."""
+        sys_test = stile.WhiskerPlotSysTest('Star')
+        fig = sys_test(self.array, aggregate=True, cell_size=20.)
+        self.assertTrue(hasattr(fig, 'savefig'))
+        data = sys_test.getData()
+        numpy.testing.assert_equal(len(data), 50)
+        numpy.testing.assert_equal(numpy.sum(data['N']), self.n)
+        sys_test(self.array[:100])
+        numpy.testing.assert_equal(len(sys_test.getData()), 100)
+
+if __name__ == '__main__':
+    unittest.main()